@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import multiprocessing
+import os
+import socket
+import time
+from chord_node import ChordNode
+from chord_protocol import encode_message, recv_message
+from chord_ring_index import hash_key
+
+
+def run_node(bootstrap_port, replication, consistency, ports, bootstrap):
+    """Start one node on 127.0.0.1 with the memory storage engine and report its port."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if bootstrap:
+            node = ChordNode(bootstrap_node=None, port=bootstrap_port, replication_factor=replication, consistency_type=consistency,
+                             debugging=False, storage_engine="memory", ip="127.0.0.1")
+        else:
+            node = ChordNode(bootstrap_node={"ip": "127.0.0.1", "port": bootstrap_port}, debugging=False,
+                             storage_engine="memory", ip="127.0.0.1")
+        ports.put(node.port)
+        node.start_server()
+
+
+def ask_successor(port, reply_socket):
+    """Ask the node listening on port for its successor through an overlay request. Returns the successor's port or None."""
+    request = {
+        "type": "overlay",
+        "sender_ip": "127.0.0.1",
+        "sender_port": reply_socket.getsockname()[1],
+        "sender_id": 0,
+        "sender_temp_port": reply_socket.getsockname()[1],
+        "request_id": port
+    }
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=2) as sock:
+            sock.sendall(encode_message(request))
+        conn, _ = reply_socket.accept()
+        with conn:
+            response = recv_message(conn)
+        return response["next"]["port"] if response else None
+    except OSError:
+        return None
+
+
+def ring_converged(ports, reply_socket):
+    """Check that following the successor pointers visits every node once, in ring order."""
+    by_id = sorted(ports, key=lambda port: hash_key(f"127.0.0.1:{port}"))
+    for i, port in enumerate(by_id):
+        if ask_successor(port, reply_socket) != by_id[(i + 1) % len(by_id)]:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start many nodes at once and measure how long the ring takes to converge")
+    parser.add_argument("--nodes", type=int, default=50, help="Number of nodes, the bootstrap included (default: 50)")
+    parser.add_argument("--port", type=int, default=5000, help="Port of the bootstrap node (default: 5000)")
+    parser.add_argument("--replication", type=int, default=3, help="Replication factor (default: 3)")
+    parser.add_argument("--consistency", choices=["linearizability", "eventual", "craq"], default="linearizability")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for convergence (default: 120)")
+    args = parser.parse_args()
+
+    ports = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_node, args=(args.port, args.replication, args.consistency, ports, True), daemon=True)]
+    processes[0].start()
+    ports.get()  # The bootstrap node has to be listening before the others join through it
+
+    start_time = time.time()
+    for _ in range(args.nodes - 1):
+        process = multiprocessing.Process(target=run_node, args=(args.port, args.replication, args.consistency, ports, False), daemon=True)
+        process.start()
+        processes.append(process)
+    node_ports = [args.port] + [ports.get(timeout=args.timeout) for _ in range(args.nodes - 1)]
+    joined_time = time.time()
+    print(f"🟢 {args.nodes - 1} nodes joined concurrently in {joined_time - start_time:.2f} seconds")
+
+    reply_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    reply_socket.bind(("127.0.0.1", 0))
+    reply_socket.listen()
+    reply_socket.settimeout(5)
+    converged = False
+    while time.time() - start_time < args.timeout:
+        if ring_converged(node_ports, reply_socket):
+            converged = True
+            break
+        time.sleep(0.2)
+    if converged:
+        print(f"✅ Ring of {args.nodes} nodes converged {time.time() - start_time:.2f} seconds after the launch")
+    else:
+        print(f"❌ Ring did not converge within {args.timeout} seconds")
+
+    reply_socket.close()
+    for process in processes:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from run_experiments_bastion import trigger_signal
+from trace_report import percentile
+
+PHASES = ("insert", "query", "requests")
+SIGNAL_WAIT = "Waiting for signal"  # Printed by run_experiments.py whenever a node is ready for the next phase
+
+
+def wait_for_log(path, count, process, timeout):
+    """Wait until a node has printed SIGNAL_WAIT count times. Returns False if it exited or timeout passed first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if Path(path).read_text(errors="replace").count(SIGNAL_WAIT) >= count:
+            return True
+        if process.poll() is not None:
+            return False
+        time.sleep(0.1)
+    return False
+
+
+def stop_nodes(processes, timeout=5):
+    """Wait for the node processes to exit, killing those that do not."""
+    for process in processes:
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def summarize(node_results, phase):
+    """Pool the results of every node for a phase: overall throughput and latency percentiles in milliseconds.
+
+    The nodes start each phase together, so throughput is every operation over the time the slowest node took.
+    """
+    operations = sum(result[phase]["operations"] for result in node_results)
+    seconds = max(result[phase]["seconds"] for result in node_results)
+    latencies = sorted(latency for result in node_results for latency in result[phase]["latencies"])
+    return {
+        "operations": operations,
+        "completed": len(latencies),
+        "seconds": seconds,
+        "throughput": operations / seconds if seconds > 0 else 0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "p999_ms": percentile(latencies, 0.999) * 1000
+    }
+
+
+def run_configuration(args, node_options, consistency, replication):
+    """Launch the nodes for one consistency mode and replication factor on loopback and run the three phases.
+
+    Each node is a run_experiments.py process replaying its own inserts/, queries/ and requests/ files.
+    Returns the pooled results of every phase, or a dict with an error if a node failed.
+    """
+    processes = []
+    logs = []
+    results = []
+    finished = False
+    try:
+        for n in range(args.nodes):
+            Path(f"./node0{n}").mkdir(parents=True, exist_ok=True)
+            log_path = f"./node0{n}/node_0{n}_{consistency}_{replication}.log"
+            Path(log_path).with_suffix(".json").unlink(missing_ok=True)  # Never read the results of an earlier run
+            command = [sys.executable, "-u", "run_experiments.py", "--node_number", str(n), "--consistency", consistency,
+                       "--replication", str(replication), "--ip", "127.0.0.1", "--bootstrap_ip", "127.0.0.1",
+                       "--bootstrap_port", str(args.bootstrap_port), "--signal_port", str(args.signal_port + n),
+                       "--storage", args.storage] + node_options
+            with open(log_path, "w") as log:
+                processes.append(subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT))
+            logs.append(log_path)
+            # Nodes join one at a time, each once the previous one is in the ring
+            if not wait_for_log(log_path, 1, processes[-1], args.timeout):
+                return {"error": f"node {n} did not start, see {log_path}"}
+        time.sleep(args.settle)  # Let stabilization and gossip spread the final ring
+
+        for count, phase in enumerate(PHASES, 2):
+            for n in range(args.nodes):
+                trigger_signal("127.0.0.1", args.signal_port + n)
+            for n, (process, log_path) in enumerate(zip(processes, logs)):
+                if not wait_for_log(log_path, count, process, args.timeout):
+                    return {"error": f"node {n} did not finish the {phase} phase, see {log_path}"}
+
+        finished = True
+        for log_path in logs:
+            results.append(json.loads(Path(log_path).with_suffix(".json").read_text()))
+        return {phase: summarize(results, phase) for phase in PHASES}
+    finally:
+        if finished:
+            # Depart in reverse order of arrival, each node once the one after it has left
+            for n in reversed(range(len(processes))):
+                trigger_signal("127.0.0.1", args.signal_port + n)
+                stop_nodes([processes[n]], timeout=args.timeout)
+        else:
+            # The nodes would take a departure signal for the next phase
+            for process in processes:
+                process.kill()
+            stop_nodes(processes)
+
+
+def regressions(runs, baseline, tolerance):
+    """List the phases whose throughput fell or whose p99 latency rose by more than tolerance against baseline."""
+    previous = {(run["consistency"], run["replication"]): run for run in baseline["runs"]}
+    found = []
+    for run in runs:
+        before = previous.get((run["consistency"], run["replication"]))
+        if before is None or "error" in run or "error" in before:
+            continue
+        for phase in PHASES:
+            now, then = run[phase], before[phase]
+            name = f"{run['consistency']} k={run['replication']} {phase}"
+            if now["throughput"] < then["throughput"] * (1 - tolerance):
+                found.append(f"{name}: throughput {then['throughput']:.1f} → {now['throughput']:.1f} ops/sec")
+            if now["p99_ms"] > then["p99_ms"] * (1 + tolerance):
+                found.append(f"{name}: p99 {then['p99_ms']:.2f} → {now['p99_ms']:.2f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark a ring of local node processes on 127.0.0.1 for every consistency mode and replication factor",
+        epilog="Other options (e.g. --concurrency, --server, --wire, --virtual_nodes) are passed on to run_experiments.py")
+    parser.add_argument("--nodes", type=int, default=10, help="Node processes to launch, at most one per insert file (default: 10)")
+    parser.add_argument("--consistency", default="linearizability,eventual,craq", help="Comma-separated consistency modes (default: all three)")
+    parser.add_argument("--replication", default="1,3,5", help="Comma-separated replication factors (default: 1,3,5)")
+    parser.add_argument("--storage", choices=["memory", "mongodb"], default="memory",
+                        help="Storage engine of the nodes: in-process, or a local MongoDB (default: memory)")
+    parser.add_argument("--bootstrap_port", type=int, default=5000, help="Port of node 0 (default: 5000)")
+    parser.add_argument("--signal_port", type=int, default=6000, help="Signal port of node 0; node n uses this plus n (default: 6000)")
+    parser.add_argument("--settle", type=float, default=2.0, help="Seconds to wait after the last join before the first phase (default: 2)")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds a node may take to start or to finish a phase (default: 60)")
+    parser.add_argument("--output", default="benchmark_local.json", help="File the results are written to (default: benchmark_local.json)")
+    parser.add_argument("--baseline", help="Results of an earlier run: exit with status 1 if any phase regressed against them")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change in throughput or p99 counted as a regression (default: 0.2)")
+    args, node_options = parser.parse_known_args()
+
+    available = len(list(Path("./inserts").glob("insert_*.txt")))
+    if not 1 <= args.nodes <= available:
+        print(f"❌ --nodes must be between 1 and {available}, the number of insert files")
+        sys.exit(1)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {"commit": commit, "nodes": args.nodes, "storage": args.storage, "node_options": node_options, "runs": []}
+    for consistency in args.consistency.split(","):
+        for replication in [int(k) for k in args.replication.split(",")]:
+            print(f"🚀 {args.nodes} nodes, consistency={consistency} k={replication}")
+            start_time = time.time()
+            run = {"consistency": consistency, "replication": replication,
+                   **run_configuration(args, node_options, consistency, replication)}
+            report["runs"].append(run)
+            if "error" in run:
+                print(f"❌ {run['error']}")
+                continue
+            for phase in PHASES:
+                result = run[phase]
+                print(f"  [{phase}] {result['completed']}/{result['operations']} ops, {result['throughput']:.1f} ops/sec, "
+                      f"p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, p999 {result['p999_ms']:.2f} ms")
+            print(f"  finished in {time.time() - start_time:.1f} seconds")
+
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"📝 Results written to {args.output}")
+
+    failed = [run for run in report["runs"] if "error" in run]
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        setup = ("nodes", "storage", "node_options")
+        if any(baseline[field] != report[field] for field in setup):
+            print(f"❌ {args.baseline} was run with a different setup: " + ", ".join(f"{field}={baseline[field]}" for field in setup))
+            sys.exit(1)
+        found = regressions(report["runs"], baseline, args.tolerance)
+        for regression in found:
+            print(f"⚠️ Regression: {regression}")
+        if not found:
+            print(f"✅ No regression beyond {args.tolerance:.0%} against {args.baseline}")
+        failed += found
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from chord_protocol import FRAME_HEADER, WIRE_FORMATS, decode_message, encode_message
+from chord_ring_index import hash_key
+
+
+def node(port):
+    """Build the address of a node on port, as nodes put it in messages."""
+    return {"ip": "10.0.0.1", "port": port, "node_id": hash_key(f"10.0.0.1:{port}")}
+
+
+def realistic_messages(batch_size):
+    """Build the messages that dominate the traffic of a run: single operations, their responses and batches."""
+    gossip = [{**node(5000 + i), "version": 3, "alive": True} for i in range(5)]
+    sender = {"sender_ip": "10.0.0.2", "sender_port": 5001, "sender_id": hash_key("10.0.0.2:5001"),
+              "sender_temp_port": 41234, "request_id": 1783, "target_id": hash_key("10.0.0.1:5003"), "gossip": gossip}
+    owner_range = {**node(5003), "end": hash_key("10.0.0.1:5004")}
+    query = {"type": "query", "key": "Like a Rolling Stone", "key_hash": hash_key("Like a Rolling Stone"),
+             "times_copied": 0, "hops": 1, **sender}
+    insertion = {"type": "insertion", "key": "Like a Rolling Stone", "key_hash": hash_key("Like a Rolling Stone"),
+                 "value": "10.0.0.2:5001", "times_copied": 1, "version": [5821, str(hash_key("10.0.0.1:5003"))],
+                 "owner_range": owner_range, **sender}
+    response = {"type": "query_response", "sender_ip": "10.0.0.1", "sender_port": 5003,
+                "sender_node_id": hash_key("10.0.0.1:5003"), "key": "Like a Rolling Stone",
+                "key_hash": hash_key("Like a Rolling Stone"), "value": "10.0.0.2:5001", "hops": 1, "request_id": 1783,
+                "owner_range": owner_range, "gossip": gossip}
+    items = [{"key": f"song {i}", "key_hash": hash_key(f"song {i}"), "value": f"10.0.0.{i % 10}:5000"} for i in range(batch_size)]
+    bulk = {"type": "bulk_insertion", "key_hash": items[0]["key_hash"], "items": items, "times_copied": 0, "hops": 0,
+            **sender}
+    documents = [{"key": f"song {i}", "key_hash": f"{hash_key(f'song {i}')}", "value": f"10.0.0.{i % 10}:5000",
+                  "version": [i, str(hash_key("10.0.0.1:5003"))]} for i in range(batch_size)]
+    chunk = {"type": "query_all_chunk", "source_node": node(5003), "next": node(5004), "sequence": 3, "last": False,
+             "key_value_list": documents, "request_id": 1783}
+    return {"query": query, "insertion": insertion, "query_response": response, "bulk_insertion": bulk,
+            "query_all_chunk": chunk}
+
+
+def measure(message, wire_format, seconds):
+    """Encode and decode message repeatedly for about seconds each. Returns the frame size and microseconds per call."""
+    frame = encode_message(message, wire_format)
+    count = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < seconds:
+        encode_message(message, wire_format)
+        count += 1
+    encode_time = (time.perf_counter() - start_time) / count * 1e6
+
+    payload = memoryview(frame)[FRAME_HEADER.size:]
+    version = WIRE_FORMATS[wire_format]
+    assert decode_message(payload, version) == decode_message(encode_message(message, "json")[FRAME_HEADER.size:], WIRE_FORMATS["json"])
+    count = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < seconds:
+        decode_message(payload, version)
+        count += 1
+    decode_time = (time.perf_counter() - start_time) / count * 1e6
+    return len(frame), encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the binary and JSON wire formats on realistic messages")
+    parser.add_argument("--batch_size", type=int, default=500, help="Items per bulk request and query_all chunk (default: 500)")
+    parser.add_argument("--seconds", type=float, default=0.5, help="Seconds spent encoding and decoding each message (default: 0.5)")
+    args = parser.parse_args()
+
+    for name, message in realistic_messages(args.batch_size).items():
+        results = {wire_format: measure(message, wire_format, args.seconds) for wire_format in ("json", "binary")}
+        json_size = results["json"][0]
+        for wire_format, (size, encode_time, decode_time) in results.items():
+            print(f"[{name}] {wire_format}: {size} bytes ({size / json_size:.0%} of JSON), "
+                  f"encode {encode_time:.1f} µs, decode {decode_time:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import os
+import tempfile
+import time
+from chord_ring_index import hash_key
+from chord_storage import open_storage_engine
+
+
+def read_keys(pattern, command):
+    """Read the keys of every command line in the files matching pattern."""
+    keys = []
+    for file_path in sorted(glob.glob(pattern)):
+        with open(file_path, "r") as f:
+            for line in f:
+                parts = [p.strip() for p in line.split(',')]
+                if len(parts) > 1 and parts[0].lower() == command:
+                    keys.append(parts[1])
+    return keys
+
+
+def run_engine(storage, insert_keys, query_keys, rounds):
+    """Replay the inserts and queries against an engine the way a node does: a read then a write per insert, a read per query."""
+    storage.clear()
+    start_time = time.time()
+    version = 0
+    for _ in range(rounds):
+        for key in insert_keys:
+            key_hash = hash_key(key)
+            document = storage.get(key_hash)
+            version += 1
+            value = document["value"] + key if document else key
+            storage.put({"key": key, "key_hash": f"{key_hash}", "value": value, "version": [version, "benchmark"]})
+    insert_duration = time.time() - start_time
+
+    start_time = time.time()
+    for _ in range(rounds):
+        for key in query_keys:
+            storage.get(hash_key(key))
+    query_duration = time.time() - start_time
+    storage.clear()
+    return insert_duration, query_duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the storage engines on the bundled insert and query files")
+    parser.add_argument("--engines", nargs="+", choices=["mongodb", "memory", "memory-aof"], default=["mongodb", "memory", "memory-aof"])
+    parser.add_argument("--inserts", default="./inserts/insert_*.txt", help="Glob of insert files")
+    parser.add_argument("--queries", default="./queries/query_*.txt", help="Glob of query files")
+    parser.add_argument("--rounds", type=int, default=10, help="Times every file is replayed (default: 10)")
+    parser.add_argument("--write_behind", type=float, help="Wrap every engine in a write-behind buffer flushed this often (seconds)")
+    args = parser.parse_args()
+
+    insert_keys = read_keys(args.inserts, "insert")
+    query_keys = read_keys(args.queries, "query")
+    print(f"📂 {len(insert_keys)} inserts and {len(query_keys)} queries, replayed {args.rounds} times")
+
+    for name in args.engines:
+        aof_path = None
+        if name == "memory-aof":
+            aof_path = os.path.join(tempfile.mkdtemp(), "benchmark.aof")
+        try:
+            storage = open_storage_engine("memory" if name.startswith("memory") else name, "collection_benchmark", aof_path,
+                                          args.write_behind)
+            insert_duration, query_duration = run_engine(storage, insert_keys, query_keys, args.rounds)
+            storage.close()
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            continue
+        inserts = len(insert_keys) * args.rounds
+        queries = len(query_keys) * args.rounds
+        print(f"[{name}] inserts: {inserts / insert_duration if insert_duration > 0 else 0:.0f} ops/sec, "
+              f"queries: {queries / query_duration if query_duration > 0 else 0:.0f} ops/sec")
+        if aof_path:
+            os.remove(aof_path)
+            os.rmdir(os.path.dirname(aof_path))
+
+
+if __name__ == "__main__":
+    main()
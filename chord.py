@@ -1,7 +1,8 @@
 import argparse
+import json
 import threading
-from pymongo import MongoClient
 import sys
+from chord_metrics import quantile, to_prometheus
 from chord_node import ChordNode
 
 def process_command(line, node):
@@ -28,6 +29,16 @@ def process_command(line, node):
         process_delete(parts, node)
     elif cmd == "query":
         process_query(parts, node)
+    elif cmd == "cache":
+        print_cache(node)
+    elif cmd == "overlay":
+        print_overlay(parts, node)
+    elif cmd == "load":
+        print_load(node)
+    elif cmd == "stats":
+        print_stats(parts, node)
+    elif cmd == "traces":
+        save_traces(parts, node)
     else:
         print(f"❌ Invalid command: {cmd}")
     return False
@@ -41,6 +52,11 @@ def print_help():
     print("  insert, <song> [, <value>] - Store key-value pair in DHT")
     print("  delete, <song> - Remove entry from DHT")
     print("  query, <song> - Retrieve value from DHT")
+    print("  cache - Show the read cache counters")
+    print("  overlay [, verify] - List the nodes of the ring (verify: walk the ring instead of the gossiped view)")
+    print("  load - Show the keys each physical node owns and stores")
+    print("  stats [, prometheus] [, <ip>, <port>] - Show the metrics of a node (default: this one), optionally as Prometheus text")
+    print("  traces [, <file>] - Save the traces of sampled operations for trace_report.py (default: traces.jsonl)")
     print("  exit - Leave the network and shutdown")
 
 def print_status(node):
@@ -49,10 +65,97 @@ def print_status(node):
     print(f"• Self: {node.node_id//2**155}")
     print(f"• Successor: {node.successor['node_id']//2**155}")
     print(f"• Predecessor: {node.predecessor['node_id']//2**155}")
+    fingers = sorted({finger["node_id"] for finger in node.finger_table if finger is not None})
+    print(f"• Fingers: {[finger_id//2**155 for finger_id in fingers]}")
+    stats = node.cache.stats()
+    print(f"• Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.2%})")
     
     print("\n💾 Local Storage:")
-    for entry in node.collection.find():
-        print(f"  {entry['_id']}: {entry.get('value', '')}")
+    for entry in node.storage.scan():
+        print(f"  {entry['key']}: {entry.get('value', '')}")
+
+def print_overlay(parts, node):
+    """Display the nodes of the ring, optionally verified by walking it."""
+    verify = len(parts) > 1 and parts[1].lower() == "verify"
+    nodes = node.overlay(verify=verify)
+    if nodes is None:
+        print("❌ The ring walk did not complete")
+        return
+    print(f"\n🌐 Overlay ({len(nodes)} nodes):")
+    for member in nodes:
+        print(f"  {member['node_id']//2**155} - {member['ip']}:{member['port']}")
+
+def print_load(node):
+    """Display the key distribution across the physical nodes of the ring."""
+    report = node.load_report()
+    if not report:
+        print("❌ No node reported its load")
+        return
+    print(f"\n⚖️ Load ({len(report)} physical nodes):")
+    for entry in sorted(report, key=lambda entry: entry["owned"], reverse=True):
+        print(f"  {entry['ip']}:{entry['port']} - {entry['owned']} owned, {entry['keys']} stored ({entry['expected']} in its chains), "
+              f"{entry['ring_share']:.1%} of the ring over {entry['virtual_nodes']} virtual nodes")
+    owned = [entry["owned"] for entry in report]
+    mean = sum(owned) / len(owned)
+    if mean:
+        print(f"• Skew: busiest node owns {max(owned) / mean:.2f}x the mean, idlest {min(owned) / mean:.2f}x")
+
+def print_stats(parts, node):
+    """Display the request counters, latency histograms and gauges of a node."""
+    args = parts[1:]
+    prometheus = bool(args) and args[0].lower() == "prometheus"
+    if prometheus:
+        args = args[1:]
+    target = {"ip": args[0], "port": int(args[1]), "node_id": None} if len(args) > 1 else None
+    stats = node.stats(target)
+    if stats is None:
+        print(f"⏳ Timeout: No stats from {args[0]}:{args[1]}")
+        return
+    if prometheus:
+        print(to_prometheus(stats), end="")
+        return
+    name = f"{target['ip']}:{target['port']}" if target else f"{node.ip}:{node.port}"
+    print(f"\n📊 Stats of {name}:")
+    titles = {"handler_seconds": "Requests handled", "operation_seconds": "Operations issued", "storage_seconds": "Storage calls",
+              "queue_seconds": "Executor queue wait"}
+    for metric_name, title in titles.items():
+        metric = stats["histograms"].get(metric_name)
+        if metric is None:
+            continue
+        print(f"• {title}:")
+        for value, histogram in sorted(metric["series"].items(), key=lambda item: item[1]["count"], reverse=True):
+            print(f"  {value or 'all'}: {histogram['count']}, mean {histogram['sum'] / histogram['count'] * 1000:.2f} ms, "
+                  f"p50 ≤ {quantile(histogram, metric['bounds'], 0.5) * 1000:g} ms, "
+                  f"p99 ≤ {quantile(histogram, metric['bounds'], 0.99) * 1000:g} ms")
+    hops = stats["histograms"].get("hops")
+    if hops is not None:
+        print("• Hops per operation:")
+        for value, histogram in sorted(hops["series"].items()):
+            print(f"  {value}: mean {histogram['sum'] / histogram['count']:.2f}, p99 ≤ {quantile(histogram, hops['bounds'], 0.99)}")
+    for counter in ("forwarded", "timeouts"):
+        if counter in stats["counters"]:
+            series = stats["counters"][counter]["series"]
+            print(f"• {counter.capitalize()}: " + ", ".join(f"{value} {count}" for value, count in sorted(series.items())))
+    traffic = {counter: stats["counters"].get(counter, {"series": {}})["series"].get("", 0) for counter in ("bytes_in", "bytes_out")}
+    print(f"• Traffic: {traffic['bytes_in']} bytes in, {traffic['bytes_out']} bytes out")
+    print("• Gauges: " + ", ".join(f"{gauge} {level}" for gauge, level in sorted(stats["gauges"].items())))
+
+def save_traces(parts, node):
+    """Write the traces collected with --trace_sample to a file, one JSON object per line."""
+    path = parts[1] if len(parts) > 1 and parts[1] else "traces.jsonl"
+    traces = list(node.traces)
+    with open(path, "w") as f:
+        for trace in traces:
+            f.write(json.dumps(trace) + "\n")
+    print(f"🧭 Saved {len(traces)} traces to {path}")
+
+def print_cache(node):
+    """Display the counters of the node's read cache."""
+    stats = node.cache.stats()
+    print("\n🗃️ Read Cache:")
+    print(f"• Size: {stats['size']}/{stats['capacity']}")
+    print(f"• Hits: {stats['hits']}, Misses: {stats['misses']}, Evictions: {stats['evictions']}")
+    print(f"• Hit ratio: {stats['hit_ratio']:.2%}")
 
 def process_greet(parts, node):
     """Handle greeting command with optional IP/port parameters."""
@@ -91,11 +194,14 @@ def process_query(parts, node):
     result = node.query(song)
     print(f"🔍 Query result for {song}: {result}")
 
-def cli(node, input_file=None):
+def cli(node, input_file=None, bulk=False):
     """Command line interface with support for both interactive and file input."""
     if input_file:
         try:
             with open(input_file) as f:
+                if bulk:
+                    run_bulk_file(f, node)
+                    return
                 for line in f:
                     line = line.strip()
                     if line and process_command(line, node):
@@ -114,6 +220,35 @@ def cli(node, input_file=None):
                 node.depart()
                 break
 
+def run_bulk_file(f, node):
+    """Run a command file, sending runs of consecutive inserts or deletes as batches."""
+    pending_cmd, pending = None, []
+
+    def flush():
+        if pending_cmd == "insert":
+            node.insert_many(pending)
+        elif pending_cmd == "delete":
+            node.delete_many(pending)
+        pending.clear()
+
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        parts = [part.strip() for part in line.split(',')]
+        cmd = parts[0].lower()
+        if cmd in ("insert", "delete") and len(parts) > 1:
+            if cmd != pending_cmd:
+                flush()
+                pending_cmd = cmd
+            pending.append((parts[1], parts[2] if len(parts) > 2 else "") if cmd == "insert" else parts[1])
+            continue
+        flush()
+        pending_cmd = None
+        if process_command(line, node):
+            return
+    flush()
+
 def main():
     """Configure and start the Chord node with enhanced CLI."""
     parser = argparse.ArgumentParser(description="Distributed Hash Table Node")
@@ -123,19 +258,48 @@ def main():
     parser.add_argument("--port", type=int, default=5000,
                       help="Port number (default: 5000)")
     parser.add_argument("--file", help="Read commands from input file")
+    parser.add_argument("--bulk", action="store_true",
+                      help="With --file, send consecutive inserts/deletes as batches")
+    parser.add_argument("--server", choices=["threaded", "asyncio"], default="threaded",
+                      help="Server mode: a thread per connection or a single asyncio event loop (default: threaded)")
+    parser.add_argument("--storage", choices=["mongodb", "memory"], default="mongodb",
+                      help="Storage engine: the local MongoDB or an in-process store (default: mongodb)")
+    parser.add_argument("--aof", help="With --storage memory, append-only file that persists the store across restarts")
+    parser.add_argument("--write_behind", type=float,
+                      help="Buffer writes and flush them in batches at least every this many seconds")
+    parser.add_argument("--cache_size", type=int, default=1024,
+                      help="Keys kept in the read cache, 0 to disable it (default: 1024)")
+    parser.add_argument("--virtual_nodes", type=int, default=1,
+                      help="Ring positions this node takes, all served by one server and storage engine (default: 1)")
+    parser.add_argument("--hot_replicas", type=int, default=2,
+                      help="Extra nodes given read-only copies of hot keys in eventual mode, 0 to disable (default: 2)")
+    parser.add_argument("--wire", choices=["binary", "json"], default="binary",
+                      help="Message encoding on the wire; json is readable when debugging (default: binary)")
+    parser.add_argument("--trace_sample", type=float, default=0.0,
+                        help="Share of this node's insertions, queries and deletions to trace hop by hop (default: 0)")
+    parser.add_argument("--migration_rate", type=float, default=5_000_000,
+                      help="Bytes per second sent when migrating keys to a joining node, 0 for unlimited (default: 5000000)")
     args = parser.parse_args()
 
     if args.bootstrap:
-        node = ChordNode(port=args.port, bootstrap_node=None)
+        node = ChordNode(port=args.port, bootstrap_node=None, server_mode=args.server, storage_engine=args.storage,
+                         aof_path=args.aof, write_behind=args.write_behind,
+                         cache_size=args.cache_size, migration_rate=args.migration_rate,
+                         virtual_nodes=args.virtual_nodes, hot_replicas=args.hot_replicas,
+                         wire_format=args.wire, trace_sample=args.trace_sample)
         print(f"🚀 Bootstrap node started at {node.ip}:{args.port}")
     else:
         if not args.ip:
             print("❌ Must specify bootstrap IP with --ip when not in bootstrap mode")
             return
-        node = ChordNode(port=args.port, bootstrap_node={"ip": args.ip, "port": args.port})
+        node = ChordNode(port=args.port, bootstrap_node={"ip": args.ip, "port": args.port}, server_mode=args.server,
+                         storage_engine=args.storage, aof_path=args.aof, write_behind=args.write_behind,
+                         cache_size=args.cache_size, migration_rate=args.migration_rate,
+                         virtual_nodes=args.virtual_nodes, hot_replicas=args.hot_replicas,
+                         wire_format=args.wire, trace_sample=args.trace_sample)
         print(f"🌐 Node started at {node.ip}:{args.port}")
 
-    cli_thread = threading.Thread(target=cli, args=(node, args.file))
+    cli_thread = threading.Thread(target=cli, args=(node, args.file, args.bulk))
     cli_thread.daemon = True
     cli_thread.start()
 
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity  # Maximum number of cached keys; 0 disables the cache
+        self.entries = OrderedDict()  # key -> value, least recently used first
+        self.lock = threading.Lock()
+        self.writes = 0  # Number of writes seen, so that a fill racing with a write is dropped
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) if key is cached, or (False, None) after counting a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def begin_fill(self):
+        """Return a token to pass to fill after reading a missed key from the store."""
+        with self.lock:
+            return self.writes
+
+    def fill(self, key, value, token):
+        """Cache a value read from the store, unless a write happened since begin_fill (the read may be stale)."""
+        with self.lock:
+            if self.capacity <= 0 or token != self.writes:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, key, value):
+        """Apply a write to the cache: a cached key takes the new value, an uncached key stays uncached."""
+        with self.lock:
+            self.writes += 1
+            if key in self.entries:
+                self.entries[key] = value
+
+    def discard(self, key):
+        """Drop a key from the cache, so that the next read goes to the store."""
+        with self.lock:
+            self.writes += 1
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Drop every cached key."""
+        with self.lock:
+            self.writes += 1
+            self.entries.clear()
+
+    def stats(self):
+        """Return the cache counters."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,127 @@
+import socket
+import threading
+import time
+
+
+class ConnectionPool:
+    def __init__(self, idle_timeout=30, connect_timeout=10, max_idle_per_peer=4, warm_peers=None):
+        self.idle_timeout = idle_timeout  # Seconds an unused connection is kept open
+        self.connect_timeout = connect_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self.warm_peers = warm_peers  # Callable returning the (ip, port) peers that should always have a connection
+        self.idle = {}  # (ip, port) -> list of [socket, last_used]
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """Start the background thread that evicts idle connections and keeps warm peers connected."""
+        self.running = True
+        maintenance_thread = threading.Thread(target=self.maintenance_loop, daemon=True)
+        maintenance_thread.start()
+
+    def send(self, ip, port, data):
+        """Send an already framed message to ip:port, reusing a pooled connection when one is available."""
+        peer = (ip, port)
+        sock = self.acquire(peer)
+        if sock is not None:
+            try:
+                sock.sendall(data)
+                self.release(peer, sock)
+                return
+            except OSError:
+                # The pooled connection went stale (e.g. the peer restarted), retry on a fresh one
+                sock.close()
+
+        sock = self.connect(peer)
+        try:
+            sock.sendall(data)
+        except OSError:
+            sock.close()
+            raise
+        self.release(peer, sock)
+
+    def connect(self, peer):
+        """Open a new connection to peer."""
+        sock = socket.create_connection(peer, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def acquire(self, peer):
+        """Take a live idle connection to peer out of the pool, or return None if there is none."""
+        with self.lock:
+            connections = self.idle.get(peer)
+            while connections:
+                sock, _ = connections.pop()
+                if self.is_alive(sock):
+                    return sock
+                sock.close()
+        return None
+
+    def release(self, peer, sock):
+        """Return a connection to the pool once a message has been written to it."""
+        with self.lock:
+            connections = self.idle.setdefault(peer, [])
+            if len(connections) < self.max_idle_per_peer:
+                connections.append([sock, time.monotonic()])
+                return
+        sock.close()
+
+    def is_alive(self, sock):
+        """Check that the peer has not closed a pooled connection. Peers never write on these connections."""
+        try:
+            sock.setblocking(False)
+            try:
+                return sock.recv(1, socket.MSG_PEEK) != b""
+            finally:
+                sock.settimeout(self.connect_timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def evict_idle(self):
+        """Close connections that have been idle for longer than idle_timeout, except those to warm peers."""
+        warm = set(self.warm_peers()) if self.warm_peers else set()
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for peer, connections in list(self.idle.items()):
+                if peer in warm:
+                    continue
+                keep = [entry for entry in connections if now - entry[1] < self.idle_timeout]
+                evicted.extend(entry[0] for entry in connections if now - entry[1] >= self.idle_timeout)
+                if keep:
+                    self.idle[peer] = keep
+                else:
+                    del self.idle[peer]
+        for sock in evicted:
+            sock.close()
+
+    def keep_warm(self):
+        """Make sure every warm peer has an open connection in the pool."""
+        if not self.warm_peers:
+            return
+        for peer in self.warm_peers():
+            with self.lock:
+                if self.idle.get(peer):
+                    continue
+            try:
+                self.release(peer, self.connect(peer))
+            except OSError:
+                pass
+
+    def maintenance_loop(self):
+        """Periodically evict idle connections and re-open warm ones."""
+        while self.running:
+            time.sleep(max(self.idle_timeout / 2, 0.5))
+            self.evict_idle()
+            self.keep_warm()
+
+    def close_all(self):
+        """Close every pooled connection and stop the maintenance thread."""
+        self.running = False
+        with self.lock:
+            connections = [entry[0] for entries in self.idle.values() for entry in entries]
+            self.idle.clear()
+        for sock in connections:
+            sock.close()
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class HotKeyTracker:
+    def __init__(self, window=10.0, slots=5, capacity=64):
+        self.slot_length = window / slots  # Seconds counted by each slot of the sliding window
+        self.slots = [{} for _ in range(slots)]  # Space-Saving counters (key -> estimated count), oldest slot first
+        self.totals = [0] * slots  # Reads counted by each slot
+        self.capacity = capacity  # Counters kept per slot; a key read more than 1/capacity of a slot's reads is always kept
+        self.slot_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, key):
+        """Count one read of key in the current slot (Space-Saving: a new key evicts the smallest counter)."""
+        with self.lock:
+            self.advance()
+            counters = self.slots[-1]
+            self.totals[-1] += 1
+            if key in counters:
+                counters[key] += 1
+            elif len(counters) < self.capacity:
+                counters[key] = 1
+            else:
+                smallest = min(counters, key=counters.get)
+                counters[key] = counters.pop(smallest) + 1
+
+    def advance(self):
+        """Drop the slots that fell out of the window. Callers hold the lock."""
+        elapsed = int((time.monotonic() - self.slot_start) / self.slot_length)
+        for _ in range(min(elapsed, len(self.slots))):
+            self.slots.pop(0)
+            self.slots.append({})
+            self.totals.pop(0)
+            self.totals.append(0)
+        self.slot_start += elapsed * self.slot_length
+
+    def hot(self, share=0.05, min_count=20):
+        """Return the keys read at least min_count times and at least share of all reads within the window."""
+        with self.lock:
+            self.advance()
+            total = sum(self.totals)
+            estimates = {}
+            for counters in self.slots:
+                for key, count in counters.items():
+                    estimates[key] = estimates.get(key, 0) + count
+        return {key for key, count in estimates.items() if count >= min_count and count >= share * total}
@@ -0,0 +1,61 @@
+import bisect
+import threading
+from collections import OrderedDict
+from chord_ring_index import in_range
+
+
+class LocationCache:
+    def __init__(self, capacity=4096):
+        self.capacity = capacity  # Maximum number of cached ranges
+        self.starts = []  # Sorted start ids of the cached ranges
+        # start id -> {"ip", "port", "node_id", "end"}, the node owning [node_id, end); least recently used first
+        self.ranges = OrderedDict()
+        self.lock = threading.Lock()
+
+    def find(self, key_hash):
+        """Return the cached node whose range holds key_hash, or None."""
+        with self.lock:
+            if not self.starts:
+                return None
+            # The candidate is the range with the last start not after key_hash; index -1 wraps around the ring
+            start = self.starts[bisect.bisect_right(self.starts, key_hash) - 1]
+            owner = self.ranges[start]
+            if self.contains(owner, key_hash):
+                self.ranges.move_to_end(start)
+                return owner
+            return None
+
+    def update(self, owner_range):
+        """Cache the range a node reported owning, dropping cached ranges of other nodes that start inside it."""
+        with self.lock:
+            for start in self.starts_within(owner_range["node_id"], owner_range["end"]):
+                if start != owner_range["node_id"]:
+                    self.remove(start)
+            if owner_range["node_id"] not in self.ranges:
+                if len(self.starts) >= self.capacity:
+                    self.remove(next(iter(self.ranges)))
+                bisect.insort(self.starts, owner_range["node_id"])
+            self.ranges[owner_range["node_id"]] = dict(owner_range)
+            self.ranges.move_to_end(owner_range["node_id"])
+
+    def invalidate(self, node_id):
+        """Forget the range of a node, e.g. after it could not be reached or departed."""
+        with self.lock:
+            if node_id in self.ranges:
+                self.remove(node_id)
+
+    def starts_within(self, lo, hi):
+        """Return the cached starts in the clockwise range [lo, hi). lo == hi is the whole ring. Callers hold the lock."""
+        first, last = bisect.bisect_left(self.starts, lo), bisect.bisect_left(self.starts, hi)
+        if lo < hi:
+            return self.starts[first:last]
+        return self.starts[first:] + self.starts[:last]
+
+    def remove(self, start):
+        """Drop a cached range. Callers hold the lock."""
+        del self.ranges[start]
+        self.starts.pop(bisect.bisect_left(self.starts, start))
+
+    def contains(self, owner_range, key_hash):
+        """Check whether key_hash lies in [node_id, end) clockwise. node_id == end is the whole ring."""
+        return in_range(key_hash, owner_range["node_id"], owner_range["end"])
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+
+
+class MembershipView:
+    def __init__(self, node, recent_window=10, max_piggyback=16, on_departure=None):
+        self.node_id = node["node_id"]
+        # node_id -> {"ip", "port", "node_id", "version", "alive"}; only a node itself raises its own version
+        self.members = {self.node_id: {**node, "version": 1, "alive": True}}
+        self.updated = {self.node_id: time.monotonic()}  # node_id -> when its entry last changed here
+        self.recent_window = recent_window  # Seconds a changed entry keeps being piggybacked on messages
+        self.max_piggyback = max_piggyback  # Most entries piggybacked on a single message
+        self.changes = 0  # Number of times the view changed, so derived views can tell when to rebuild
+        self.on_departure = on_departure  # Called with the node_id of every member learned to have departed
+        self.lock = threading.Lock()
+
+    def merge(self, entries):
+        """Adopt every entry with a higher version than the local one. Returns True if the view changed."""
+        changed = False
+        departed = []
+        now = time.monotonic()
+        with self.lock:
+            for entry in entries:
+                current = self.members.get(entry["node_id"])
+                if entry["node_id"] == self.node_id:
+                    if entry["version"] >= current["version"] and entry != current:
+                        # Someone holds a newer claim about this node (e.g. from before a restart): refute it
+                        current["version"] = entry["version"] + 1
+                        current["alive"] = True
+                        self.updated[self.node_id] = now
+                        changed = True
+                    continue
+                if current is None or entry["version"] > current["version"]:
+                    if not entry["alive"] and (current is None or current["alive"]):
+                        departed.append(entry["node_id"])
+                    self.members[entry["node_id"]] = dict(entry)
+                    self.updated[entry["node_id"]] = now
+                    changed = True
+            if changed:
+                self.changes += 1
+        if self.on_departure is not None:
+            for node_id in departed:
+                self.on_departure(node_id)
+        return changed
+
+    def depart(self):
+        """Mark this node as departed, with a version that overrides every earlier entry for it."""
+        with self.lock:
+            own = self.members[self.node_id]
+            own["version"] += 1
+            own["alive"] = False
+            self.updated[self.node_id] = time.monotonic()
+            self.changes += 1
+
+    def entries(self):
+        """Return every entry, departed nodes included, for a full exchange."""
+        with self.lock:
+            return [dict(entry) for entry in self.members.values()]
+
+    def recent(self):
+        """Return the most recently changed entries, to piggyback on an outgoing message."""
+        now = time.monotonic()
+        with self.lock:
+            fresh = [node_id for node_id, updated in self.updated.items() if now - updated < self.recent_window]
+            fresh.sort(key=lambda node_id: self.updated[node_id], reverse=True)
+            return [dict(self.members[node_id]) for node_id in fresh[:self.max_piggyback]]
+
+    def is_behind(self, entries):
+        """Check whether entries lack or hold older versions of some entry of this view."""
+        versions = {entry["node_id"]: entry["version"] for entry in entries}
+        with self.lock:
+            return any(versions.get(node_id, 0) < entry["version"] for node_id, entry in self.members.items())
+
+    def has_departed(self, node_id):
+        """Check whether the view records node_id as departed."""
+        with self.lock:
+            entry = self.members.get(node_id)
+            return entry is not None and not entry["alive"]
+
+    def nodes(self):
+        """Return the live members in ring order starting at this node, as {"ip", "port", "node_id"} dicts."""
+        with self.lock:
+            alive = sorted(
+                ({"ip": entry["ip"], "port": entry["port"], "node_id": entry["node_id"]}
+                 for entry in self.members.values() if entry["alive"]),
+                key=lambda node: node["node_id"]
+            )
+        start = next((i for i, node in enumerate(alive) if node["node_id"] == self.node_id), 0)
+        return alive[start:] + alive[:start]
+
+    def random_peer(self):
+        """Return a random live member other than this node, or None."""
+        with self.lock:
+            peers = [entry for node_id, entry in self.members.items() if entry["alive"] and node_id != self.node_id]
+        return dict(random.choice(peers)) if peers else None
@@ -0,0 +1,107 @@
+import hashlib
+import threading
+
+
+# Leaves cover equal slices of the 160-bit key space and the hash of a tree node is the XOR of the digests
+# of the keys below it, so a write only touches the path from its leaf to the root. Hashes can be restricted
+# to any clockwise key range, so one tree serves every range a node replicates.
+class MerkleTree:
+    def __init__(self, depth=10, bits=160):
+        self.depth = depth
+        self.bits = bits
+        self.hashes = [0] * (2 ** (depth + 1))  # Heap layout: node 1 is the root, leaves start at 2**depth
+        self.digests = {}  # key_hash -> digest of its current version
+        self.leaf_keys = {}  # leaf index -> set of key hashes in that leaf
+        self.lock = threading.Lock()
+
+    def leaf_of(self, key_hash):
+        """Return the index of the leaf covering key_hash."""
+        return 2 ** self.depth + (key_hash >> (self.bits - self.depth))
+
+    def digest(self, key_hash, version):
+        """Digest identifying one version of a key."""
+        return int(hashlib.sha1(f"{key_hash}:{version[0]}:{version[1]}".encode()).hexdigest(), 16)
+
+    def update(self, key_hash, version):
+        """Record that key_hash is now stored with version."""
+        digest = self.digest(key_hash, version)
+        with self.lock:
+            delta = self.digests.get(key_hash, 0) ^ digest
+            self.digests[key_hash] = digest
+            leaf = self.leaf_of(key_hash)
+            self.leaf_keys.setdefault(leaf, set()).add(key_hash)
+            index = leaf
+            while index >= 1:
+                self.hashes[index] ^= delta
+                index //= 2
+
+    def remove(self, key_hash, version):
+        """Forget key_hash if it is still recorded with version."""
+        digest = self.digest(key_hash, version)
+        with self.lock:
+            if self.digests.get(key_hash) != digest:
+                return
+            del self.digests[key_hash]
+            leaf = self.leaf_of(key_hash)
+            self.leaf_keys[leaf].discard(key_hash)
+            index = leaf
+            while index >= 1:
+                self.hashes[index] ^= digest
+                index //= 2
+
+    def clear(self):
+        """Forget every key."""
+        with self.lock:
+            self.hashes = [0] * len(self.hashes)
+            self.digests.clear()
+            self.leaf_keys.clear()
+
+    def span(self, index):
+        """Return the linear key interval [start, end) covered by a node."""
+        level = index.bit_length() - 1
+        width = 2 ** (self.bits - level)
+        start = (index - 2 ** level) * width
+        return start, start + width
+
+    def linear_intervals(self, lo, hi):
+        """Split the clockwise range [lo, hi) into non-wrapping intervals. lo == hi is the whole ring."""
+        if lo < hi:
+            return [(lo, hi)]
+        return [(lo, 2 ** self.bits), (0, hi)] if hi > 0 else [(lo, 2 ** self.bits)]
+
+    def range_hash(self, index, lo, hi):
+        """Hash of the keys below a node that fall in the clockwise range [lo, hi)."""
+        with self.lock:
+            result = 0
+            for start, end in self.linear_intervals(lo, hi):
+                result ^= self.interval_hash(index, start, end)
+            return result
+
+    def interval_hash(self, index, start, end):
+        """Hash of the keys below a node that fall in the linear interval [start, end). Callers hold the lock."""
+        node_start, node_end = self.span(index)
+        if node_end <= start or node_start >= end:
+            return 0
+        if start <= node_start and node_end <= end:
+            return self.hashes[index]
+        if self.is_leaf(index):
+            result = 0
+            for key_hash in self.leaf_keys.get(index, ()):
+                if start <= key_hash < end:
+                    result ^= self.digests[key_hash]
+            return result
+        return self.interval_hash(2 * index, start, end) ^ self.interval_hash(2 * index + 1, start, end)
+
+    def is_leaf(self, index):
+        """Check whether a tree node is a leaf."""
+        return index >= 2 ** self.depth
+
+    def leaf_digests(self, index, lo, hi):
+        """Return {key_hash: digest} for the keys of a leaf that fall in the clockwise range [lo, hi)."""
+        with self.lock:
+            intervals = self.linear_intervals(lo, hi)
+            return {
+                key_hash: self.digests[key_hash]
+                for key_hash in self.leaf_keys.get(index, ())
+                if any(start <= key_hash < end for start, end in intervals)
+            }
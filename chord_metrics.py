@@ -0,0 +1,100 @@
+import bisect
+import threading
+
+# Upper bounds of the histogram buckets; the last, implicit bucket holds everything larger
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+HOP_BOUNDS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}  # name -> {"label": label name, "series": {label value: count}}
+        self.histograms = {}  # name -> {"label": label name, "bounds": bucket bounds, "series": {label value: histogram}}
+        self.levels = {}  # name -> current value of a gauge moved up and down with adjust
+        self.gauges = {}  # name -> callable returning the current value, read at snapshot time
+        self.lock = threading.Lock()
+
+    def count(self, name, amount=1, label=None, value=""):
+        """Add amount to a counter, optionally split by the value of a label."""
+        with self.lock:
+            series = self.counters.setdefault(name, {"label": label, "series": {}})["series"]
+            series[value] = series.get(value, 0) + amount
+
+    def observe(self, name, sample, label=None, value="", bounds=LATENCY_BOUNDS):
+        """Record a sample in a histogram, optionally split by the value of a label."""
+        with self.lock:
+            metric = self.histograms.setdefault(name, {"label": label, "bounds": bounds, "series": {}})
+            histogram = metric["series"].get(value)
+            if histogram is None:
+                histogram = metric["series"][value] = {"buckets": [0] * (len(bounds) + 1), "sum": 0, "count": 0}
+            histogram["buckets"][bisect.bisect_left(metric["bounds"], sample)] += 1
+            histogram["sum"] += sample
+            histogram["count"] += 1
+
+    def adjust(self, name, delta):
+        """Move a gauge up or down, e.g. the number of requests being handled."""
+        with self.lock:
+            self.levels[name] = self.levels.get(name, 0) + delta
+
+    def register_gauge(self, name, read):
+        """Report the value returned by read() as a gauge in every snapshot."""
+        self.gauges[name] = read
+
+    def snapshot(self):
+        """Return a copy of every metric, as plain dicts that can be sent in a message."""
+        gauges = {name: read() for name, read in self.gauges.items()}
+        with self.lock:
+            gauges.update(self.levels)
+            return {
+                "counters": {name: {"label": metric["label"], "series": dict(metric["series"])}
+                             for name, metric in self.counters.items()},
+                "histograms": {name: {"label": metric["label"], "bounds": list(metric["bounds"]),
+                                      "series": {value: {"buckets": list(histogram["buckets"]), "sum": histogram["sum"],
+                                                         "count": histogram["count"]}
+                                                 for value, histogram in metric["series"].items()}}
+                               for name, metric in self.histograms.items()},
+                "gauges": gauges
+            }
+
+
+def quantile(histogram, bounds, q):
+    """Estimate the q-quantile of a histogram snapshot as the upper bound of the bucket holding it."""
+    rank = q * histogram["count"]
+    seen = 0
+    for i, count in enumerate(histogram["buckets"]):
+        seen += count
+        if count and seen >= rank:
+            return bounds[i] if i < len(bounds) else float("inf")
+    return 0
+
+
+def to_prometheus(snapshot, prefix="chord_"):
+    """Render a snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}{name} counter")
+        for value, count in sorted(metric["series"].items()):
+            lines.append(f"{prefix}{name}{labels(metric['label'], value)} {count}")
+    for name, metric in sorted(snapshot["histograms"].items()):
+        lines.append(f"# TYPE {prefix}{name} histogram")
+        for value, histogram in sorted(metric["series"].items()):
+            cumulative = 0
+            for bound, count in zip(list(metric["bounds"]) + ["+Inf"], histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{labels(metric['label'], value, bound)} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{labels(metric['label'], value)} {histogram['sum']}")
+            lines.append(f"{prefix}{name}_count{labels(metric['label'], value)} {histogram['count']}")
+    for name, level in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {prefix}{name} gauge")
+        lines.append(f"{prefix}{name} {level}")
+    return "\n".join(lines) + "\n"
+
+
+def labels(label, value, bound=None):
+    """Format the label set of a series, with the le label of a histogram bucket."""
+    pairs = []
+    if label:
+        pairs.append(f'{label}="{value}"')
+    if bound is not None:
+        pairs.append(f'le="{bound}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
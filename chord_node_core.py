@@ -1,32 +1,124 @@
-import hashlib
+import asyncio
+import collections
 import socket
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
 import threading
-import json
+import time
+from chord_cache import LRUCache
+from chord_connection_pool import ConnectionPool
+from chord_hot_keys import HotKeyTracker
+from chord_location_cache import LocationCache
+from chord_membership import MembershipView
+from chord_merkle import MerkleTree
+from chord_metrics import Metrics
+from chord_protocol import MessageReader, encode_message
+from chord_rate_limiter import RateLimiter
+from chord_ring_index import hash_key, in_range
+from chord_reply_dispatcher import ReplyDispatcher
+from chord_storage import open_storage_engine
 
 
 class ChordNodeCore:
-    def __init__(self, bootstrap_node=None, replication_factor=3, consistency_type="linearizability", debugging=True):
-        try:
-            self.ip = socket.gethostbyname(socket.gethostname())
-        except Exception as e:
-            print(f"❌ Failed to resolve local IP: {e}\n❌ Aborting...")
-            exit(1)   
-        if bootstrap_node is not None:
-            self.port = self.get_free_port()  # Assign a free port
+    def __init__(self, bootstrap_node=None, replication_factor=3, consistency_type="linearizability", debugging=True,
+                 port=None, server_mode="threaded", handler_workers=32, read_repair_chance=0.1, storage_engine="mongodb",
+                 aof_path=None, write_behind=None, cache_size=1024, ip=None,
+                 migration_rate=5_000_000, virtual_nodes=1, host=None, virtual_index=0, hot_replicas=2,
+                 wire_format="binary", trace_sample=0.0):
+        # A virtual node shares the server, storage engine and connections of its host, the first node of its process
+        self.host = host if host is not None else self
+        if host is not None:
+            self.ip = host.ip
+            self.server_socket = host.server_socket
+            self.port = host.port
+            self.node_id = self.hash_function(f"{self.ip}:{self.port}#{virtual_index}")
         else:
-            self.port = 5000
-        self.node_id = self.hash_function(f"{self.ip}:{self.port}")
+            try:
+                self.ip = ip if ip is not None else socket.gethostbyname(socket.gethostname())
+            except Exception as e:
+                print(f"❌ Failed to resolve local IP: {e}\n❌ Aborting...")
+                exit(1)   
+            # The server socket is bound and listening before the join, so the port cannot be taken by a node starting
+            # at the same time, and requests sent to this node while it joins wait in the backlog
+            if bootstrap_node is not None:
+                self.server_socket = self.bind_free_port()
+            else:
+                self.server_socket = self.bind_server_socket(port if port is not None else 5000)
+            self.port = self.server_socket.getsockname()[1]
+            self.node_id = self.hash_function(f"{self.ip}:{self.port}")
+        self.virtual_nodes = self.host.virtual_nodes if host is not None else {}  # node_id -> virtual nodes of this process
+        self.virtual_nodes[self.node_id] = self
+        self.virtual_node_count = virtual_nodes  # Ring positions the host takes, itself included
         self.replication_factor = replication_factor
+        # Gossiped view of the ring; ranges cached for departed nodes are dropped as soon as the departure is learned
+        self.membership = MembershipView({"ip": self.ip, "port": self.port, "node_id": self.node_id},
+                                         on_departure=lambda node_id: self.locations.invalidate(node_id))
+        self.gossip_interval = 1.0
         self.successor = None
         self.predecessor = None
+        self.ring_lock = threading.RLock()  # Serializes changes to successor and predecessor
+        self.stabilize_interval = 1.0
+        self.finger_table = [None] * 160  # finger_table[i] is the node responsible for node_id + 2**i
+        self.next_finger = 0
+        self.ring_cache = (None, None)  # (membership changes, RingIndex) of the view of the ring last indexed
+        self.fix_fingers_interval = 1.0
+        self.dirty_versions = {}  # CRAQ: key_hash -> number of writes not yet committed by the tail
+        self.craq_lock = threading.Lock()
+        self.lamport_clock = 0  # Versions of stored values are [lamport_clock, node_id]
+        self.clock_lock = threading.Lock()
+        # (source, lo, hi) ranges this node pulls after joining, None once done. Writes it stamps as first copy fetch
+        # their keys from the source first, so they merge into the migrated documents
+        self.pulling = [] if bootstrap_node is not None else None
+        self.pulled_keys = set()  # Keys already fetched for a write during the pull
+        self.pull_lock = threading.Lock()
+        self.read_repair_chance = read_repair_chance  # Share of eventual reads after which the owner compares copies with its successor
+        self.hot_keys = HotKeyTracker()  # Reads of the keys this node owns over a sliding window
+        self.hot_replicas = hot_replicas  # Extra nodes given read-only copies of hot keys in eventual mode; 0 disables
+        self.hot_interval = 2.0  # Seconds between hot key checks; copies expire after three of them
+        self.hot_placements = {}  # key_hash -> nodes holding a read-only copy of this owner's hot key
+        self.hot_copies = {}  # key_hash -> (document, expiry) read-only copies pushed here by owners of hot keys
+        self.hot_routes = {}  # key_hash -> (nodes, expiry) copies advertised to this node's operations
+        self.hot_lock = threading.Lock()
+        self.trace_sample = trace_sample  # Share of this node's insertions, queries and deletions sent with a trace context
+        self.tracing = threading.local()  # The trace hop of the request each handler thread is handling, if it is traced
+        self.anti_entropy_interval = 30
+        self.tombstone_grace = 600  # Seconds a tombstone is kept before anti-entropy may purge it from replicas that agree
+        self.stream_timeout = 30  # Seconds a stream waits for the receiver to make room before it is given up
+        if host is None:
+            self.cache = LRUCache(cache_size)  # Documents of recently read keys, kept up to date by every write
+            self.merkle = MerkleTree()  # Digests of every stored key, compared with the replicas during anti-entropy
+            self.tombstones = {}  # key_hash -> time its tombstone was stored, purged after tombstone_grace
+            self.migration_limiter = RateLimiter(migration_rate)  # Bytes per second this node sends when migrating keys
+            self.metrics = Metrics()  # Counters and latency histograms of the process, reported by the stats request
+            self.traces = collections.deque(maxlen=10000)  # Traces returned with the responses to sampled operations
+        else:
+            self.cache, self.merkle, self.migration_limiter = host.cache, host.merkle, host.migration_limiter
+            self.tombstones = host.tombstones
+            self.metrics, self.traces = host.metrics, host.traces
         if bootstrap_node!=None:
             bootstrap_node["node_id"] = self.hash_function(f"{bootstrap_node['ip']}:{bootstrap_node['port']}")
         self.bootstrap_node = bootstrap_node  # Dictionary containing bootstrap node details
         self.running = True  # Flag to control the server loop
-        self.server_socket = None  # Store the server socket for cleanup
+        self.server_mode = server_mode  # "threaded" (a thread per connection) or "asyncio" (a single event loop)
+        self.handler_workers = handler_workers  # Size of the handler executor in asyncio mode
+        self.executor = None
+        self.connections = {}  # Open accepted connections -> their handler thread, or task in asyncio mode
         self.debugging = debugging
+        self.wire_format = wire_format  # "binary", or "json" to read the messages on the wire while debugging
         #self.print_lock = threading.Lock()
+        self.locations = LocationCache()  # Ranges of the nodes that answered this node's operations
+        if host is None:
+            self.connection_pool = ConnectionPool(warm_peers=lambda: [self.get_successor()] if self.successor else [])
+            self.replies = ReplyDispatcher()  # Waiters for responses to the operations of every virtual node
+            self.stream_windows = {}  # (receiver ip, reply port, request_id) -> StreamWindow of a stream this process sends
+            self.reply_socket = None
+            self.reply_port = self.start_reply_endpoint()
+            self.metrics.register_gauge("threads", threading.active_count)
+            self.metrics.register_gauge("pending_replies", lambda: len(self.replies.pending))
+        else:
+            self.connection_pool, self.replies = host.connection_pool, host.replies
+            self.stream_windows = host.stream_windows
+            self.dirty_versions, self.craq_lock = host.dirty_versions, host.craq_lock  # Dirty copies live in the shared storage
+            self.reply_socket, self.reply_port = host.reply_socket, host.reply_port
 
         if bootstrap_node is None:
             # If this is the first node, it is its own successor and predecessor
@@ -37,29 +129,45 @@ class ChordNodeCore:
             print(f"🟢 Bootstrap node started at {self.ip}:{self.port}, ID: {self.node_id}")
         else:
             self.join()
-        self.mongoclient = MongoClient("mongodb://localhost:27017/")  
-        self.db = self.mongoclient["database"]  
-        self.collection = self.db[f"collection_{self.node_id//2**155}"]
-        self.collection.delete_many({})
+        if host is not None:
+            self.storage_engine, self.storage = host.storage_engine, host.storage
+            self.lamport_clock = max(self.lamport_clock, host.lamport_clock)
+            return
+        self.storage_engine = storage_engine  # "mongodb" or "memory"
+        # With write_behind (seconds), writes are acknowledged from memory and flushed in batches
+        self.storage = open_storage_engine(storage_engine, f"collection_{self.node_id//2**155}", aof_path, write_behind)
+        if storage_engine == "mongodb":
+            self.storage.clear()  # Drop what a previous run left in the shared database
+        for document in self.storage.scan(include_deleted=True):
+            # Documents replayed from an append-only file
+            self.merkle.update(int(document["key_hash"]), document["version"])
+            self.lamport_clock = max(self.lamport_clock, document["version"][0])
+            if document.get("deleted"):
+                self.tombstones[int(document["key_hash"])] = time.time()  # The grace period restarts with the node
         #server_thread = threading.Thread(target=self.start_server, args=())
         #server_thread.daemon = True
         #server_thread.start()
 
-    def get_free_port(self):
-        """Assign a free port."""
+    def bind_free_port(self):
+        """Bind the server socket to the first free port from 5000 on."""
         for i in range(5000,6000):
-            if self.is_port_free(i):
-                return i
-        return -1
-
-    def is_port_free(self, port):
-        """Check if a port is free."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             try:
-                sock.bind(("0.0.0.0", port))
-                return True
-            except:
-                return False
+                return self.bind_server_socket(i)
+            except OSError:
+                continue
+        raise OSError("No free port between 5000 and 6000")
+
+    def bind_server_socket(self, port):
+        """Bind a listening server socket to port on all interfaces."""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server_socket.bind(("0.0.0.0", port))  # Listen on all interfaces
+            server_socket.listen(128)
+        except OSError:
+            server_socket.close()
+            raise
+        return server_socket
 
     def get_port(self):
         return self.port
@@ -78,39 +186,202 @@ class ChordNodeCore:
 
     def hash_function(self, key):
         """Hash a key using SHA-1 and return a 160-bit integer."""
-        return int(hashlib.sha1(key.encode()).hexdigest(), 16) % (2**160)
+        return hash_key(key)
 
     def start_server(self):
         """Start the server to listen for incoming connections."""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(("0.0.0.0", self.port))  # Listen on all interfaces
-        self.server_socket.listen()  # Listen for incoming connections
-        print(f"🔵 Chord Node {self.ip}:{self.port} started. ID: {self.node_id}")
+        print(f"🔵 Chord Node {self.ip}:{self.port} started ({self.server_mode} server). ID: {self.node_id}")
+        self.start_maintenance()
+        if self.virtual_node_count > 1:
+            threading.Thread(target=self.start_virtual_nodes, daemon=True).start()
+        self.connection_pool.start()
+        if self.server_mode == "asyncio":
+            asyncio.run(self.serve_async())
+        else:
+            self.serve_threaded()
+        self.server_socket.close()
+        print("🔴 Server stopped.")
+
+    def start_maintenance(self):
+        """Start the background loops that keep this node's place in the ring and its replicas up to date."""
+        fingers_thread = threading.Thread(target=self.fix_fingers_loop, daemon=True)
+        fingers_thread.start()
+        anti_entropy_thread = threading.Thread(target=self.anti_entropy_loop, daemon=True)
+        anti_entropy_thread.start()
+        gossip_thread = threading.Thread(target=self.gossip_loop, daemon=True)
+        gossip_thread.start()
+        stabilize_thread = threading.Thread(target=self.stabilize_loop, daemon=True)
+        stabilize_thread.start()
+        hot_keys_thread = threading.Thread(target=self.hot_keys_loop, daemon=True)
+        hot_keys_thread.start()
+        if self.bootstrap_node["node_id"] != self.node_id:
+            # A joined node serves right away while the keys it now holds are migrated in the background
+            threading.Thread(target=self.handle_replication_upon_arrival, daemon=True).start()
+
+    def start_virtual_nodes(self):
+        """Join the other virtual nodes of this process one after the other, once the shared server accepts requests."""
+        bootstrap = {"ip": self.bootstrap_node["ip"], "port": self.bootstrap_node["port"]}
+        for index in range(1, self.virtual_node_count):
+            try:
+                node = type(self)(bootstrap_node=dict(bootstrap), replication_factor=self.replication_factor,
+                                  consistency_type=self.consistency_type, debugging=self.debugging,
+                                  read_repair_chance=self.read_repair_chance, host=self, virtual_index=index,
+                                  hot_replicas=self.hot_replicas, wire_format=self.wire_format)
+            except Exception as e:
+                print(f"❌ Virtual node {index} failed to join: {e}")
+                self.virtual_nodes.pop(self.hash_function(f"{self.ip}:{self.port}#{index}"), None)
+                continue
+            node.start_maintenance()
+            print(f"🔵 Virtual node {index} of {self.ip}:{self.port} joined. ID: {node.node_id}")
+
+    def serve_threaded(self):
+        """Accept connections, handling each one in its own thread."""
         while self.running:
             try:
                 conn, _ = self.server_socket.accept()
-                threading.Thread(target=self.handle_request, args=(conn,)).start()
+                handler = threading.Thread(target=self.handle_request, args=(conn,), daemon=True)
+                self.connections[conn] = handler
+                handler.start()
             except Exception as e:
                 if self.running:
                     print(f"❌ Error accepting connection: {e}")
-        self.server_socket.close()
-        print("🔴 Server stopped.")
 
-    def pass_request(self, request, target_ip=None, target_port=None):
-        """Send a request to another node without waiting for a response."""
+    async def serve_async(self):
+        """Accept connections on an asyncio event loop, running handlers on a bounded executor."""
+        self.executor = ThreadPoolExecutor(max_workers=self.handler_workers)
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.handle_request_async, sock=self.server_socket)
+        async with server:
+            while self.running:
+                await asyncio.sleep(0.5)
+            # Let every connection's handler finish on its own instead of being cancelled by asyncio.run
+            for writer in list(self.connections):
+                writer.close()
+            try:
+                await asyncio.wait_for(asyncio.gather(*self.connections.values(), return_exceptions=True), timeout=5)
+            except asyncio.TimeoutError:
+                pass  # Handlers still running are cancelled, which they end quietly
+        self.executor.shutdown(wait=False)
+
+    def start_reply_endpoint(self):
+        """Open the long-lived endpoint on which this node receives the responses to its own operations."""
+        self.reply_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reply_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.reply_socket.bind(("0.0.0.0", 0))  # Bind to a free port
+        self.reply_socket.listen()
+        reply_thread = threading.Thread(target=self.serve_replies, daemon=True)
+        reply_thread.start()
+        return self.reply_socket.getsockname()[1]
+
+    def serve_replies(self):
+        """Accept connections on the reply endpoint."""
+        while self.running:
+            try:
+                conn, _ = self.reply_socket.accept()
+                threading.Thread(target=self.handle_replies, args=(conn,), daemon=True).start()
+            except Exception as e:
+                if self.running:
+                    print(f"❌ Error accepting reply connection: {e}")
+
+    def handle_replies(self, conn):
+        """Complete the waiting operation for every response read from a reply connection."""
+        reader = MessageReader(conn, on_frame=self.count_received)
+        try:
+            while self.running:
+                response = reader.read()
+                if response is None:
+                    break
+                self.membership.merge(response.get("gossip", []))
+                if not self.replies.complete(response) and self.debugging:
+                    print(f"⚠️ Dropped {response.get('type')} for request {response.get('request_id')} that is no longer awaited")
+        except Exception as e:
+            print(f"❌ Error reading responses: {e}")
+        finally:
+            conn.close()
+
+    def pass_request(self, request, target_ip=None, target_port=None, target_id=None):
+        """Send a request to another node without waiting for a response.
+
+        target_id picks the virtual node among those sharing the target's server; without it, the first one handles it.
+        """
         try:
             if target_ip is None or target_port is None:
                 succ_ip, succ_port = self.get_successor()
-                self.pass_request(request, succ_ip, succ_port)
+                return self.pass_request(request, succ_ip, succ_port, self.successor["node_id"])
             else:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                    sock.settimeout(10)  
-                    sock.connect((target_ip, target_port))
-                    if self.debugging:
-                        print(f"📤 Sent request to {target_ip}:{target_port}")
-                    sock.send(json.dumps(request).encode())
-                    sock.shutdown(socket.SHUT_WR) 
+                request["target_id"] = target_id
+                request["gossip"] = self.membership.recent()  # Piggyback recent membership changes
+                if "trace" in request:
+                    self.stamp_departure(request["trace"])
+                frame = encode_message(request, self.wire_format)
+                self.connection_pool.send(target_ip, target_port, frame)
+                self.metrics.count("bytes_out", len(frame))
+                if self.debugging:
+                    print(f"📤 Sent request to {target_ip}:{target_port}")
+                return True
         except Exception as e:
             print(f"❌ Failed to send request to {target_ip}:{target_port}: {e}")
+            return False
+
+    def stamp_departure(self, trace):
+        """Record when a traced request or its response leaves this node, if it arrived here last and has not left yet."""
+        hops = trace["hops"]
+        if hops and hops[-1]["node_id"] == self.node_id and "departed" not in hops[-1]:
+            hops[-1]["departed"] = time.time()
+
+    def trace_role(self, role):
+        """Record the part this node plays for the traced request it is handling: route, owner, replica or hot_copy."""
+        hop = getattr(self.tracing, "hop", None)
+        if hop is not None:
+            hop["role"] = role
+
+    def count_received(self, size):
+        """Count the bytes of a frame read by one of this node's servers."""
+        self.metrics.count("bytes_in", size)
+
+    def send_response(self, request, response):
+        """Send a response to the reply endpoint of the node whose operation issued request."""
+        response["request_id"] = request.get("request_id")
+        if "owner_range" in request:
+            response["owner_range"] = request["owner_range"]
+        if "hot_copies" in request:
+            response["hot_copies"] = request["hot_copies"]
+        if "trace" in request:
+            response["trace"] = request["trace"]
+        return self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+
+    def in_arc(self, x, start, end):
+        """Check whether x lies strictly inside the clockwise arc from start to end."""
+        if start < end:
+            return start < x < end
+        return x > start or x < end
+
+    def owns_key(self, key_hash):
+        """Check whether this node is responsible for key_hash, i.e. key_hash lies in [node_id, successor_id)."""
+        return in_range(key_hash, self.node_id, self.successor["node_id"])
+
+    def closest_preceding_node(self, key_hash):
+        """Return the finger that most closely precedes key_hash, or None if no finger does."""
+        for finger in reversed(self.finger_table):
+            if finger is not None and self.in_arc(finger["node_id"], self.node_id, key_hash):
+                return finger
+        return None
+
+    def remove_finger(self, node_id):
+        """Forget every finger pointing to node_id (e.g. after it departed or stopped answering)."""
+        for i, finger in enumerate(self.finger_table):
+            if finger is not None and finger["node_id"] == node_id:
+                self.finger_table[i] = None
+
+    def route_request(self, request, key_hash):
+        """Forward a request towards the node responsible for key_hash through the finger table."""
+        request["hops"] = request.get("hops", 0) + 1
+        self.metrics.count("forwarded", 1, "type", request["type"])
+        self.trace_role("route")
+        finger = self.closest_preceding_node(key_hash)
+        if finger is not None and finger["node_id"] != self.successor["node_id"]:
+            if self.pass_request(request, finger["ip"], finger["port"], finger["node_id"]):
+                return
+            self.remove_finger(finger["node_id"])
+        self.pass_request(request)
 
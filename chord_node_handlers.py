@@ -1,48 +1,150 @@
-import json
+import asyncio
+import random
+import threading
+import time
 from chord_node_core import ChordNodeCore
-from pymongo import MongoClient
+from chord_protocol import MessageReader, encode_message, read_message
+from chord_reply_dispatcher import StreamWindow
+from chord_ring_index import RingIndex, in_range
 
 
 class ChordNodeHandlers(ChordNodeCore):
     def handle_request(self, conn):
-        """Handle incoming requests from other nodes."""
+        """Handle incoming requests from other nodes, reading framed messages until the connection closes."""
+        reader = MessageReader(conn, on_frame=self.count_received)
         try:
-            data = conn.recv(1024).decode()
-            if data:
-                request = json.loads(data)
-                if self.debugging:
-                    print(f"📨 Received request from {request['sender_ip']}:{request['sender_port']}")
-                    print(f"📝 Request details: {request}")
-
-                # Handle different request types
-                if request['type'] == 'greet':
-                    self.handle_greet_request(request)
-                elif request['type'] == 'join':
-                    self.handle_join_request(request)
-                elif request['type'] == 'departure':
-                    self.handle_departure_request(request)
-                elif request['type'] == 'insertion':
-                    self.handle_insertion_request(request)
-                elif request['type'] == 'query':
-                    self.handle_query_request(request)
-                elif request['type'] == 'query_all':
-                    self.handle_query_all_request(request)
-                elif request['type'] == 'deletion':
-                    self.handle_deletion_request(request)
-                elif request['type'] == 'overlay':
-                    self.handle_overlay_request(request)
-                elif request['type'] == 'departure_announcement':
-                    if self.bootstrap_node["node_id"] == self.node_id and self.debugging:
-                        (f"🟡 Node {request['sender_ip']}:{request['sender_port']} is departing.")
+            while self.running:
+                request = reader.read()
+                if request is None or not self.running:
+                    break  # A request read after the node stopped is dropped with its connection
+                self.dispatch_request(request)
+        except Exception as e:
+            if self.running:
+                print(f"❌ (In \"handle_request_method\") Error handling request: {e}")
+        finally:
+            self.connections.pop(conn, None)
+            conn.close()
+
+    async def handle_request_async(self, reader, writer):
+        """Handle incoming requests on an asyncio stream, one framed message after another."""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while self.running:
+                request = await read_message(reader, self.count_received)
+                if request is None:
+                    break
+                await self.dispatch_request_async(request)
+        except asyncio.CancelledError:
+            pass  # The event loop is shutting down
+        except Exception as e:
+            if self.running:
+                print(f"❌ (In \"handle_request_async\") Error handling request: {e}")
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def dispatch_request_async(self, request):
+        """Run the handler for a request on the executor, so storage calls and sends never block the event loop."""
+        loop = asyncio.get_running_loop()
+        self.metrics.adjust("queued_handlers", 1)
+        await loop.run_in_executor(self.executor, self.dispatch_queued, request, time.perf_counter())
+
+    def dispatch_queued(self, request, queued_at):
+        """Run a request taken off the executor's queue, recording how long it waited there."""
+        self.metrics.adjust("queued_handlers", -1)
+        self.metrics.observe("queue_seconds", time.perf_counter() - queued_at)
+        self.dispatch_request(request)
+
+    def dispatch_request(self, request):
+        """Run the handler matching the type of a single request."""
+        node = self.virtual_nodes.get(request.get("target_id"), self)
+        if node is not self:
+            node.dispatch_request(request)  # Addressed to another virtual node sharing this server
+            return
+        self.metrics.adjust("active_handlers", 1)
+        start_time = time.perf_counter()
+        if "trace" in request:
+            # Storage calls made while handling the request add up in the hop; pass_request stamps its departure
+            self.tracing.hop = {"node_id": self.node_id, "role": "owner", "arrived": time.time(), "storage": 0}
+            request["trace"]["hops"].append(self.tracing.hop)
+        try:
+            if self.debugging:
+                print(f"📨 Received request from {request['sender_ip']}:{request['sender_port']}")
+                print(f"📝 Request details: {request}")
+
+            self.membership.merge(request.get("gossip", []))
+
+            # Handle different request types
+            if request['type'] == 'greet':
+                self.handle_greet_request(request)
+            elif request['type'] == 'join':
+                self.handle_join_request(request)
+            elif request['type'] == 'departure':
+                self.handle_departure_request(request)
+            elif request['type'] == 'insertion':
+                self.handle_insertion_request(request)
+            elif request['type'] == 'query':
+                self.handle_query_request(request)
+            elif request['type'] == 'query_all':
+                self.start_stream(self.handle_query_all_request, request)
+            elif request['type'] == 'stream_credit':
+                self.handle_stream_credit_request(request)
+            elif request['type'] == 'deletion':
+                self.handle_deletion_request(request)
+            elif request['type'] == 'overlay':
+                self.handle_overlay_request(request)
+            elif request['type'] == 'lookup':
+                self.handle_lookup_request(request)
+            elif request['type'] == 'bulk_insertion':
+                self.handle_bulk_insertion_request(request)
+            elif request['type'] == 'bulk_deletion':
+                self.handle_bulk_deletion_request(request)
+            elif request['type'] == 'craq_commit':
+                self.handle_craq_commit_request(request)
+            elif request['type'] == 'read_repair':
+                self.handle_read_repair_request(request)
+            elif request['type'] == 'merkle_sync':
+                self.handle_merkle_sync_request(request)
+            elif request['type'] == 'merkle_keys':
+                self.handle_merkle_keys_request(request)
+            elif request['type'] == 'merkle_repair':
+                self.handle_merkle_repair_request(request)
+            elif request['type'] == 'tombstone_purge':
+                self.handle_tombstone_purge_request(request)
+            elif request['type'] == 'gossip':
+                self.handle_gossip_request(request)
+            elif request['type'] == 'migration':
+                self.start_stream(self.handle_migration_request, request)
+            elif request['type'] == 'key_pull':
+                self.handle_key_pull_request(request)
+            elif request['type'] == 'handoff':
+                self.handle_handoff_request(request)
+            elif request['type'] == 'hot_copy':
+                self.handle_hot_copy_request(request)
+            elif request['type'] == 'hot_withdraw':
+                self.handle_hot_withdraw_request(request)
+            elif request['type'] == 'load':
+                self.handle_load_request(request)
+            elif request['type'] == 'stats':
+                self.handle_stats_request(request)
+            elif request['type'] == 'stabilize':
+                self.handle_stabilize_request(request)
+            elif request['type'] == 'notify':
+                self.handle_notify_request(request)
+            elif request['type'] == 'departure_announcement':
+                if self.bootstrap_node["node_id"] == self.node_id and self.debugging:
+                    (f"🟡 Node {request['sender_ip']}:{request['sender_port']} is departing.")
 
         except Exception as e:
             print(f"❌ (In \"handle_request_method\") Error handling request: {e}")
         finally:
-            conn.close()
+            self.tracing.hop = None
+            self.metrics.adjust("active_handlers", -1)
+            self.metrics.observe("handler_seconds", time.perf_counter() - start_time, "type", request.get("type"))
 
     def handle_greet_request(self, request):
         """Handle a greet request."""
-        print(f"👋 Received messsage from {request['sender_ip']}:{request['sender_port']}\n{request["msg"]}")
+        print(f"👋 Received messsage from {request['sender_ip']}:{request['sender_port']}\n{request['msg']}")
         response = {
             "type": "greet_response",
             "sender_ip": self.ip,
@@ -50,128 +152,420 @@ class ChordNodeHandlers(ChordNodeCore):
             "sender_id": self.node_id,
             "msg": "O pappous einai EKEI. 1-0"
         }
-        self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_port'])# Send response back to the sender
+        self.send_response(request, response)  # Send response back to the sender
         
     def handle_join_request(self, request):
         """Handle a join request."""
         if self.debugging:
             print(f"🟡 Node {request['sender_ip']}:{request['sender_port']} is joining the network.")
 
-        if not request.get("found_predecessor", False):
-            # If predecessor is not yet found
-            if self.bootstrap_node["node_id"] == self.node_id:
-                request["consistency_type"] = self.consistency_type
-                request["replication_factor"] = self.replication_factor
+        with self.ring_lock:  # Joins through this node are applied one at a time
+            if not request.get("found_predecessor", False):
+                # If predecessor is not yet found
+                if self.bootstrap_node["node_id"] == self.node_id:
+                    request["consistency_type"] = self.consistency_type
+                    request["replication_factor"] = self.replication_factor
 
-            if (self.successor["node_id"] == self.node_id or  # Bootstrap node case
-                self.node_id < request['sender_id'] < self.successor["node_id"] or  # Normal case
-                (self.successor["node_id"] < self.node_id and  # Wrap-around case
-                (request['sender_id'] > self.node_id or request['sender_id'] < self.successor["node_id"]))):
+                if self.owns_key(request['sender_id']):
                 
-                # The new node fits between this node and its successor
-                request["found_predecessor"] = True
-                request["predecessor_ip"] = self.ip
-                request["predecessor_port"] = self.port
-                request["predecessor_id"] = self.node_id
+                    # The new node fits between this node and its successor
+                    request["found_predecessor"] = True
+                    request["predecessor_ip"] = self.ip
+                    request["predecessor_port"] = self.port
+                    request["predecessor_id"] = self.node_id
+                    request["lamport_clock"] = self.lamport_clock  # Every version this node stamped in the new range is older
 
-                # Update the successor of the current node to point to the new node
+                    # Update the successor of the current node to point to the new node
 
-                self.pass_request(request)
-                self.successor = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
+                    self.pass_request(request)
+                    self.successor = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
 
-                # Forward the request to the new node
+                    # Forward the request to the new node
+                else:
+                    # Forward the request towards the new node's predecessor
+                    self.route_request(request, request['sender_id'])
             else:
-                # Forward the request to the successor
-                self.pass_request(request)
-        else:
-            # Predecessor is found, update successor's predecessor and respond
-            self.predecessor = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
+                # Predecessor is found, update successor's predecessor and respond
+                self.predecessor = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
+                response = {
+                    "type": "join_response",
+                    "predecessor_ip": request["predecessor_ip"],
+                    "predecessor_port": request["predecessor_port"],
+                    "predecessor_id": request["predecessor_id"],
+                    "successor_ip": self.ip,
+                    "successor_port": self.port,
+                    "successor_id": self.node_id,
+                    "consistency_type": request["consistency_type"],
+                    "replication_factor": request["replication_factor"],
+                    "lamport_clock": max(request["lamport_clock"], self.lamport_clock),
+                    "members": self.membership.entries()
+                }
+                # Send response back to the new node
+                self.send_response(request, response)
+
+    def handle_stabilize_request(self, request):
+        """Answer a predecessor's stabilization with this node's current predecessor."""
+        response = {
+            "type": "stabilize_response",
+            "predecessor": self.predecessor
+        }
+        self.send_response(request, response)
+
+    def handle_notify_request(self, request):
+        """Adopt the notifying node as predecessor if it lies between the current predecessor and this node."""
+        sender = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
+        if self.membership.has_departed(sender["node_id"]):
+            return  # A late notify from a node that already left
+        with self.ring_lock:
+            if (self.predecessor["node_id"] == self.node_id or
+            self.in_arc(sender["node_id"], self.predecessor["node_id"], self.node_id)):
+                self.predecessor = sender
+
+    def handle_gossip_request(self, request):
+        """Merge a peer's membership view, and push ours back if the peer is missing updates we have."""
+        self.membership.merge(request['members'])
+        if not request.get("reply") and self.membership.is_behind(request['members']):
             response = {
-                "type": "join_response",
-                "predecessor_ip": request["predecessor_ip"],
-                "predecessor_port": request["predecessor_port"],
-                "predecessor_id": request["predecessor_id"],
-                "successor_ip": self.ip,
-                "successor_port": self.port,
-                "successor_id": self.node_id,
-                "consistency_type": request["consistency_type"],
-                "replication_factor": request["replication_factor"]
+                "type": "gossip",
+                "sender_ip": self.ip,
+                "sender_port": self.port,
+                "sender_id": self.node_id,
+                "members": self.membership.entries(),
+                "reply": True
             }
-            # Send response back to the new node
-            self.pass_request(response, target_ip=request['sender_ip'], target_port= request['sender_temp_port'])
+            self.pass_request(response, request['sender_ip'], request['sender_port'], request['sender_id'])
 
     def handle_departure_request(self, request):
         """Handle a departure request."""
         if self.debugging:
             print(f"👋 Node {request['sender_id']} is departing. Updating successor and predecessor.")
-        if self.successor["node_id"] == request["sender_id"]:
-            self.successor = {"ip": request["successor_ip"], "port": request["successor_port"], "node_id": request["successor_id"]}
-            #announce the departure to the successor
-            #say that the successor of the node departed
-            if self.debugging:
-                print(f"🟢 Successor updated to {self.successor}")
-        if self.predecessor["node_id"] == request["sender_id"]:
-            self.predecessor = {"ip": request["predecessor_ip"], "port": request["predecessor_port"], "node_id": request["predecessor_id"]}
-            if self.debugging:
-                print(f"🟢 Predecessor updated to {self.predecessor}")
+        with self.ring_lock:
+            self.remove_finger(request["sender_id"])
+            if self.successor["node_id"] == request["sender_id"]:
+                self.successor = {"ip": request["successor_ip"], "port": request["successor_port"], "node_id": request["successor_id"]}
+                #announce the departure to the successor
+                #say that the successor of the node departed
+                if self.debugging:
+                    print(f"🟢 Successor updated to {self.successor}")
+            if self.predecessor["node_id"] == request["sender_id"]:
+                self.predecessor = {"ip": request["predecessor_ip"], "port": request["predecessor_port"], "node_id": request["predecessor_id"]}
+                if self.debugging:
+                    print(f"🟢 Predecessor updated to {self.predecessor}")
 
     def handle_insertion_request(self, request):
         """Handle an insertion request."""
-        if ((self.successor["node_id"] == self.node_id or  # Bootstrap node case
-        self.node_id < request['key_hash'] < self.successor["node_id"] or  # Normal case
-        (self.successor["node_id"] < self.node_id and  # Wrap-around case
-        (request['key_hash'] > self.node_id or request['key_hash'] < self.successor["node_id"])) and request["times_copied"]==0) or
+        if ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
         0<request['times_copied']<self.replication_factor):
-            request['times_copied']+=1
+            self.pull_before_write(request)
+            self.take_copy(request)
 
 
-            self.insert_into_mongodb(request['key'], request['key_hash'], request['value'])
+            # The first copy merges and stamps the value; replicas store that exact value and version
+            request['value'], request['version'] = self.insert_into_mongodb(request['key'], request['key_hash'], request['value'], request.get('version'))
+            if self.consistency_type=="craq":
+                self.track_craq_write(request, [request['key_hash']])
 
-
-            if request['times_copied']==self.replication_factor and self.consistency_type=="linearizability":
+            if request['times_copied']==self.replication_factor and self.consistency_type in ("linearizability", "craq"):
                 response = {
                     "type": "insertion_response",
                     "key": request['key'],
                     "key_hash": request['key_hash'],
-                    "inserted": True
+                    "inserted": True,
+                    "hops": request.get("hops", 0)
                 }
-                self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+                self.send_response(request, response)
             if request['times_copied']==1 and self.consistency_type=="eventual":
                 response = {
                     "type": "insertion_response",
                     "key": request['key'],
                     "key_hash": request['key_hash'],
-                    "inserted": True
+                    "inserted": True,
+                    "hops": request.get("hops", 0)
                 }
-                self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+                self.send_response(request, response)
             if request['times_copied']<self.replication_factor:
-                self.pass_request(request)
+                self.pass_down_chain(request)
         else:
-            # Forward the request to the successor
-            self.pass_request(request)
+            # Forward the request towards the responsible node
+            self.route_request(request, request['key_hash'])
     
-    def insert_into_mongodb(self, key, key_hash, value):
-        """Insert a key-value pair into the MongoDB collection."""
-        old_value = self.query_mongodb(key_hash)
-        if old_value is not None:
-            self.remove_from_mongodb(key_hash)
-            self.collection.insert_one({"key":key, "key_hash": f"{key_hash}", "value": old_value+value})
+    def insert_into_mongodb(self, key, key_hash, value, version=None):
+        """Insert a key-value pair into the local storage engine.
+
+        Without a version this is the first copy: the value is appended to the existing one and stamped with a new
+        Lamport version. With a version, the already merged value is stored only if it is newer than the local copy.
+        Returns the value and version the key now has.
+        """
+        document = self.get_document(key_hash)
+        if version is None:
+            old_value = document["value"] if document else None
+            value = old_value+value if old_value is not None else value
+            version = self.next_version()
+        elif not self.is_newer(version, document):
+            return document["value"], document["version"]
         else:
-            self.collection.insert_one({"key":key, "key_hash": f"{key_hash}", "value": value})
+            self.observe_version(version)
+        self.store_written([self.versioned_document(key, key_hash, value, version)])
+        return value, version
+
+    def store_written(self, documents):
+        """Write documents to the storage engine and apply them to the Merkle tree and the read cache."""
+        start_time = time.perf_counter()
+        self.storage.put_many(documents)
+        self.record_storage("put_many", start_time)
+        for document in documents:
+            self.merkle.update(int(document["key_hash"]), document["version"])
+            self.cache.update(int(document["key_hash"]), document)
+            if document.get("deleted"):
+                self.tombstones[int(document["key_hash"])] = time.time()
+            else:
+                self.tombstones.pop(int(document["key_hash"]), None)
+
+    def drop_tombstones(self, tombstones):
+        """Remove the tombstones given as [key_hash, version] that are still stored with that version.
+
+        Returns the number of tombstones removed.
+        """
+        start_time = time.perf_counter()
+        purged = self.storage.purge(tombstones)
+        self.record_storage("purge", start_time)
+        versions = {int(key_hash): version for key_hash, version in tombstones}
+        for key_hash in purged:
+            self.merkle.remove(key_hash, versions[key_hash])
+            self.cache.discard(key_hash)
+            self.tombstones.pop(key_hash, None)
+        self.metrics.count("tombstones_purged", len(purged))
+        return len(purged)
+
+    def get_document(self, key_hash):
+        """Return the stored document for key_hash, tombstones included, or None, reading through the LRU cache."""
+        found, document = self.cache.get(key_hash)
+        if not found:
+            token = self.cache.begin_fill()
+            start_time = time.perf_counter()
+            document = self.storage.get(key_hash)
+            self.record_storage("get", start_time)
+            self.cache.fill(key_hash, document, token)
+        return dict(document) if document is not None else None
+
+    def get_documents(self, key_hashes):
+        """Return the stored documents for several keys with a single query, as a dict keyed by the key_hash string."""
+        start_time = time.perf_counter()
+        documents = self.storage.get_many(key_hashes)
+        self.record_storage("get_many", start_time)
+        return documents
+
+    def record_storage(self, call, start_time):
+        """Record the latency of a storage engine call, also in the trace hop of the request being handled."""
+        elapsed = time.perf_counter() - start_time
+        self.metrics.observe("storage_seconds", elapsed, "call", call)
+        hop = getattr(self.tracing, "hop", None)
+        if hop is not None:
+            hop["storage"] += elapsed
+
+    def versioned_document(self, key, key_hash, value, version):
+        """Build the document stored for a key. A value of None is a tombstone left by a deletion."""
+        document = {"key": key, "key_hash": f"{key_hash}", "value": value, "version": version}
+        if value is None:
+            document["deleted"] = True
+        return document
+
+    def next_version(self):
+        """Tick the Lamport clock and return a new version, with the node id breaking ties between nodes."""
+        with self.clock_lock:
+            self.lamport_clock += 1
+            return [self.lamport_clock, f"{self.node_id}"]
+
+    def observe_version(self, version):
+        """Advance the Lamport clock past a version received from another node."""
+        with self.clock_lock:
+            self.lamport_clock = max(self.lamport_clock, version[0])
+
+    def pull_before_write(self, request):
+        """Fetch the keys of a write this node applies as first copy, if it still pulls them after joining.
+
+        The first copy merges into the stored value and stamps the version, so it has to see the migrated document.
+        Only the write's keys are fetched, waiting at most fetch_documents' timeout rather than for the whole pull.
+        """
+        if request["times_copied"] != 0:
+            return
+        key_hashes = [item['key_hash'] for item in request['items']] if 'items' in request else [request['key_hash']]
+        wanted = {}  # source node_id -> (source, key hashes to fetch from it)
+        with self.pull_lock:
+            if not self.pulling:
+                return
+            for key_hash in key_hashes:
+                if key_hash in self.pulled_keys:
+                    continue
+                for source, lo, hi in self.pulling:
+                    if in_range(key_hash, lo, hi):
+                        wanted.setdefault(source["node_id"], (source, []))[1].append(key_hash)
+                        break
+        for source, missing in wanted.values():
+            if self.fetch_documents(source, missing):
+                with self.pull_lock:
+                    self.pulled_keys.update(missing)
+
+    def is_newer(self, version, document):
+        """Check whether version is newer than the version of a stored document (or there is no document)."""
+        if document is None:
+            return True
+        return tuple(version) > tuple(document.get("version", [0, ""]))
+
+    def take_copy(self, request):
+        """Count this node's copy of a replicated request. The first copy records the owner's range for the client."""
+        if request['times_copied']==0:
+            request["owner_range"] = self.owner_range()
+        else:
+            self.trace_role("replica")
+        request['times_copied']+=1
+        if (self.consistency_type!="eventual" and request['times_copied']<self.replication_factor and
+        self.ends_short_chain(request['key_hash'])):
+            # There are fewer servers than copies and this is the last one, so this copy completes the chain
+            request['times_copied'] = self.replication_factor
+
+    def ends_short_chain(self, key_hash):
+        """Check whether this server is the last of a chain of key_hash that has fewer servers than copies."""
+        chain = self.replica_chain(key_hash)
+        return len(chain)<self.replication_factor and (chain[-1]["ip"], chain[-1]["port"])==(self.ip, self.port)
+
+    def pass_down_chain(self, request):
+        """Pass a replicated request on to the next server of its key's chain, if this one is not the last.
+
+        Virtual nodes of a server already in the chain are skipped, since they share its storage. When this node is
+        not in the chain of its view of the ring, or the next server is gone, the request follows the successor pointer.
+        """
+        chain = self.replica_chain(request['key_hash'])
+        servers = [(node["ip"], node["port"]) for node in chain]
+        if (self.ip, self.port) not in servers:
+            self.pass_request(request)
+            return
+        position = servers.index((self.ip, self.port)) + 1
+        if (position < len(chain) and
+        not self.pass_request(request, chain[position]["ip"], chain[position]["port"], chain[position]["node_id"])):
+            self.pass_request(request)
+
+    def pass_up_chain(self, request, key_hash):
+        """Pass a CRAQ commit on to the previous server of key_hash's chain, or to the predecessor outside the chain."""
+        chain = self.replica_chain(key_hash)
+        servers = [(node["ip"], node["port"]) for node in chain]
+        if (self.ip, self.port) not in servers:
+            self.pass_request(request, self.predecessor["ip"], self.predecessor["port"], self.predecessor["node_id"])
+            return
+        position = servers.index((self.ip, self.port)) - 1
+        if position >= 0:
+            self.pass_request(request, chain[position]["ip"], chain[position]["port"], chain[position]["node_id"])
+
+    def owner_range(self):
+        """Describe the range [node_id, successor_id) this node owns, for the clients' location caches."""
+        return {"ip": self.ip, "port": self.port, "node_id": self.node_id, "end": self.successor["node_id"]}
+
+    def handle_bulk_insertion_request(self, request):
+        """Handle a batch of insertions that the client grouped for a single responsible node."""
+        if request["times_copied"]==0 and self.owns_key(request['key_hash']) and not self.keep_owned_items(request):
+            return
+        if ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
+        0<request['times_copied']<self.replication_factor):
+            self.pull_before_write(request)
+            self.take_copy(request)
+            request['items'] = self.bulk_insert_into_mongodb(request['items'])
+            if self.consistency_type=="craq":
+                self.track_craq_write(request, [item['key_hash'] for item in request['items']])
+            if ((request['times_copied']==self.replication_factor and self.consistency_type in ("linearizability", "craq")) or
+            (request['times_copied']==1 and self.consistency_type=="eventual")):
+                response = {
+                    "type": "bulk_insertion_response",
+                    "count": len(request['items']),
+                    "inserted": True,
+                    "misrouted": request.get("misrouted", []),
+                    "hops": request.get("hops", 0)
+                }
+                self.send_response(request, response)
+            if request['times_copied']<self.replication_factor:
+                self.pass_down_chain(request)
+        else:
+            # Forward the batch towards the node responsible for its first key
+            self.route_request(request, request['key_hash'])
+
+    def keep_owned_items(self, request):
+        """Keep the items of a batch this node owns; the others go back to the client in the response, to be regrouped.
+
+        The client groups batches with its view of the ring, which may be stale. Returns False if this node owns none of
+        the items, once the client has been told.
+        """
+        owned = [item for item in request['items'] if self.owns_key(item['key_hash'])]
+        if len(owned) == len(request['items']):
+            return True
+        request['misrouted'] = [item for item in request['items'] if not self.owns_key(item['key_hash'])]
+        request['items'] = owned
+        if owned:
+            request['key_hash'] = owned[0]['key_hash']
+            return True
+        response = {
+            "type": f"{request['type']}_response",
+            "count": 0,
+            "misrouted": request['misrouted'],
+            "hops": request.get("hops", 0)
+        }
+        self.send_response(request, response)
+        return False
+
+    def bulk_insert_into_mongodb(self, items):
+        """Insert a batch of key-value pairs with one read and a single batched write, following insert_into_mongodb.
+
+        Returns the items with the merged values and versions they now have, to be forwarded to the replicas.
+        """
+        documents = self.get_documents([item['key_hash'] for item in items])
+        writes = []
+        stored = []
+        for item in items:
+            document = documents.get(f"{item['key_hash']}")
+            version = item.get('version')
+            if version is None:
+                old_value = document["value"] if document else None
+                value = old_value+item['value'] if old_value is not None else item['value']
+                version = self.next_version()
+            elif not self.is_newer(version, document):
+                stored.append({"key": item['key'], "key_hash": item['key_hash'], "value": document["value"], "version": document["version"]})
+                continue
+            else:
+                value = item['value']
+                self.observe_version(version)
+            document = self.versioned_document(item['key'], item['key_hash'], value, version)
+            documents[f"{item['key_hash']}"] = document  # Later items for the same key build on this one
+            writes.append(document)
+            stored.append({"key": item['key'], "key_hash": item['key_hash'], "value": value, "version": version})
+        if writes:
+            self.store_written(writes)
+        return stored
 
     def handle_query_request(self, request):
         if self.consistency_type=="eventual":
             self.handle_query_request_eventual_consistency(request)
         elif self.consistency_type=="linearizability":
             self.handle_query_request_linearizability(request)
+        elif self.consistency_type=="craq":
+            self.handle_query_request_craq(request)
 
 
     def handle_query_request_eventual_consistency(self, request):
-        """Handle a query request."""
-        if (self.successor["node_id"] == self.node_id or  # Bootstrap node case
-            self.node_id < request['key_hash'] < self.successor["node_id"] or  # Normal case
-            (self.successor["node_id"] < self.node_id and  # Wrap-around case
-            (request['key_hash'] > self.node_id or request['key_hash'] < self.successor["node_id"]))):
+        """Handle a query request.
+
+        The responsible node answers with its own copy right away and may then send that copy to its successor
+        (read_repair_chance), which keeps the newer of the two and pushes it back if the responsible node was stale.
+        A read sent to a node holding a read-only copy of a hot key is answered from that copy, or routed to the owner
+        once the copy is gone.
+        """
+        if request.pop("hot_read", False) and self.answer_from_hot_copy(request):
+            return
+        if self.owns_key(request['key_hash']):
+            request["owner_range"] = self.owner_range()
+            if self.hot_replicas:
+                self.hot_keys.record(request['key_hash'])
+                holders = self.hot_placements.get(request['key_hash'])
+                if holders:
+                    request["hot_copies"] = holders
+            document = self.get_document(request['key_hash'])
             response = {
                 "type": "query_response",
                 "sender_ip": self.ip,
@@ -179,20 +573,125 @@ class ChordNodeHandlers(ChordNodeCore):
                 "sender_node_id": self.node_id,
                 "key": request['key'],
                 "key_hash": request['key_hash'],
-                "value": self.query_mongodb(request['key_hash'])
+                "value": document["value"] if document else None,
+                "hops": request.get("hops", 0)
             }
-            self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+            self.send_response(request, response)
+            if self.replication_factor>1 and random.random()<self.read_repair_chance:
+                # Compared after answering, so the read does not wait for the second replica
+                self.send_read_repair(request['key'], request['key_hash'], document, self.successor)
         else:
-            self.pass_request(request)
+            self.route_request(request, request['key_hash'])
 
+    def answer_from_hot_copy(self, request):
+        """Answer a query from the read-only copy of a hot key, if this node holds an unexpired one."""
+        with self.hot_lock:
+            document, expiry = self.hot_copies.get(request['key_hash'], (None, 0))
+        if document is None or expiry < time.monotonic():
+            return False
+        self.trace_role("hot_copy")
+        response = {
+            "type": "query_response",
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_node_id": self.node_id,
+            "key": request['key'],
+            "key_hash": request['key_hash'],
+            "value": document["value"],
+            "hops": request.get("hops", 0),
+            "hot_copy": True
+        }
+        self.send_response(request, response)
+        return True
+
+    def handle_hot_copy_request(self, request):
+        """Keep the read-only copies of hot keys an owner pushed here, until they expire or are withdrawn."""
+        expiry = time.monotonic() + request['ttl']
+        with self.hot_lock:
+            for document in request['documents']:
+                self.hot_copies[int(document["key_hash"])] = (document, expiry)
+            # Drop the copies that expired without being withdrawn
+            for key_hash in [key_hash for key_hash, (_, until) in self.hot_copies.items() if until < time.monotonic()]:
+                del self.hot_copies[key_hash]
+
+    def handle_hot_withdraw_request(self, request):
+        """Drop the read-only copies of keys that cooled down."""
+        with self.hot_lock:
+            for key_hash in request['key_hashes']:
+                self.hot_copies.pop(key_hash, None)
+
+    def send_read_repair(self, key, key_hash, document, node):
+        """Send this node's copy of a key (or its absence) to another replica, to compare it with its own."""
+        repair = {
+            "type": "read_repair",
+            "key": key,
+            "key_hash": key_hash,
+            "value": document["value"] if document else None,
+            "version": document["version"] if document else None,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id
+        }
+        self.pass_request(repair, node["ip"], node["port"], node["node_id"])
+
+    def handle_read_repair_request(self, request):
+        """Keep the newer of a replica's copy of a key and this node's, pushing this node's back if the replica is stale."""
+        document = self.get_document(request['key_hash'])
+        if request['version'] is not None and self.is_newer(request['version'], document):
+            if request['value'] is None:
+                self.remove_from_mongodb(request['key_hash'], request['version'], request['key'])
+            else:
+                self.insert_into_mongodb(request['key'], request['key_hash'], request['value'], request['version'])
+        elif document is not None and (request['version'] is None or tuple(document["version"]) > tuple(request['version'])):
+            sender = {"ip": request['sender_ip'], "port": request['sender_port'], "node_id": request['sender_id']}
+            self.send_read_repair(request['key'], request['key_hash'], document, sender)
+
+    def handle_merkle_sync_request(self, request):
+        """Compare the hashes of a replica's Merkle tree nodes with this node's, restricted to the synchronized range."""
+        mismatched = [
+            index for index, digest in request['hashes']
+            if self.merkle.range_hash(index, request['lo'], request['hi']) != digest
+        ]
+        response = {
+            "type": "merkle_sync_response",
+            "mismatched": mismatched
+        }
+        self.send_response(request, response)
+
+    def handle_merkle_keys_request(self, request):
+        """Answer with this node's documents for the keys whose digests differ from a replica's in mismatched leaves."""
+        theirs = {key_hash: digest for key_hash, digest in request['digests']}
+        ours = {}
+        for index in request['leaves']:
+            ours.update(self.merkle.leaf_digests(index, request['lo'], request['hi']))
+        differing = [key_hash for key_hash in theirs.keys() | ours.keys() if theirs.get(key_hash) != ours.get(key_hash)]
+        response = {
+            "type": "merkle_keys_response",
+            "differing": differing,
+            "documents": list(self.get_documents(differing).values()) if differing else []
+        }
+        self.send_response(request, response)
+
+    def handle_merkle_repair_request(self, request):
+        """Store the documents a replica found to differ during anti-entropy, keeping whichever version is newer."""
+        for document in request['documents']:
+            self.store_document(document)
+
+    def handle_tombstone_purge_request(self, request):
+        """Purge the tombstones a replica found to have outlived the grace period on every copy of its range."""
+        self.drop_tombstones(request['tombstones'])
+
+    def store_document(self, document):
+        """Store a document copied from another replica, tombstones included, unless the local copy is newer."""
+        if document.get("deleted"):
+            self.remove_from_mongodb(int(document["key_hash"]), document["version"], document["key"])
+        else:
+            self.insert_into_mongodb(document["key"], int(document["key_hash"]), document["value"], document["version"])
 
     def handle_query_request_linearizability(self, request):
-        if ((self.successor["node_id"] == self.node_id or  # Bootstrap node case
-        self.node_id < request['key_hash'] < self.successor["node_id"] or  # Normal case
-        (self.successor["node_id"] < self.node_id and  # Wrap-around case
-        (request['key_hash'] > self.node_id or request['key_hash'] < self.successor["node_id"])) and request["times_copied"]==0) or
+        if ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
         0<request['times_copied']<self.replication_factor):
-            request['times_copied']+=1
+            self.take_copy(request)
             if request['times_copied']==self.replication_factor:
                 response = {
                     "type": "query_response",
@@ -201,82 +700,359 @@ class ChordNodeHandlers(ChordNodeCore):
                     "sender_node_id": self.node_id,
                     "key": request['key'],
                     "key_hash": request['key_hash'],
-                    "value": self.query_mongodb(request['key_hash'])
+                    "value": self.query_mongodb(request['key_hash']),
+                    "hops": request.get("hops", 0)
                 }
-                self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+                self.send_response(request, response)
             elif request['times_copied']<self.replication_factor:
-                self.pass_request(request)
+                self.pass_down_chain(request)
         else:
-            # Forward the request to the successor
-            self.pass_request(request)
+            # Forward the request towards the responsible node
+            self.route_request(request, request['key_hash'])
     
+    def handle_query_request_craq(self, request):
+        """Handle a query with chain replication with apportioned queries (CRAQ).
+
+        Clients send each read to a random replica of the key's chain, given in replica_position. A replica that holds
+        the key answers from a clean copy and forwards a dirty one to the tail, which always holds the committed
+        version. A read sent to the head walks the chain up to the position in serve_at; from there on, the first
+        replica whose copy is clean answers, and dirty copies pass the query on towards the tail.
+        """
+        if request.pop("replica_position", None) is not None:
+            self.serve_craq_read(request)
+        elif ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
+        0<request['times_copied']<self.replication_factor):
+            self.take_copy(request)
+            serve_at = request.get("serve_at", self.replication_factor)
+            if (request['times_copied']==self.replication_factor or
+            (request['times_copied']>=serve_at and not self.is_dirty(request['key_hash']))):
+                self.answer_craq_read(request)
+            else:
+                self.pass_down_chain(request)
+        else:
+            # Forward the request towards the responsible node
+            self.route_request(request, request['key_hash'])
+
+    def serve_craq_read(self, request):
+        """Answer a CRAQ read a client sent straight to this replica, or pass it on to the tail or the head of the chain."""
+        chain = self.replica_chain(request['key_hash'])
+        positions = [i for i, node in enumerate(chain) if (node["ip"], node["port"]) == (self.ip, self.port)]
+        if not positions:
+            # The client's view of the ring is stale and this node holds no copy: let the head serve the read
+            request["serve_at"] = 1
+            self.route_request(request, request['key_hash'])
+        elif positions[0] == len(chain) - 1 or not self.is_dirty(request['key_hash']):
+            request['times_copied'] = positions[0]
+            self.take_copy(request)
+            self.answer_craq_read(request)
+        else:
+            # The tail answers once it counts the last copy
+            tail = chain[-1]
+            request['times_copied'] = self.replication_factor - 1
+            self.pass_request(request, tail["ip"], tail["port"], tail["node_id"])
+
+    def answer_craq_read(self, request):
+        """Answer a CRAQ read with this replica's copy, reporting its position in the chain."""
+        response = {
+            "type": "query_response",
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_node_id": self.node_id,
+            "key": request['key'],
+            "key_hash": request['key_hash'],
+            "value": self.query_mongodb(request['key_hash']),
+            "hops": request.get("hops", 0),
+            "replica_position": request['times_copied']
+        }
+        self.send_response(request, response)
+
+    def ring_index(self):
+        """Return a RingIndex of this node's view of the ring, rebuilt only once the view has changed."""
+        changes, index = self.ring_cache
+        if changes != self.membership.changes:
+            changes = self.membership.changes
+            index = RingIndex(self.overlay())
+            self.ring_cache = (changes, index)
+        return index
+
+    def replica_chain(self, key_hash):
+        """Return the nodes holding key_hash as this node sees the ring: its owner, then the replicas in chain order."""
+        index = self.ring_index()
+        return [index.nodes[position] for position in index.chain_positions([key_hash], self.replication_factor)[0]]
+
+    def track_craq_write(self, request, key_hashes):
+        """Mark a CRAQ write as dirty on the way down the chain; at the tail, send its commit back up the chain."""
+        if request['times_copied']<self.replication_factor:
+            with self.craq_lock:
+                for key_hash in key_hashes:
+                    self.dirty_versions[key_hash] = self.dirty_versions.get(key_hash, 0) + 1
+        elif self.replication_factor>1:
+            commit = {
+                "type": "craq_commit",
+                "key_hashes": key_hashes,
+                "remaining": self.replication_factor-1,
+                "sender_ip": self.ip,
+                "sender_port": self.port,
+                "sender_id": self.node_id
+            }
+            self.pass_up_chain(commit, key_hashes[0])
+
+    def handle_craq_commit_request(self, request):
+        """Mark a write committed by the tail as clean, and pass the commit on towards the head."""
+        with self.craq_lock:
+            for key_hash in request['key_hashes']:
+                pending = self.dirty_versions.get(key_hash, 0) - 1
+                if pending > 0:
+                    self.dirty_versions[key_hash] = pending
+                else:
+                    self.dirty_versions.pop(key_hash, None)
+        request['remaining']-=1
+        if request['remaining']>0:
+            request["sender_ip"], request["sender_port"], request["sender_id"] = self.ip, self.port, self.node_id
+            self.pass_up_chain(request, request['key_hashes'][0])
+
+    def is_dirty(self, key_hash):
+        """Check whether this replica holds a CRAQ write for key_hash that the tail has not committed yet."""
+        with self.craq_lock:
+            return key_hash in self.dirty_versions
+
     def query_mongodb(self, key_hash):
-        query = self.collection.find_one({"key_hash": f"{key_hash}"})
-        if query:
-            return query["value"]
+        document = self.get_document(key_hash)
+        if document:
+            return document["value"]
         else:
             return None
 
     def handle_query_all_request(self, request):
-        # Retrieve all key-value pairs from the local MongoDB
-        key_value_list = self.query_all_mongodb()
-        # Add source node information to each key-value pair
-        for kv in key_value_list:
-            kv["source_node"] = {"ip": self.ip, "port": self.port, "node_id": self.node_id}
+        """Stream every key-value pair of the local store back in chunks read from a cursor."""
+        batches = self.storage.scan_batches(batch_size=request.get("chunk_size", 500))
+        # The source node is given once per chunk for all its records
+        chunk = {
+            "type": "query_all_chunk",
+            "source_node": {"ip": self.ip, "port": self.port, "node_id": self.node_id},
+            "next": self.successor
+        }
+        self.stream_batches(request, batches, chunk, "key_value_list")
+
+    def handle_key_pull_request(self, request):
+        """Answer with the documents of a few keys, tombstones included, for a joining node about to write them."""
         response = {
-            "type": "query_all_response",
-            "next": self.successor,
-            "node_id": self.node_id,
-            "key_value_list": key_value_list
+            "type": "key_pull_response",
+            "documents": list(self.get_documents(request['key_hashes']).values())
         }
-        self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+        self.send_response(request, response)
 
-    
+    def handle_migration_request(self, request):
+        """Stream the documents of a key range, tombstones included, to a node that now holds that range."""
+        if self.debugging:
+            print(f"🚚 Migrating keys to node {request['sender_ip']}:{request['sender_port']}")
+        batches = self.storage.scan_batches(request['lo'], request['hi'], include_deleted=True, batch_size=request.get("chunk_size", 500))
+        self.stream_batches(request, batches, {"type": "migration_chunk"}, "documents", self.migration_limiter)
+
+    def handle_load_request(self, request):
+        """Report how many live keys this process stores, how many its virtual nodes own and how many it should hold.
+
+        A key should be held here when one of the virtual nodes is in its replica chain, as this node sees the ring.
+        """
+        index = RingIndex(self.overlay())
+        local = [node_id in self.virtual_nodes for node_id in index.ids]
+        keys = owned = expected = 0
+        for batch in self.storage.scan_batches():
+            keys += len(batch)
+            for chain in index.chain_positions([int(document["key_hash"]) for document in batch], self.replication_factor):
+                owned += local[chain[0]]
+                expected += any(local[position] for position in chain)
+        response = {"type": "load_response", "virtual_nodes": len(self.virtual_nodes), "keys": keys, "owned": owned,
+                    "expected": expected}
+        self.send_response(request, response)
+
+    def handle_stats_request(self, request):
+        """Report the counters, latency histograms and gauges recorded by this process."""
+        response = {"type": "stats_response", "stats": self.metrics.snapshot()}
+        self.send_response(request, response)
+
+    def handle_handoff_request(self, request):
+        """Store a batch of documents a departing node handed over, acknowledging it so the next batch can follow."""
+        response = {"type": "handoff_ack", "stored": self.store_documents(request['documents']) if request['documents'] else 0}
+        self.send_response(request, response)
+
+    def start_stream(self, handler, request):
+        """Run a handler that answers with a stream on its own thread, so the connection it came on keeps being read."""
+        def run():
+            try:
+                handler(request)
+            except Exception as e:
+                print(f"❌ Error streaming {request['type']} to {request['sender_ip']}:{request['sender_port']}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def handle_stream_credit_request(self, request):
+        """Let a stream this process sends go on: the receiver consumed chunks and has room for more, or cancelled it."""
+        window = self.stream_windows.get((request['sender_ip'], request['sender_temp_port'], request['request_id']))
+        if window is not None:
+            window.grant(request['granted'])
+
+    def stream_batches(self, request, batches, chunk, field, limiter=None):
+        """Send batches as numbered chunks of a stream answering request, the last chunk flagged.
+
+        Every chunk is a copy of chunk with the batch under field. A limiter throttles the bytes sent. At most the
+        request's window of chunks is sent ahead of the receiver's credits, so a slow receiver holds up only this stream.
+        """
+        key = (request['sender_ip'], request['sender_temp_port'], request['request_id'])
+        window = self.stream_windows[key] = StreamWindow(request.get("window", float("inf")))
+        try:
+            previous = []
+            sequence = 0
+            for batch in batches:
+                if previous:
+                    if not window.wait(sequence, self.stream_timeout):
+                        self.report_stopped_stream(request, window, sequence)
+                        return
+                    self.send_chunk(request, {**chunk, field: previous, "sequence": sequence, "last": False}, limiter)
+                    sequence += 1
+                previous = batch
+            if window.wait(sequence, self.stream_timeout):
+                self.send_chunk(request, {**chunk, field: previous, "sequence": sequence, "last": True}, limiter)
+            else:
+                self.report_stopped_stream(request, window, sequence)
+        finally:
+            self.stream_windows.pop(key, None)
+
+    def report_stopped_stream(self, request, window, sequence):
+        """Report a stream given up before its last chunk: cancelled by the receiver, or left without room for too long."""
+        if not window.cancelled:
+            print(f"⚠️ {request['type']} stream to {request['sender_ip']}:{request['sender_port']} got no room for "
+                  f"{self.stream_timeout} seconds after {sequence} chunks")
+        elif self.debugging:
+            print(f"🛑 {request['sender_ip']}:{request['sender_port']} cancelled its {request['type']} stream after {sequence} chunks")
+
+    def send_chunk(self, request, response, limiter=None):
+        """Send one chunk of a stream, waiting first for the limiter to allow its size."""
+        if limiter is not None:
+            limiter.acquire(len(encode_message(response, self.wire_format)))
+        self.send_response(request, response)
+
+    def store_documents(self, documents):
+        """Store a batch of documents copied from other nodes with one read and one batched write, keeping newer local copies."""
+        current = self.get_documents([int(document["key_hash"]) for document in documents])
+        newer = {}
+        for document in documents:
+            if self.is_newer(document["version"], newer.get(document["key_hash"]) or current.get(document["key_hash"])):
+                self.observe_version(document["version"])
+                newer[document["key_hash"]] = document
+        if newer:
+            self.store_written(list(newer.values()))
+        return len(newer)
 
     def query_all_mongodb(self):
-        """Returns a list of all key value pairs inside the local mongodb collection."""
-        query = self.collection.find({}, {"_id": 0})
-        return list(query)
+        """Returns a list of all key value pairs inside the local storage engine."""
+        return self.storage.scan()
 
 
     def handle_deletion_request(self, request):
-        if ((self.successor["node_id"] == self.node_id or  # Bootstrap node case
-        self.node_id < request['key_hash'] < self.successor["node_id"] or  # Normal case
-        (self.successor["node_id"] < self.node_id and  # Wrap-around case
-        (request['key_hash'] > self.node_id or request['key_hash'] < self.successor["node_id"])) and request["times_copied"]==0) or
+        if ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
         0<request['times_copied']<self.replication_factor):
-            request['times_copied']+=1
-
+            self.pull_before_write(request)
+            self.take_copy(request)
 
-            self.remove_from_mongodb(request['key_hash'])
 
+            request['version'] = self.remove_from_mongodb(request['key_hash'], request.get('version'), request['key'])
+            if self.consistency_type=="craq":
+                self.track_craq_write(request, [request['key_hash']])
 
-            if request['times_copied']==self.replication_factor and self.consistency_type=="linearizability":
+            if request['times_copied']==self.replication_factor and self.consistency_type in ("linearizability", "craq"):
                 response = {
                     "type": "deletion_response",
                     "key": request['key'],
                     "key_hash": request['key_hash'],
-                    "inserted": True
+                    "inserted": True,
+                    "hops": request.get("hops", 0)
                 }
-                self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+                self.send_response(request, response)
             if request['times_copied']==1 and self.consistency_type=="eventual":
                 response = {
                     "type": "deletion_response",
                     "key": request['key'],
                     "key_hash": request['key_hash'],
-                    "inserted": True
+                    "inserted": True,
+                    "hops": request.get("hops", 0)
                 }
-                self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+                self.send_response(request, response)
             if request['times_copied']<self.replication_factor:
-                self.pass_request(request)
+                self.pass_down_chain(request)
         else:
-            # Forward the request to the successor
-            self.pass_request(request)
-    
-    def remove_from_mongodb(self, key_hash):
-        """Remove a key from mongo collection."""
-        self.collection.delete_one({"key_hash": f"{key_hash}"})
+            # Forward the request towards the responsible node
+            self.route_request(request, request['key_hash'])
     
+    def remove_from_mongodb(self, key_hash, version=None, key=None):
+        """Remove a key from the local storage engine.
+
+        The key is replaced by a versioned tombstone, so that a stale replica cannot bring it back during repair.
+        Without a version this is the first copy and the deletion gets a new one. Returns the version of the key.
+        """
+        document = self.get_document(key_hash)
+        if version is None:
+            version = self.next_version()
+        elif not self.is_newer(version, document):
+            return document["version"]
+        else:
+            self.observe_version(version)
+        self.store_written([self.versioned_document(key, key_hash, None, version)])
+        return version
+
+    def handle_bulk_deletion_request(self, request):
+        """Handle a batch of deletions that the client grouped for a single responsible node."""
+        if request["times_copied"]==0 and self.owns_key(request['key_hash']) and not self.keep_owned_items(request):
+            return
+        if ((request["times_copied"]==0 and self.owns_key(request['key_hash'])) or
+        0<request['times_copied']<self.replication_factor):
+            self.pull_before_write(request)
+            self.take_copy(request)
+            request['items'] = self.bulk_remove_from_mongodb(request['items'])
+            if self.consistency_type=="craq":
+                self.track_craq_write(request, [item['key_hash'] for item in request['items']])
+            if ((request['times_copied']==self.replication_factor and self.consistency_type in ("linearizability", "craq")) or
+            (request['times_copied']==1 and self.consistency_type=="eventual")):
+                response = {
+                    "type": "bulk_deletion_response",
+                    "count": len(request['items']),
+                    "deleted": True,
+                    "misrouted": request.get("misrouted", []),
+                    "hops": request.get("hops", 0)
+                }
+                self.send_response(request, response)
+            if request['times_copied']<self.replication_factor:
+                self.pass_down_chain(request)
+        else:
+            # Forward the batch towards the node responsible for its first key
+            self.route_request(request, request['key_hash'])
+
+    def bulk_remove_from_mongodb(self, items):
+        """Replace a batch of keys with tombstones using one read and a single batched write, following remove_from_mongodb.
+
+        Returns the items with the versions of their deletions, to be forwarded to the replicas.
+        """
+        documents = self.get_documents([item['key_hash'] for item in items])
+        writes = []
+        stored = []
+        for item in items:
+            document = documents.get(f"{item['key_hash']}")
+            version = item.get('version')
+            if version is None:
+                version = self.next_version()
+            elif not self.is_newer(version, document):
+                stored.append({"key": item['key'], "key_hash": item['key_hash'], "version": document["version"]})
+                continue
+            else:
+                self.observe_version(version)
+            document = self.versioned_document(item['key'], item['key_hash'], None, version)
+            documents[f"{item['key_hash']}"] = document
+            writes.append(document)
+            stored.append({"key": item['key'], "key_hash": item['key_hash'], "version": version})
+        if writes:
+            self.store_written(writes)
+        return stored
+
     def handle_overlay_request(self, request):
         """Handle an overlay request."""
         response = {
@@ -284,4 +1060,19 @@ class ChordNodeHandlers(ChordNodeCore):
             "sender": {"ip":self.ip,"port":self.port,"node_id":self.node_id},
             "next": self.successor
         }
-        self.pass_request(response, target_ip=request['sender_ip'], target_port=request['sender_temp_port'])
+        self.send_response(request, response)
+
+    def handle_lookup_request(self, request):
+        """Handle a lookup request, answering with the node responsible for the key."""
+        if self.owns_key(request['key_hash']):
+            request["owner_range"] = self.owner_range()
+            response = {
+                "type": "lookup_response",
+                "key_hash": request['key_hash'],
+                "owner": {"ip": self.ip, "port": self.port, "node_id": self.node_id},
+                "successor": self.successor,
+                "hops": request.get("hops", 0)
+            }
+            self.send_response(request, response)
+        else:
+            self.route_request(request, request['key_hash'])
@@ -1,97 +1,467 @@
+import queue
+import random
 import socket
-import json
+import time
+from chord_metrics import HOP_BOUNDS
 from chord_node_handlers import ChordNodeHandlers
-from pymongo import MongoClient
+from chord_protocol import encode_message
+from chord_ring_index import RingIndex, in_range
 
 class ChordNodeOperations(ChordNodeHandlers):
+    def expect_reply(self, request, timeout=10):
+        """Tag a request with a fresh request id and this node's reply endpoint, returning the future of its response.
+
+        The future fails with TimeoutError if no response arrives within timeout seconds.
+        """
+        start_time = time.perf_counter()
+        request_id, future = self.replies.register(timeout)
+        request["request_id"] = request_id
+        request["sender_temp_port"] = self.reply_port
+        future.add_done_callback(self.learn_location)
+        future.add_done_callback(lambda future: self.record_operation(future, request["type"], start_time))
+        return future
+
+    def record_operation(self, future, request_type, start_time):
+        """Record the latency of an operation of this node and the hops its request took to the node that answered."""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.metrics.count("timeouts", 1, "type", request_type)
+            return
+        self.metrics.observe("operation_seconds", time.perf_counter() - start_time, "type", request_type)
+        response = future.result()
+        if "hops" in response:
+            self.metrics.observe("hops", response["hops"], "type", request_type, HOP_BOUNDS)
+        if "trace" in response:
+            trace = response["trace"]
+            trace["type"], trace["finished"] = request_type, time.time()
+            self.traces.append(trace)
+
+    def start_trace(self, request):
+        """Attach a trace context to a sampled share (trace_sample) of this node's operations.
+
+        Every node handling the request appends a hop to it, and the response brings the whole trace back.
+        """
+        if self.trace_sample and random.random() < self.trace_sample:
+            request["trace"] = {"trace_id": f"{random.getrandbits(64):016x}", "started": time.time(), "hops": []}
+
+    def learn_location(self, future):
+        """Cache the range of the node that owned the key of a completed operation, and the copies of a hot key."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        response = future.result()
+        if "owner_range" in response:
+            self.locations.update(response["owner_range"])
+        if "hot_copies" in response:
+            with self.hot_lock:
+                self.hot_routes[response["key_hash"]] = (response["hot_copies"], time.monotonic() + 3 * self.hot_interval)
+
+    def hot_route(self, key_hash):
+        """Pick a node to read a hot key from: one of its advertised copies or, with the same chance, its owner (None)."""
+        with self.hot_lock:
+            nodes, expiry = self.hot_routes.get(key_hash, ([], 0))
+            if expiry < time.monotonic():
+                self.hot_routes.pop(key_hash, None)
+                return None
+        return random.choice(nodes + [None])
+
+    def send_to_owner(self, request):
+        """Send a keyed request straight to the owner cached for its key, or to this node to be routed around the ring.
+
+        A stale cache entry only costs extra hops, since a node that no longer owns the key routes the request on.
+        """
+        owner = self.locations.find(request["key_hash"])
+        if owner is not None and owner["node_id"] != self.node_id:
+            if self.pass_request(request, owner["ip"], owner["port"], owner["node_id"]):
+                return
+            self.locations.invalidate(owner["node_id"])
+        self.pass_request(request, self.ip, self.port, self.node_id)
+
+    def wait_reply(self, future):
+        """Wait for the response to a request sent after expect_reply. Returns None on timeout."""
+        try:
+            return future.result()
+        except TimeoutError:
+            print("⏳ Timeout: No response received within the timeout period.")
+            return None
+
     def greet(self, target_ip, target_port):
         if target_port == None and target_ip == None:
             target_ip = self.bootstrap_node["ip"]
             target_port = self.bootstrap_node["port"]
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-                temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-                temp_port = temp_socket.getsockname()[1]
-                temp_socket.listen(1)
-                temp_socket.settimeout(10)
-                print(f"🔍 Listening for response on temporary port {temp_port}")
-
-                request = {
-                    "type": "greet",
-                    "sender_ip": self.ip,
-                    "sender_port": temp_port,
-                    "sender_id": self.node_id,
-                    "target_id": self.hash_function(f"{target_ip}:{target_port}"),
-                    "msg": "Einai o pappous ekei?"
-                }
-                self.pass_request(request=request, target_ip=target_ip, target_port=target_port)
-
-                # Wait for the response on the temporary socket
-                print("🕒 Waiting for response...")
-                try:
-                    conn, _ = temp_socket.accept()
-                    data = conn.recv(1024).decode()
-                    if data:
-                        response = json.loads(data)
-                        print(f"📨 Received response: {response['msg']}")
-                    conn.close()
-                except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
+        request = {
+            "type": "greet",
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "target_id": self.hash_function(f"{target_ip}:{target_port}"),
+            "msg": "Einai o pappous ekei?"
+        }
+        future = self.expect_reply(request)
+        self.pass_request(request=request, target_ip=target_ip, target_port=target_port)
+
+        print("🕒 Waiting for response...")
+        response = self.wait_reply(future)
+        if response:
+            print(f"📨 Received response: {response['msg']}")
 
     def join(self):
         """Join an existing Chord network using the bootstrap node."""
         print(f"🟡 Joining network via bootstrap node {self.bootstrap_node}")
 
-        # Create a temporary socket to listen for the response
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(10)
-            print(f"🔍 Listening for response on temporary port {temp_port}")
+        request = {
+            "type": "join",
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "found_predecessor": False  # Initialize found_predecessor as False
+        }
+        future = self.expect_reply(request)
+
+        # Send the join request to the bootstrap node
+        if self.pass_request(request=request, target_ip=self.bootstrap_node["ip"], target_port=self.bootstrap_node["port"],
+                             target_id=self.bootstrap_node["node_id"]):
+            print("🕒 Waiting for response...")
+            response = self.wait_reply(future)
+        else:
+            self.replies.cancel(request["request_id"])
+            response = None
+        if response:
+            print(f"📨 Received response: {response}")
+            self.successor = {
+                "ip": response['successor_ip'],
+                "port": response['successor_port'],
+                "node_id": response['successor_id']
+            }
+            self.predecessor = {
+                "ip": response['predecessor_ip'],
+                "port": response['predecessor_port'],
+                "node_id": response['predecessor_id']
+            }
+            self.consistency_type = response["consistency_type"]
+            self.replication_factor = response["replication_factor"]
+            self.observe_version([response["lamport_clock"], ""])  # Stamp writes after those the predecessor stamped
+            self.membership.merge(response["members"])
+            print(f"🟢 Successfully joined network. Successor: {self.successor}, Predecessor: {self.predecessor}")
+        else:
+            self.running = False
+            self.virtual_nodes.pop(self.node_id, None)
+            if self.host is self:
+                # Release the port bound for the join and the sockets opened for it, the node never starts serving
+                self.connection_pool.close_all()
+                for listening in (self.reply_socket, self.server_socket):
+                    try:
+                        listening.shutdown(socket.SHUT_RDWR)  # Unblocks the reply thread's accept()
+                    except OSError:
+                        pass
+                    listening.close()
+            raise ConnectionError(f"No response to the join request from bootstrap node "
+                                  f"{self.bootstrap_node['ip']}:{self.bootstrap_node['port']}")
+
+    def lookup(self, key_hash):
+        """Find the node responsible for key_hash, returning the lookup response or None on timeout."""
+        request = {
+            "type": "lookup",
+            "key_hash": key_hash,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id
+        }
+        future = self.expect_reply(request)
+        self.route_request(request, key_hash)
+        try:
+            return future.result()
+        except TimeoutError:
+            if self.debugging:
+                print("⏳ Timeout: No lookup response received within the timeout period.")
+        return None
 
+    def fix_fingers_loop(self):
+        """Periodically refresh the finger table (Chord's fix_fingers)."""
+        while self.running:
+            time.sleep(self.fix_fingers_interval)
+            try:
+                self.fix_next_finger()
+            except Exception as e:
+                print(f"❌ Error fixing fingers: {e}")
+
+    def fix_next_finger(self):
+        """Refresh the next finger, along with every following finger that falls in the same node's range."""
+        i = self.next_finger
+        start = (self.node_id + 2**i) % 2**160
+        if self.owns_key(start):
+            owner = {"ip": self.ip, "port": self.port, "node_id": self.node_id}
+            owner_successor = self.successor
+        else:
+            response = self.lookup(start)
+            if response is None:
+                return
+            owner, owner_successor = response["owner"], response["successor"]
+
+        while True:
+            self.finger_table[i] = owner
+            i = (i + 1) % 160
+            start = (self.node_id + 2**i) % 2**160
+            if i == 0 or not (start == owner["node_id"] or self.in_arc(start, owner["node_id"], owner_successor["node_id"])):
+                break
+        self.next_finger = i
+
+    def stabilize_loop(self):
+        """Periodically check and repair the ring pointers (Chord's stabilize and notify)."""
+        while self.running:
+            time.sleep(self.stabilize_interval)
+            try:
+                self.stabilize()
+            except Exception as e:
+                print(f"❌ Error stabilizing: {e}")
+
+    def stabilize(self):
+        """Adopt the successor's predecessor as successor if it joined in between, then notify the successor."""
+        successor = self.successor
+        if successor["node_id"] == self.node_id:
+            candidate = self.predecessor
+        else:
+            response = self.ask_node(successor, {"type": "stabilize"}, timeout=2)
+            if response is None:
+                return
+            candidate = response["predecessor"]
+        with self.ring_lock:
+            if (candidate is not None and self.successor is successor and not self.membership.has_departed(candidate["node_id"]) and
+            self.in_arc(candidate["node_id"], self.node_id, successor["node_id"])):
+                self.successor = candidate
+        if self.running and self.successor["node_id"] != self.node_id:
             request = {
-                "type": "join",
+                "type": "notify",
                 "sender_ip": self.ip,
                 "sender_port": self.port,
-                "sender_temp_port": temp_port,
-                "sender_id": self.node_id,
-                "found_predecessor": False  # Initialize found_predecessor as False
+                "sender_id": self.node_id
             }
+            self.pass_request(request)
 
-            # Send the join request to the bootstrap node
-            self.pass_request(request=request, target_ip=self.bootstrap_node["ip"], target_port=self.bootstrap_node["port"])
+    def hot_keys_loop(self):
+        """Periodically place read-only copies of the hot keys this node owns, and withdraw those of cooled keys."""
+        while self.running:
+            time.sleep(self.hot_interval)
+            if self.consistency_type != "eventual" or not self.hot_replicas:
+                continue
+            try:
+                self.refresh_hot_copies()
+            except Exception as e:
+                print(f"❌ Error placing hot key copies: {e}")
+
+    def refresh_hot_copies(self):
+        """Push the current documents of the owned hot keys to nodes past the replica set, and withdraw cooled keys.
+
+        The copies are pushed again every hot_interval, so a read from a copy is at most that stale, and expire after
+        three intervals should a withdrawal be lost.
+        """
+        hot = {key_hash for key_hash in self.hot_keys.hot() if self.owns_key(key_hash)}
+        cooled = {}
+        for key_hash in set(self.hot_placements) - hot:
+            for node in self.hot_placements.pop(key_hash):
+                cooled.setdefault((node["ip"], node["port"], node["node_id"]), []).append(key_hash)
+        for (ip, port, node_id), key_hashes in cooled.items():
+            request = {"type": "hot_withdraw", "sender_ip": self.ip, "sender_port": self.port, "sender_id": self.node_id,
+                       "key_hashes": key_hashes}
+            self.pass_request(request, ip, port, node_id)
+        if not hot:
+            return
+        nodes = self.physical_nodes(self.overlay())
+        placements = {}  # Holders -> the hot keys copied to them
+        for key_hash in hot:
+            # The servers of the replica chain already store the key, this one included
+            chain = {(node["ip"], node["port"]) for node in self.replica_chain(key_hash)} | {(self.ip, self.port)}
+            holders = tuple((node["ip"], node["port"], node["node_id"]) for node in nodes
+                            if (node["ip"], node["port"]) not in chain)[:self.hot_replicas]
+            if holders:
+                placements.setdefault(holders, []).append(key_hash)
+        documents = self.get_documents(list(hot))
+        for holders, key_hashes in placements.items():
+            copies = [documents[f"{key_hash}"] for key_hash in key_hashes if f"{key_hash}" in documents]
+            for ip, port, node_id in holders:
+                request = {"type": "hot_copy", "sender_ip": self.ip, "sender_port": self.port, "sender_id": self.node_id,
+                           "documents": copies, "ttl": 3 * self.hot_interval}
+                self.pass_request(request, ip, port, node_id)
+            if self.debugging:
+                print(f"🔥 {len(copies)} hot keys copied to {len(holders)} nodes")
+            for document in copies:
+                self.hot_placements[int(document["key_hash"])] = [
+                    {"ip": ip, "port": port, "node_id": node_id} for ip, port, node_id in holders
+                ]
+
+    def gossip_loop(self):
+        """Periodically send the full membership view to a random live member (push-pull gossip)."""
+        while self.running:
+            time.sleep(self.gossip_interval)
+            peer = self.membership.random_peer()
+            if peer is None:
+                continue
+            request = {
+                "type": "gossip",
+                "sender_ip": self.ip,
+                "sender_port": self.port,
+                "sender_id": self.node_id,
+                "members": self.membership.entries()
+            }
+            self.pass_request(request, peer["ip"], peer["port"], peer["node_id"])
 
-            # Wait for the response on the temporary socket
-            print("🕒 Waiting for response...")
+    def anti_entropy_loop(self):
+        """Periodically synchronize this node's range with the replicas that hold copies of it."""
+        while self.running:
+            time.sleep(self.anti_entropy_interval)
             try:
-                conn, _ = temp_socket.accept()
-                data = conn.recv(1024).decode()
-                if data:
-                    response = json.loads(data)
-                    print(f"📨 Received response: {response}")
-                    self.successor = {
-                        "ip": response['successor_ip'],
-                        "port": response['successor_port'],
-                        "node_id": response['successor_id']
-                    }
-                    self.predecessor = {
-                        "ip": response['predecessor_ip'],
-                        "port": response['predecessor_port'],
-                        "node_id": response['predecessor_id']
-                    }
-                    self.consistency_type = response["consistency_type"]
-                    self.replication_factor = response["replication_factor"]
-                    print(f"🟢 Successfully joined network. Successor: {self.successor}, Predecessor: {self.predecessor}")
-                conn.close()
-            except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
-                    self.close()
+                self.anti_entropy()
+            except Exception as e:
+                print(f"❌ Error during anti-entropy: {e}")
+
+    def anti_entropy(self):
+        """Compare the range [node_id, successor_id) with each of the next replication_factor-1 nodes and repair the differences.
+
+        When every replica answered and none differed, tombstones older than tombstone_grace are purged from all
+        the copies. Returns the number of keys that differed.
+        """
+        if self.successor["node_id"] == self.node_id:
+            return 0
+        lo, hi = self.node_id, self.successor["node_id"]
+        replicas = self.successor_list(self.replication_factor - 1)
+        differing = 0
+        agreed = True
+        for replica in replicas:
+            repaired = self.synchronize_range(replica, lo, hi)
+            if repaired is None:
+                agreed = False
+                continue
+            differing += repaired
+            if repaired and self.debugging:
+                print(f"🔧 Anti-entropy repaired {repaired} keys with node {replica['ip']}:{replica['port']}")
+        if agreed and not differing:
+            self.purge_tombstones(replicas, lo, hi)
+        return differing
+
+    def purge_tombstones(self, replicas, lo, hi):
+        """Purge the tombstones in the clockwise range [lo, hi) stored longer than tombstone_grace, here and on the replicas.
+
+        Only called once anti-entropy found the replicas in agreement, so every copy holds the same tombstones. Each
+        is purged only where it is still stored with the same version, so a write made since then is kept.
+        """
+        expired = time.time() - self.tombstone_grace
+        key_hashes = [
+            key_hash for key_hash, stored_at in list(self.tombstones.items())
+            if stored_at <= expired and in_range(key_hash, lo, hi)
+        ]
+        if not key_hashes:
+            return 0
+        tombstones = [
+            [int(document["key_hash"]), document["version"]]
+            for document in self.get_documents(key_hashes).values() if document.get("deleted")
+        ]
+        request = {
+            "type": "tombstone_purge",
+            "tombstones": tombstones,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id
+        }
+        for replica in replicas:
+            self.pass_request(request, replica["ip"], replica["port"], replica["node_id"])
+        purged = self.drop_tombstones(tombstones)
+        if purged and self.debugging:
+            print(f"🧹 Purged {purged} tombstones older than {self.tombstone_grace}s")
+        return purged
+
+    def successor_list(self, count):
+        """Return up to count nodes following this one on the ring, by asking each successor for the next."""
+        nodes = []
+        node = self.successor
+        while node["node_id"] != self.node_id and len(nodes) < count:
+            nodes.append(node)
+            if len(nodes) == count:
+                break
+            response = self.ask_node(node, {"type": "overlay"})
+            if response is None:
+                break
+            node = response["next"]
+        return nodes
+
+    def ask_node(self, node, request, timeout=10):
+        """Send a request to a node and wait for its response. Returns None if it could not be sent or timed out."""
+        request.update({"sender_ip": self.ip, "sender_port": self.port, "sender_id": self.node_id})
+        future = self.expect_reply(request, timeout)
+        if not self.pass_request(request, node["ip"], node["port"], node["node_id"]):
+            self.replies.cancel(request["request_id"])
+            return None
+        try:
+            return future.result()
+        except TimeoutError:
+            return None
+
+    def synchronize_range(self, replica, lo, hi):
+        """Synchronize the keys in the clockwise range [lo, hi) with a replica through their Merkle trees.
+
+        Starting from the root, only the children of tree nodes whose hashes differ are compared, one level per
+        round trip; at mismatched leaves the two nodes exchange the documents of the keys whose digests differ,
+        and each keeps the newer version. Returns the number of differing keys, or None if the replica did not answer.
+        """
+        level = [1]
+        differing = 0
+        while level:
+            request = {
+                "type": "merkle_sync",
+                "lo": lo,
+                "hi": hi,
+                "hashes": [[index, self.merkle.range_hash(index, lo, hi)] for index in level]
+            }
+            response = self.ask_node(replica, request)
+            if response is None:
+                return None
+            leaves = [index for index in response["mismatched"] if self.merkle.is_leaf(index)]
+            if leaves:
+                repaired = self.synchronize_leaves(replica, lo, hi, leaves)
+                if repaired is None:
+                    return None
+                differing += repaired
+            level = [child for index in response["mismatched"] if not self.merkle.is_leaf(index) for child in (2 * index, 2 * index + 1)]
+        return differing
+
+    def synchronize_leaves(self, replica, lo, hi, leaves):
+        """Exchange the documents of the differing keys in mismatched leaves. Returns how many keys differed."""
+        digests = {}
+        for index in leaves:
+            digests.update(self.merkle.leaf_digests(index, lo, hi))
+        request = {
+            "type": "merkle_keys",
+            "lo": lo,
+            "hi": hi,
+            "leaves": leaves,
+            "digests": [[key_hash, digest] for key_hash, digest in digests.items()]
+        }
+        response = self.ask_node(replica, request)
+        if response is None:
+            return None
+        for document in response["documents"]:
+            self.store_document(document)
+        ours = list(self.get_documents(response["differing"]).values()) if response["differing"] else []
+        if ours:
+            # The replica keeps whichever of its copy and ours is newer
+            repair = {
+                "type": "merkle_repair",
+                "documents": ours,
+                "sender_ip": self.ip,
+                "sender_port": self.port,
+                "sender_id": self.node_id
+            }
+            self.pass_request(repair, replica["ip"], replica["port"], replica["node_id"])
+        return len(response["differing"])
 
     def depart(self):
-        """Depart from the Chord network gracefully."""
+        """Depart from the Chord network gracefully, handing the stored keys over before stopping."""
+        if self.host is self:
+            for node in list(self.virtual_nodes.values()):
+                if node is not self:
+                    node.depart()  # The other virtual nodes leave first, while the shared server still answers
+        handoffs = self.handoff_ranges()
+        self.membership.depart()  # Piggybacked on the departure messages, then gossiped on by the neighbours
         if self.successor["node_id"] != self.node_id: 
             # Notify the successor to update its predecessor
             request = {
@@ -107,49 +477,144 @@ class ChordNodeOperations(ChordNodeHandlers):
                 "predecessor_id": self.predecessor["node_id"]
             }
             self.pass_request(request)
-            self.pass_request(request=request,target_ip=self.predecessor["ip"],target_port=self.predecessor["port"])
+            self.pass_request(request=request,target_ip=self.predecessor["ip"],target_port=self.predecessor["port"],
+                              target_id=self.predecessor["node_id"])
             if self.debugging:
                 request["type"] = "departure_announcement"
-                self.pass_request(request, self.bootstrap_node["ip"], self.bootstrap_node["port"])
+                self.pass_request(request, self.bootstrap_node["ip"], self.bootstrap_node["port"], self.bootstrap_node["node_id"])
+            # New writes now go to the neighbours, which keep the newer version of any key handed over late
+            self.handle_replication_upon_departure(handoffs)
 
         self.stop()
+
+    def handoff_ranges(self):
+        """Return the (node, lo, hi) transfers that keep every key this node holds at k copies once it leaves.
+
+        Every range [id_i, id_i+1) of the ring whose chain includes this node's server goes to the servers that join
+        its chain once this node is gone. Other virtual nodes of the server may stay in the chain, since the chains
+        count servers rather than nodes; adjacent ranges going to the same node are sent as one.
+        """
+        # Virtual nodes of this server that already left may linger in the view; they no longer hold anything
+        nodes = [node for node in self.overlay()
+                 if (node["ip"], node["port"]) != (self.ip, self.port) or node["node_id"] in self.virtual_nodes]
+        remaining = [node for node in nodes if node["node_id"] != self.node_id]
+        if not remaining:
+            return []
+        before, after = RingIndex(nodes), RingIndex(remaining)
+        k = self.replication_factor
+        handoffs = []
+        for position, chain in enumerate(before.chain_positions(before.ids, k)):
+            holders = {(before.nodes[i]["ip"], before.nodes[i]["port"]) for i in chain}
+            if (self.ip, self.port) not in holders:
+                continue
+            lo, hi = before.ids[position], before.ids[(position + 1) % len(before.ids)]
+            for target in after.chain_positions([lo], k)[0]:
+                if (after.nodes[target]["ip"], after.nodes[target]["port"]) not in holders:
+                    self.add_transfer(handoffs, after.nodes[target], lo, hi)
+        return handoffs
+
+    def hand_off(self, target, lo, hi, batch_size=500):
+        """Send the documents of the clockwise range [lo, hi) to a node in batches, each acknowledged before the next."""
+        sent = stored = 0
+        for batch in self.storage.scan_batches(lo, hi, include_deleted=True, batch_size=batch_size):
+            request = {"type": "handoff", "documents": batch}
+            self.migration_limiter.acquire(len(encode_message(request, self.wire_format)))
+            response = self.ask_node(target, request)
+            if response is None:
+                print(f"❌ Handoff to {target['ip']}:{target['port']} stopped: batch not acknowledged")
+                return stored
+            sent += len(batch)
+            stored += response["stored"]
+            if self.debugging:
+                print(f"📦 Handoff to {target['ip']}:{target['port']}: {sent} documents sent, {stored} stored")
+        print(f"✅ Handed {stored} of {sent} documents over to {target['ip']}:{target['port']}")
+        return stored
     
     def insert(self, key, value=None):
         """Insert a key-value pair into the Chord network."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(10)
-
-
-            key_hash = self.hash_function(key)
-            print(f"🔍 Querying for key {key} with hash {key_hash}")
-            request = {
-                "type": "insertion",
-                "key": key,
-                "key_hash": key_hash,
-                "value": key if value is None else value,
-                "sender_ip": self.ip,
-                "sender_port": self.port,
-                "sender_temp_port": temp_port,
-                "sender_id": self.node_id,
-                "times_copied": 0
-            }
-            self.pass_request(request,self.ip,self.port)
-            print("🕒 Waiting for response...")
-            conn, _ = temp_socket.accept()
-            data = conn.recv(1024).decode()
-            try:    
-                if data:
-                    response = json.loads(data)
-                    if response:
-                        print(f"📨 Song was inserted successfully")
-                conn.close()
-            except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
-            
+        print(f"🔍 Querying for key {key} with hash {self.hash_function(key)}")
+        future = self.insert_async(key, value)
+        print("🕒 Waiting for response...")
+        response = self.wait_reply(future)
+        if response:
+            print(f"📨 Song was inserted successfully after {response.get('hops', 0)} hops")
+        return response
+
+    def insert_async(self, key, value=None, timeout=10):
+        """Send an insertion without waiting for it. Returns a future of the response that fails after timeout seconds."""
+        request = {
+            "type": "insertion",
+            "key": key,
+            "key_hash": self.hash_function(key),
+            "value": key if value is None else value,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "times_copied": 0
+        }
+        self.start_trace(request)
+        future = self.expect_reply(request, timeout)
+        self.send_to_owner(request)
+        return future
+
+    def insert_many(self, items, batch_size=500):
+        """Insert many (key, value) pairs, sending one bulk_insertion per responsible node and batch."""
+        entries = [
+            {"key": key, "key_hash": self.hash_function(key), "value": key if value is None else value}
+            for key, value in items
+        ]
+        acknowledged = self.send_bulk("bulk_insertion", entries, batch_size)
+        print(f"📨 {acknowledged}/{len(entries)} songs were inserted successfully")
+        return acknowledged
+
+    def delete_many(self, keys, batch_size=500):
+        """Delete many keys, sending one bulk_deletion per responsible node and batch."""
+        entries = [{"key": key, "key_hash": self.hash_function(key)} for key in keys]
+        acknowledged = self.send_bulk("bulk_deletion", entries, batch_size)
+        print(f"📨 {acknowledged}/{len(entries)} songs were deleted successfully")
+        return acknowledged
+
+    def send_bulk(self, request_type, entries, batch_size, attempts=3):
+        """Send entries grouped by responsible node, waiting for every batch. Returns how many entries were acknowledged.
+
+        Owners answer with the entries they do not own, grouped with a stale view of the ring; those are regrouped with
+        the view the responses brought up to date and sent again, up to attempts times in all.
+        """
+        acknowledged = 0
+        for attempt in range(attempts):
+            nodes = self.overlay() or [{"ip": self.ip, "port": self.port, "node_id": self.node_id}]
+            pending = []
+            for owner, owner_entries in self.group_by_owner(entries, nodes):
+                for start in range(0, len(owner_entries), batch_size):
+                    batch = owner_entries[start:start + batch_size]
+                    request = {
+                        "type": request_type,
+                        "key_hash": batch[0]["key_hash"],  # Routing key, in case the owner changed since the overlay was read
+                        "items": batch,
+                        "sender_ip": self.ip,
+                        "sender_port": self.port,
+                        "sender_id": self.node_id,
+                        "times_copied": 0
+                    }
+                    future = self.expect_reply(request)
+                    self.pass_request(request, owner["ip"], owner["port"], owner["node_id"])
+                    pending.append((request, future))
+
+            entries = []
+            for request, future in pending:
+                response = self.wait_reply(future)
+                if response:
+                    acknowledged += response["count"]
+                    entries.extend(response.get("misrouted", []))
+            if not entries:
+                break
+            print(f"🔀 {len(entries)} entries reached a node that does not own them, regrouping")
+        return acknowledged
+
+    def group_by_owner(self, entries, nodes):
+        """Group entries by the node responsible for their key_hash. Returns a list of (node, entries) pairs."""
+        groups = RingIndex(nodes).group([entry["key_hash"] for entry in entries])
+        return [(owner, [entries[i] for i in indices]) for owner, indices in groups]
 
     def query(self, key):
         """Query for a key in the Chord network."""
@@ -161,207 +626,367 @@ class ChordNodeOperations(ChordNodeHandlers):
                 print(f"{entry}\n")
             return
         
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(10)
-            
-            key_hash = self.hash_function(key)
-            print(f"🔍 Querying for key {key} with hash {key_hash}")
-            request = {
-                "type": "query",
-                "key": key,
-                "key_hash": key_hash,
-                "sender_ip": self.ip,
-                "sender_port": self.port,
-                "sender_temp_port": temp_port,
-                "sender_id": self.node_id,
-                "times_copied": 0
-            }
-            self.pass_request(request,self.ip,self.port)
-            print("🕒 Waiting for response...")
-            try:
-                conn, _ = temp_socket.accept()
-                data = conn.recv(1024).decode()
-                if data:
-                    response = json.loads(data)
-                    if response["value"]==None:
-                        print(f"📨 Song \"{key}\" was not found.")
-                    else:
-                        print(f"📨 Song \"{key}\" was found in node {response['sender_ip']}:{response['sender_port']}({response["sender_node_id"]//2**155}) with value {response['value']}")
-                conn.close()
-            except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
+        print(f"🔍 Querying for key {key} with hash {self.hash_function(key)}")
+        future = self.query_async(key)
+        print("🕒 Waiting for response...")
+        response = self.wait_reply(future)
+        if response:
+            if response["value"]==None:
+                print(f"📨 Song \"{key}\" was not found after {response.get('hops', 0)} hops.")
+            else:
+                print(f"📨 Song \"{key}\" was found in node {response['sender_ip']}:{response['sender_port']}({response['sender_node_id']//2**155}) with value {response['value']} after {response.get('hops', 0)} hops")
+        return response
+
+    def query_async(self, key, timeout=10):
+        """Send a query without waiting for it. Returns a future of the response that fails after timeout seconds."""
+        request = {
+            "type": "query",
+            "key": key,
+            "key_hash": self.hash_function(key),
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "times_copied": 0
+        }
+        self.start_trace(request)
+        future = self.expect_reply(request, timeout)
+        if self.consistency_type == "craq":
+            # Any replica with a clean copy may answer, so spread reads over the chain
+            chain = self.replica_chain(request["key_hash"])
+            position = random.randrange(len(chain))
+            request["replica_position"] = position + 1
+            if self.pass_request(request, chain[position]["ip"], chain[position]["port"], chain[position]["node_id"]):
+                return future
+            del request["replica_position"]
+        holder = self.hot_route(request["key_hash"]) if self.consistency_type == "eventual" else None
+        if holder is not None:
+            request["hot_read"] = True
+            if self.pass_request(request, holder["ip"], holder["port"], holder["node_id"]):
+                return future
+            del request["hot_read"]
+        self.send_to_owner(request)
+        return future
 
     def query_all(self):
-        """Query all keys in the Chord network without modifying any node's database."""
-        network_overlay = self.overlay()
-        aggregated_keys = []
-        for node in network_overlay:
-            keys = self.get_all_keys_from_node(node)
-            aggregated_keys.extend(keys)
-        return aggregated_keys
-
-
-    
+        """Yield every key-value pair in the Chord network as it arrives, without modifying any node's database."""
+        network_overlay = self.overlay() or [{"ip": self.ip, "port": self.port, "node_id": self.node_id}]
+        return self.stream_keys(self.physical_nodes(network_overlay))
+
+    def physical_nodes(self, nodes):
+        """Keep one of the virtual nodes sharing each server, since they also share its storage."""
+        physical = {}
+        for node in nodes:
+            physical.setdefault((node["ip"], node["port"]), node)
+        return list(physical.values())
+
+    def load_report(self):
+        """Return, for every physical node, its virtual nodes, the share of the ring they own and its key counts.
+
+        keys counts every live key stored, replicas included; owned counts those in the ranges of its virtual nodes,
+        and expected those of the stored keys whose replica chain includes one of its virtual nodes.
+        """
+        nodes = self.overlay()
+        shares = {}
+        for i, node in enumerate(nodes):
+            arc = (nodes[(i + 1) % len(nodes)]["node_id"] - node["node_id"]) % 2**160 or 2**160
+            shares[(node["ip"], node["port"])] = shares.get((node["ip"], node["port"]), 0) + arc / 2**160
+        report = []
+        for (ip, port), share in shares.items():
+            response = self.ask_node({"ip": ip, "port": port, "node_id": None}, {"type": "load"})
+            if response is None:
+                print(f"⏳ Timeout: No load report from {ip}:{port}")
+                continue
+            report.append({"ip": ip, "port": port, "virtual_nodes": response["virtual_nodes"], "ring_share": share,
+                           "keys": response["keys"], "owned": response["owned"], "expected": response["expected"]})
+        return report
+
+    def stats(self, node=None):
+        """Return the metrics snapshot of a node, this one by default, or None if it did not answer."""
+        if node is None:
+            return self.metrics.snapshot()
+        response = self.ask_node(node, {"type": "stats"})
+        return response["stats"] if response is not None else None
 
     def get_all_keys_from_node(self, node):
         """Query all keys in the specified Chord node and return them without inserting."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(20)
-
-            print("🔍 Querying for every key in the Chord network.")
-            request = {
-                "type": "query_all",
+        print("🔍 Querying for every key in the Chord network.")
+        return list(self.stream_keys([node]))
+
+    def stream_keys(self, nodes, chunk_size=500, timeout=20, max_chunks=64):
+        """Ask every node for its keys at once and yield the records of their chunks in arrival order.
+
+        About max_chunks received chunks are buffered; after that the nodes wait until the records are consumed.
+        Each record refers to the source_node of its chunk. A node silent for timeout seconds is given up on.
+        """
+        requests = [(node, {"type": "query_all", "chunk_size": chunk_size}) for node in nodes]
+        chunks = self.receive_streams(requests, timeout, max_chunks)
+        try:
+            for chunk in chunks:
+                for record in chunk["key_value_list"]:
+                    record["source_node"] = chunk["source_node"]
+                    yield record
+        finally:
+            chunks.close()  # Cancel the streams right away if the records are not all consumed
+
+    def receive_streams(self, requests, timeout=20, max_chunks=64):
+        """Send each (node, request) pair as a streamed request and yield the chunks of every stream in arrival order.
+
+        Streams end with the chunk flagged last; those still open when the caller stops are cancelled. Each stream
+        may send its share of max_chunks ahead of the chunks consumed, and is granted more as they are, so a slow
+        consumer holds up the senders without blocking the reply connections they share with other operations.
+        """
+        sink = queue.Queue()
+        window = max(2, max_chunks // max(1, len(requests)))
+        streams = {}  # request_id -> [node, chunks received, chunks expected once the last one is known, chunks consumed]
+        for node, request in requests:
+            request.update({
                 "sender_ip": self.ip,
                 "sender_port": self.port,
-                "sender_temp_port": temp_port,
                 "sender_id": self.node_id,
-            }
-
-            target_ip, target_port = node["ip"], node["port"]
-            self.pass_request(request, target_ip, target_port)
-            print("🕒 Waiting for response...")
-            try:
-                conn, _ = temp_socket.accept()
-                data = conn.recv(1024).decode()
-                conn.close()
-                if data:
-                    response = json.loads(data)
-                    key_value_list = response["key_value_list"]
-                    return key_value_list  # Return without inserting into MongoDB
-                else:
-                    print("⚠️ No data received from the node.")
-            except socket.timeout:
-                print("⏳ Timeout: No response received within the timeout period.")
-        return []
-
-    
+                "sender_temp_port": self.reply_port,
+                "window": window
+            })
+            request["request_id"] = self.replies.register_stream(sink)
+            if self.pass_request(request, node["ip"], node["port"], node["node_id"]):
+                streams[request["request_id"]] = [node, 0, None, 0]
+            else:
+                self.replies.cancel(request["request_id"])
+        try:
+            while streams:
+                try:
+                    chunk = sink.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"⏳ Timeout: No chunks received from {len(streams)} nodes within the timeout period.")
+                    return
+                stream = streams.get(chunk["request_id"])
+                if stream is None:
+                    continue
+                # Chunks may arrive out of order over different pooled connections, so count them
+                stream[1] += 1
+                if chunk["last"]:
+                    stream[2] = chunk["sequence"] + 1
+                if stream[1] == stream[2]:
+                    del streams[chunk["request_id"]]
+                    self.replies.cancel(chunk["request_id"])
+                yield chunk
+                stream[3] += 1
+                if chunk["request_id"] in streams and stream[3] % max(1, window // 2) == 0:
+                    self.grant_stream(stream[0], chunk["request_id"], stream[3] + window)
+        finally:
+            for request_id, stream in streams.items():
+                self.replies.cancel(request_id)
+                self.grant_stream(stream[0], request_id, -1)  # Stop the sender
+
+    def grant_stream(self, node, request_id, granted):
+        """Tell the node sending a stream how many of its chunks this node has room for; -1 cancels the stream."""
+        credit = {
+            "type": "stream_credit",
+            "request_id": request_id,
+            "granted": granted,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "sender_temp_port": self.reply_port
+        }
+        self.pass_request(credit, node["ip"], node["port"], node["node_id"])
+
+    def overlay(self, verify=False):
+        """Return the nodes of the Chord network in ring order, starting with this node.
+
+        The list comes from the gossiped membership view. With verify, the ring is walked node by node instead,
+        following the successor pointers, and any difference from the view is reported.
+        """
+        if not verify:
+            return self.membership.nodes()
+        node_list = self.walk_overlay()
+        if node_list is not None:
+            walked = {node["node_id"] for node in node_list}
+            known = {node["node_id"] for node in self.membership.nodes()}
+            if walked != known:
+                print(f"⚠️ Membership view differs from the ring: missing {[node_id//2**155 for node_id in walked - known]}, "
+                      f"stale {[node_id//2**155 for node_id in known - walked]}")
+        return node_list
 
-    def overlay(self):
-        """Display the overlay of the Chord network."""
+    def walk_overlay(self):
+        """Walk the ring through the successor pointers, one round trip per node. Returns None if a node did not answer."""
         # Start with the local node's characteristics.
         node_list = []
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(10)
+        print("🔍 Fetching the overlay of the Chord network.")
+        target_ip, target_port, target_id = self.ip, self.port, self.node_id
 
-            print("🔍 Fetching the overlay of the Chord network.")
+        while True:
             request = {
                 "type": "overlay",
                 "sender_ip": self.ip,
                 "sender_port": self.port,
-                "sender_temp_port": temp_port,
                 "sender_id": self.node_id,
             }
-            target_ip, target_port = self.ip, self.port
-
-            while True:
-                self.pass_request(request, target_ip, target_port)
-                print("🕒 Waiting for response...")
-                try:
-                    conn, _ = temp_socket.accept()
-                    data = conn.recv(1024).decode()
-                    conn.close()
-
-                    if not data:
-                        print("⚠️ No data received from node.")
-                        break
-
-                    response = json.loads(data)
-                    # Append node characteristics if not already added.
-                    sender = response.get("sender")
-                    if sender:
-                        node_list.append(sender)
-
-                    # Check if we have completed a full cycle.
-                    if sender.get("node_id") == self.predecessor["node_id"]:
-                        print("✅ Completed full cycle of overlay.")
-                        return node_list
-
-                    # Update target with the next node's info.
-                    next_node = response.get("next")
-                    if next_node:
-                        target_ip, target_port = next_node.get("ip"), next_node.get("port")
-                    else:
-                        print("⚠️ Next node info missing.")
-                        return node_list
-
-                except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
-                    return
-        return node_list
-        
+            future = self.expect_reply(request)
+            self.pass_request(request, target_ip, target_port, target_id)
+            print("🕒 Waiting for response...")
+            response = self.wait_reply(future)
+            if not response:
+                return
+
+            # Append node characteristics if not already added.
+            sender = response.get("sender")
+            if sender:
+                node_list.append(sender)
+
+            # Check if we have completed a full cycle.
+            if sender.get("node_id") == self.predecessor["node_id"]:
+                print("✅ Completed full cycle of overlay.")
+                return node_list
+
+            # Update target with the next node's info.
+            next_node = response.get("next")
+            if next_node:
+                target_ip, target_port, target_id = next_node.get("ip"), next_node.get("port"), next_node.get("node_id")
+            else:
+                print("⚠️ Next node info missing.")
+                return node_list
 
     def delete(self, key):
-          "Remove a key from the Chord Network"
-          with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
-            temp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            temp_socket.bind(("0.0.0.0", 0))  # Bind to a free port
-            temp_port = temp_socket.getsockname()[1]
-            temp_socket.listen(1)
-            temp_socket.settimeout(10)
-
-
-            key_hash = self.hash_function(key)
-            print(f"🔍 Querying for key {key} with hash {key_hash}")
-            request = {
-                "type": "deletion",
-                "key": key,
-                "key_hash": key_hash,
-                "sender_ip": self.ip,
-                "sender_port": self.port,
-                "sender_temp_port": temp_port,
-                "sender_id": self.node_id,
-                "times_copied": 0
-            }
-            self.pass_request(request,self.ip,self.port)
-            print("🕒 Waiting for response...")
-            conn, _ = temp_socket.accept()
-            data = conn.recv(1024).decode()
-            try:    
-                if data:
-                    response = json.loads(data)
-                    if response:
-                        print(f"📨 Song was deleted successfully")
-                conn.close()
-            except socket.timeout:
-                    print("⏳ Timeout: No response received within the timeout period.")
+        "Remove a key from the Chord Network"
+        print(f"🔍 Querying for key {key} with hash {self.hash_function(key)}")
+        future = self.delete_async(key)
+        print("🕒 Waiting for response...")
+        response = self.wait_reply(future)
+        if response:
+            print(f"📨 Song was deleted successfully after {response.get('hops', 0)} hops")
+        return response
+
+    def delete_async(self, key, timeout=10):
+        """Send a deletion without waiting for it. Returns a future of the response that fails after timeout seconds."""
+        request = {
+            "type": "deletion",
+            "key": key,
+            "key_hash": self.hash_function(key),
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id,
+            "times_copied": 0
+        }
+        self.start_trace(request)
+        future = self.expect_reply(request, timeout)
+        self.send_to_owner(request)
+        return future
 
     def handle_replication_upon_arrival(self):
-        """Handle replication of key-value pairs upon arrival."""
-        network_overlay = self.overlay()
-        if len(network_overlay) <= self.replication_factor:
-            for node in network_overlay:
-                self.get_all_keys_from_node(node)
+        """Pull the keys this node now holds from the nodes that owned them before the join.
+
+        Every range [id_i, id_i+1) of the ring whose chain now includes this node's server, and did not before, is
+        pulled from its owner in the ring without this node; another virtual node of the server may already hold it.
+        The transfers stream in batches, throttled by the senders' migration limiters. Writes this node owns meanwhile
+        fetch their keys from the source first (see pull_before_write), so they merge into the migrated documents.
+        """
+        nodes = self.overlay()
+        previous = [node for node in nodes if node["node_id"] != self.node_id]
+        pulls = []
+        if previous:
+            after, before = RingIndex(nodes), RingIndex(previous)
+            k = self.replication_factor
+            for position, chain in enumerate(after.chain_positions(after.ids, k)):
+                if (self.ip, self.port) not in {(after.nodes[i]["ip"], after.nodes[i]["port"]) for i in chain}:
+                    continue
+                lo, hi = after.ids[position], after.ids[(position + 1) % len(after.ids)]
+                held = before.chain_positions([lo], k)[0]
+                if (self.ip, self.port) not in {(before.nodes[i]["ip"], before.nodes[i]["port"]) for i in held}:
+                    self.add_transfer(pulls, before.nodes[held[0]], lo, hi)
+        with self.pull_lock:
+            self.pulling = pulls
+        try:
+            self.pull_ranges(pulls)
+        finally:
+            with self.pull_lock:
+                self.pulling, self.pulled_keys = None, set()
+
+    def pull_ranges(self, pulls, chunk_size=500):
+        """Copy the documents of the clockwise ranges [lo, hi) of (source, lo, hi) pulls, applying each batch with one write."""
+        if not pulls:
+            return 0
+        sources = {(source["ip"], source["port"]) for source, _, _ in pulls}
+        print(f"🚚 Pulling keys from {', '.join(f'{ip}:{port}' for ip, port in sorted(sources))}")
+        start_time = time.time()
+        received = stored = 0
+        requests = [(source, {"type": "migration", "lo": lo, "hi": hi, "chunk_size": chunk_size}) for source, lo, hi in pulls]
+        for chunk in self.receive_streams(requests):
+            received += len(chunk["documents"])
+            if chunk["documents"]:
+                stored += self.store_documents(chunk["documents"])
+            if self.debugging:
+                print(f"📦 Migration: {received} documents received, {stored} stored")
+        print(f"✅ Migrated {stored} of {received} documents from {len(sources)} nodes in {time.time() - start_time:.2f} seconds")
+        return stored
+
+    def fetch_documents(self, source, key_hashes, timeout=2):
+        """Copy the documents of a few keys from source right away, keeping newer local copies. Returns False on timeout."""
+        request = {
+            "type": "key_pull",
+            "key_hashes": key_hashes,
+            "sender_ip": self.ip,
+            "sender_port": self.port,
+            "sender_id": self.node_id
+        }
+        future = self.expect_reply(request, timeout)
+        if not self.pass_request(request, source["ip"], source["port"], source["node_id"]):
+            self.replies.cancel(request["request_id"])
+            return False
+        response = self.wait_reply(future)
+        if response is None:
+            return False
+        if response["documents"]:
+            self.store_documents(response["documents"])
+        return True
+
+    def add_transfer(self, transfers, node, lo, hi):
+        """Append the range [lo, hi) for node to a list of (node, lo, hi) transfers, extending the last one if adjacent."""
+        if transfers and transfers[-1][0]["node_id"] == node["node_id"] and transfers[-1][2] == lo:
+            transfers[-1] = (node, transfers[-1][1], hi)
         else:
+            transfers.append((node, lo, hi))
 
-            pass
-            #copy all key-value pairs
-
-    def handle_replication_upon_departure(self):
-        """Handle replication of key-value pairs upon departure."""
-        pass
+    def handle_replication_upon_departure(self, handoffs):
+        """Hand the key ranges of handoff_ranges over to their new holders, reporting the progress."""
+        start_time = time.time()
+        stored = sum(self.hand_off(target, lo, hi) for target, lo, hi in handoffs)
+        print(f"✅ Handoff of {stored} documents to {len(handoffs)} nodes finished in {time.time() - start_time:.2f} seconds")
 
     def stop(self):
         """Stop the server and clean up resources."""
         self.running = False
-        #try:
-        #    self.server_socket.shutdown(socket.SHUT_RDWR)
-        #except:
-        #    pass
-        self.mongoclient.close()
+        if self.host is not self:
+            # The host owns the shared server, storage and connections; requests to this node now go to the host
+            self.virtual_nodes.pop(self.node_id, None)
+            return
+        for node in list(self.virtual_nodes.values()):
+            node.running = False
+        self.connection_pool.close_all()
+        self.reply_socket.close()
         if self.server_socket:
-            self.server_socket.close()
-            self.collection.delete_many({})
+            if self.server_mode != "asyncio":
+                self.close_connections()
+            if self.storage_engine == "mongodb":
+                self.storage.clear()
+                self.cache.clear()
+        self.storage.close()
         print("🛑 Stopping node...")
+
+    def close_connections(self):
+        """Stop the threaded server and shut down every connection it accepted, the event loop closes its own.
+
+        Peers pool their connections to this node; shutting them down makes the peers see the node is gone instead of
+        sending requests nobody reads.
+        """
+        try:
+            self.server_socket.shutdown(socket.SHUT_RDWR)  # Unblocks accept(), which closing alone does not
+        except OSError:
+            pass
+        self.server_socket.close()
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # Already closed by its handler
+
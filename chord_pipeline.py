@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import Future, wait
+
+
+class RequestPipeline:
+    def __init__(self, node, window=32, deadline=10):
+        self.node = node
+        self.window = window  # Maximum number of operations in flight at once
+        self.deadline = deadline  # Default seconds an operation may take from submission to response
+        self.slots = threading.BoundedSemaphore(window)
+        self.key_tails = {}  # key -> future of the last operation submitted for that key
+        self.outstanding = set()
+        self.lock = threading.Lock()
+
+    def insert(self, key, value=None, deadline=None):
+        """Pipeline an insertion. Returns a future of its response."""
+        return self.submit(key, lambda timeout: self.node.insert_async(key, value, timeout), deadline)
+
+    def query(self, key, deadline=None):
+        """Pipeline a query. Returns a future of its response."""
+        return self.submit(key, lambda timeout: self.node.query_async(key, timeout), deadline)
+
+    def delete(self, key, deadline=None):
+        """Pipeline a deletion. Returns a future of its response."""
+        return self.submit(key, lambda timeout: self.node.delete_async(key, timeout), deadline)
+
+    def submit(self, key, send, deadline=None):
+        """Issue an operation once the window has room and every earlier operation on the same key has completed.
+
+        send(timeout) must send the request and return the future of its response. Blocks while the window is full.
+        The returned future fails with TimeoutError if the deadline passes before the response arrives.
+        """
+        expires_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        self.slots.acquire()
+        result = Future()
+        with self.lock:
+            previous = self.key_tails.get(key)
+            self.key_tails[key] = result
+            self.outstanding.add(result)
+        result.add_done_callback(lambda future: self.finish(key, future))
+
+        def launch(_=None):
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                result.set_exception(TimeoutError(f"Deadline passed before the operation on {key!r} was sent"))
+                return
+            try:
+                response_future = send(remaining)
+            except Exception as e:
+                result.set_exception(e)
+                return
+            response_future.add_done_callback(lambda future: self.copy_outcome(future, result))
+
+        if previous is None:
+            launch()
+        else:
+            # Keep the per-key order: an operation starts only after the previous one on its key finished
+            previous.add_done_callback(launch)
+        return result
+
+    def copy_outcome(self, source, target):
+        """Complete target with the result or exception of source."""
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+
+    def finish(self, key, future):
+        """Free the window slot of a completed operation."""
+        with self.lock:
+            if self.key_tails.get(key) is future:
+                del self.key_tails[key]
+            self.outstanding.discard(future)
+        self.slots.release()
+
+    def drain(self):
+        """Wait until every submitted operation has completed."""
+        with self.lock:
+            outstanding = list(self.outstanding)
+        wait(outstanding)
@@ -0,0 +1,465 @@
+import asyncio
+import itertools
+import json
+import operator
+import struct
+
+# Every message on the wire is a frame: a 1-byte format version, a 4-byte big-endian payload length and the payload,
+# so a single connection can carry many messages and no message is cut short by a fixed recv size.
+# Receivers accept both formats, so nodes sending JSON for debugging interoperate with the others.
+FRAME_HEADER = struct.Struct("!BI")
+JSON_FORMAT = 1
+BINARY_FORMAT = 2
+WIRE_FORMATS = {"json": JSON_FORMAT, "binary": BINARY_FORMAT}
+
+# Binary payload: every value starts with a 1-byte tag. Non-negative integers of 65 to 160 bits (node ids and key
+# hashes) take a fixed 20 bytes instead of up to 49 decimal digits; dict keys listed in FIELDS take a single byte.
+# Coding value by value in Python is slower than the json module, so the dicts that make up most of the traffic
+# (single-key messages, ring nodes, membership entries, batch items and documents) are records instead: the fields of
+# their layout in RECORD_LAYOUTS are packed with one struct call per dict, or a few calls per field for long lists of
+# them. That makes coding them about as fast as JSON for single messages, and faster for batches.
+NONE, FALSE, TRUE, INT, ID, BIG_INT, FLOAT, STR, LIST, DICT, RECORD, RECORDS = range(12)
+ID_BYTES = 20
+DOUBLE = struct.Struct("!d")
+# Append only: the position of a field is its code on the wire
+FIELDS = (
+    "type", "sender_ip", "sender_port", "sender_id", "sender_temp_port", "request_id", "target_id", "gossip",
+    "key", "key_hash", "value", "version", "deleted", "times_copied", "hops", "owner_range", "ip", "port",
+    "node_id", "end", "alive", "members", "documents", "items", "successor", "predecessor", "next", "source_node",
+    "sequence", "last", "key_value_list", "chunk_size", "lo", "hi", "candidate", "node", "reply", "hot_copies",
+    "hot_read", "hot_copy", "stored", "hashes", "mismatched", "leaves", "differing", "consistency_type",
+    "replication_factor", "found_predecessor", "successor_ip", "successor_port", "successor_id", "predecessor_ip",
+    "predecessor_port", "predecessor_id", "sender", "sender_node_id", "owner", "msg", "serve_at", "ttl", "key_hashes",
+    "inserted", "count", "remaining", "replica_position", "keys", "owned", "virtual_nodes", "expected",
+    "stats", "trace", "trace_id", "started", "finished", "arrived", "departed", "storage", "role",
+    "window", "granted", "lamport_clock", "misrouted", "tombstones",
+)
+FIELD_CODES = {field: code for code, field in enumerate(FIELDS, 1)}
+COLUMNS_FROM = 16  # Lists of records this long are packed column by column, shorter ones record by record
+# Raised when packing a dict that does not fit a layout: a missing field, or a value of another kind or out of range
+PACK_ERRORS = (KeyError, TypeError, AttributeError, OverflowError, struct.error)
+MAX_FRAME = 256 * 1024 * 1024  # Larger lengths can only come from a corrupt header, so the connection is dropped
+
+
+class RecordLayout:
+    # struct format of the fields of a single record; strings are packed as their length, their bytes following
+    FORMATS = {"int": "q", "bool": "?", "id": f"{ID_BYTES}s", "str": "I"}
+    TYPES = {"int": int, "bool": bool, "id": int, "str": str, "version": list}
+
+    def __init__(self, code, fields):
+        self.code = code
+        self.fields = fields  # (name, kind) pairs, all required: dicts missing one are coded value by value
+        self.names = tuple(name for name, _ in fields)
+        self.get = operator.itemgetter(*self.names)
+        kinds = [kind for _, kind in fields]
+        # Exact types, as struct would pack booleans as integers, and any value as a boolean by its truth
+        self.types = tuple(self.TYPES[kind] for kind in kinds)
+        self.ids = [index for index, kind in enumerate(kinds) if kind == "id"]
+        self.strs = [index for index, kind in enumerate(kinds) if kind == "str"]
+        self.struct = None  # Layouts with a version field only pack lists of records, column by column
+        if set(kinds) <= self.FORMATS.keys():
+            self.struct = struct.Struct("!" + "".join(map(self.FORMATS.get, kinds)))
+
+    def pack_one(self, value):
+        """Pack the fields of a dict with a single struct call. Raises an error if a field is missing or of another kind."""
+        packed = list(self.get(value))
+        if tuple(map(type, packed)) != self.types:
+            raise TypeError("A field holds a value of another kind")
+        for index in self.ids:
+            packed[index] = packed[index].to_bytes(ID_BYTES, "big")
+        strs = []
+        for index in self.strs:
+            data = packed[index].encode()
+            strs.append(data)
+            packed[index] = len(data)
+        return self.struct.pack(*packed) + b"".join(strs)
+
+    def unpack_one(self, data, position):
+        """Read a dict packed by pack_one at position. Returns it and the position after it."""
+        packed = list(self.struct.unpack_from(data, position))
+        position += self.struct.size
+        for index in self.ids:
+            packed[index] = int.from_bytes(packed[index], "big")
+        for index in self.strs:
+            end = position + packed[index]
+            packed[index] = data[position:end].decode()
+            position = end
+        return dict(zip(self.names, packed)), position
+
+    def pack(self, rows):
+        """Pack a list of dicts: long ones column by column, with a few calls per column whatever the number of dicts,
+        short ones dict by dict with pack_one.
+
+        Raises an error unless every dict has exactly the fields of this layout, with values of their kind.
+        """
+        if set(map(type, rows)) != {dict} or set(map(len, rows)) != {len(self.names)}:
+            raise KeyError("Not the fields of the layout")
+        packed = bytearray()
+        encode_varint(len(rows), packed)
+        if self.struct is not None and len(rows) < COLUMNS_FROM:
+            packed.append(False)
+            packed += b"".join(map(self.pack_one, rows))
+            return packed
+        packed.append(True)
+        for (_, kind), column in zip(self.fields, zip(*map(self.get, rows))):
+            pack_column(kind, column, packed)
+        return packed
+
+    def unpack(self, data, position):
+        """Read a list of dicts packed by pack at position. Returns it and the position after it."""
+        count, position = decode_varint(data, position)
+        position += 1
+        if not data[position - 1]:
+            rows = []
+            for _ in range(count):
+                row, position = self.unpack_one(data, position)
+                rows.append(row)
+            return rows, position
+        columns = []
+        for _, kind in self.fields:
+            column, position = unpack_column(kind, count, data, position)
+            columns.append(column)
+        return list(map(dict, map(zip, itertools.repeat(self.names), zip(*columns)))), position
+
+
+def pack_column(kind, column, out):
+    """Append the values of one field of many records."""
+    kinds = set(map(type, column))
+    if kind == "int" and kinds == {int}:
+        out += struct.pack(f"!{len(column)}q", *column)
+    elif kind == "bool" and kinds == {bool}:
+        out += struct.pack(f"!{len(column)}?", *column)
+    elif kind == "id" and kinds == {int}:
+        out += b"".join(map(int.to_bytes, column, itertools.repeat(ID_BYTES), itertools.repeat("big")))
+    elif kind == "str" and kinds == {str}:
+        text = "\0".join(column)  # Split again in a single call when decoding
+        if text.count("\0") != len(column) - 1:
+            raise TypeError("A string holds the separator")
+        data = text.encode()
+        encode_varint(len(data), out)
+        out += data
+    elif kind == "version" and kinds == {list} and set(map(len, column)) == {2}:
+        clocks, node_ids = zip(*column)  # Lamport versions: [clock, node_id as a string]
+        pack_column("int", clocks, out)
+        pack_column("str", node_ids, out)
+    else:
+        raise TypeError(f"Not a column of {kind} values")
+
+
+def unpack_column(kind, count, data, position):
+    """Read the values of one field of count records. Returns them and the position after them."""
+    if kind == "int":
+        return struct.unpack_from(f"!{count}q", data, position), position + 8 * count
+    if kind == "bool":
+        return struct.unpack_from(f"!{count}?", data, position), position + count
+    if kind == "id":
+        end = position + ID_BYTES * count
+        cuts = map(slice, range(position, end, ID_BYTES), range(position + ID_BYTES, end + ID_BYTES, ID_BYTES))
+        return list(map(int.from_bytes, map(data.__getitem__, cuts), itertools.repeat("big"))), end
+    if kind == "str":
+        size, position = decode_varint(data, position)
+        return data[position:position + size].decode().split("\0"), position + size
+    if kind == "version":
+        clocks, position = unpack_column("int", count, data, position)
+        node_ids, position = unpack_column("str", count, data, position)
+        return list(map(list, zip(clocks, node_ids))), position
+    raise ValueError(f"Unknown column kind {kind}")
+
+
+SENDER = (("sender_ip", "str"), ("sender_port", "int"), ("sender_id", "id"), ("sender_temp_port", "int"),
+          ("request_id", "int"))
+# Append only, like FIELDS: the position of a layout is its code on the wire
+RECORD_LAYOUTS = (
+    RecordLayout(0, (("ip", "str"), ("port", "int"), ("node_id", "id"))),
+    RecordLayout(1, (("ip", "str"), ("port", "int"), ("node_id", "id"), ("end", "id"))),
+    RecordLayout(2, (("ip", "str"), ("port", "int"), ("node_id", "id"), ("version", "int"), ("alive", "bool"))),
+    RecordLayout(3, (("key", "str"), ("key_hash", "id"), ("value", "str"))),
+    RecordLayout(4, (("key", "str"), ("key_hash", "str"), ("value", "str"), ("version", "version"))),
+    RecordLayout(5, (("type", "str"), ("key", "str"), ("key_hash", "id"), ("times_copied", "int"), *SENDER)),
+    RecordLayout(6, (("type", "str"), ("key_hash", "id"), ("times_copied", "int"), *SENDER)),
+    RecordLayout(7, (("type", "str"), ("sender_ip", "str"), ("sender_port", "int"), ("sender_node_id", "id"),
+                     ("key", "str"), ("key_hash", "id"), ("request_id", "int"), ("hops", "int"))),
+    RecordLayout(8, (("type", "str"), ("key", "str"), ("key_hash", "id"), ("request_id", "int"), ("hops", "int"))),
+)
+# Dicts and lists of dicts with exactly the fields of these layouts are records: ring nodes, owner ranges, membership
+# entries, batch items and stored documents
+KEY_LAYOUTS = {frozenset(layout.names): layout for layout in RECORD_LAYOUTS[:5]}
+# Messages of these types are records if they have the fields of their layout; their other keys follow the record
+TYPE_LAYOUTS = {
+    **dict.fromkeys(("query", "insertion", "deletion"), RECORD_LAYOUTS[5]),
+    **dict.fromkeys(("bulk_insertion", "bulk_deletion"), RECORD_LAYOUTS[6]),
+    "query_response": RECORD_LAYOUTS[7],
+    **dict.fromkeys(("insertion_response", "deletion_response"), RECORD_LAYOUTS[8]),
+}
+
+
+def encode_message(message, wire_format="binary"):
+    """Serialize a message dict into a length-prefixed frame, in the binary format or as JSON for debugging."""
+    if wire_format == "json":
+        payload = json.dumps(message).encode()
+    else:
+        payload = bytearray()
+        encode_value(message, payload)
+    return FRAME_HEADER.pack(WIRE_FORMATS[wire_format], len(payload)) + payload
+
+
+def encode_varint(number, out):
+    """Append a non-negative integer in 7-bit groups, least significant first."""
+    while number > 0x7F:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def encode_value(value, out):
+    """Append the binary encoding of a JSON-like value. Tuples become lists and dict keys strings, as with JSON."""
+    kind = type(value)
+    if kind is str:
+        data = value.encode()
+        length = len(data)
+        if length < 0x80:
+            out.append(STR)
+            out.append(length)
+        else:
+            out.append(STR)
+            encode_varint(length, out)
+        out += data
+    elif kind is int:
+        if 0 <= value < 0x40:
+            out.append(INT)
+            out.append(value << 1)
+        elif -2**63 <= value < 2**63:
+            out.append(INT)
+            encode_varint((value << 1) ^ (value >> 63), out)  # Zigzag, so small negative numbers stay short
+        elif 0 <= value < 2**(8 * ID_BYTES):
+            out.append(ID)
+            out += value.to_bytes(ID_BYTES, "big")
+        else:
+            data = value.to_bytes((value.bit_length() + 8) // 8, "big", signed=True)
+            out.append(BIG_INT)
+            encode_varint(len(data), out)
+            out += data
+    elif kind is dict:
+        layout = TYPE_LAYOUTS.get(value["type"]) if "type" in value else KEY_LAYOUTS.get(frozenset(value))
+        if layout is not None and encode_record(layout, value, out):
+            return
+        out.append(DICT)
+        encode_varint(len(value), out)
+        for key, item in value.items():
+            code = FIELD_CODES.get(key)
+            if code is not None:
+                out.append(code)
+            else:
+                data = str(key).encode()
+                out.append(0)
+                encode_varint(len(data), out)
+                out += data
+            encode_value(item, out)
+    elif kind is list or kind is tuple:
+        layout = KEY_LAYOUTS.get(frozenset(value[0])) if value and type(value[0]) is dict else None
+        if layout is not None:
+            try:
+                packed = layout.pack(value)
+                out.append(RECORDS)
+                out.append(layout.code)
+                out += packed
+                return
+            except PACK_ERRORS:
+                pass  # Not every dict has the fields of the first one, with values of their kind
+        out.append(LIST)
+        encode_varint(len(value), out)
+        for item in value:
+            encode_value(item, out)
+    elif value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif kind is float:
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    else:
+        raise TypeError(f"Cannot encode {kind.__name__} in a message")
+
+
+def encode_record(layout, value, out):
+    """Append a dict as a record of layout followed by its other keys.
+
+    Returns False, having appended nothing, if a field is missing or of another kind.
+    """
+    if layout.struct is None:
+        return False
+    try:
+        packed = layout.pack_one(value)
+    except PACK_ERRORS:
+        return False
+    out.append(RECORD)
+    out.append(layout.code)
+    out += packed
+    if len(value) == len(layout.names):
+        out.append(NONE)
+    else:
+        encode_value({key: item for key, item in value.items() if key not in layout.names}, out)
+    return True
+
+
+def decode_varint(data, position):
+    """Read a varint at position. Returns the number and the position after it."""
+    number = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def decode_value(data, position):
+    """Read the value encoded at position of a bytes payload. Returns the value and the position after it."""
+    tag = data[position]
+    position += 1
+    if tag == STR:
+        length = data[position]
+        if length < 0x80:
+            position += 1
+        else:
+            length, position = decode_varint(data, position)
+        end = position + length
+        return data[position:end].decode(), end
+    if tag == INT:
+        number = data[position]
+        if number < 0x80:
+            return (number >> 1) ^ -(number & 1), position + 1
+        number, position = decode_varint(data, position)
+        return (number >> 1) ^ -(number & 1), position
+    if tag == ID:
+        end = position + ID_BYTES
+        return int.from_bytes(data[position:end], "big"), end
+    if tag == RECORDS:
+        return RECORD_LAYOUTS[data[position]].unpack(data, position + 1)
+    if tag == RECORD:
+        value, position = RECORD_LAYOUTS[data[position]].unpack_one(data, position + 1)
+        if data[position] == NONE:
+            return value, position + 1
+        rest, position = decode_value(data, position)
+        value.update(rest)
+        return value, position
+    if tag == DICT:
+        count, position = decode_varint(data, position)
+        value = {}
+        for _ in range(count):
+            code = data[position]
+            position += 1
+            if code:
+                key = FIELDS[code - 1]
+            else:
+                length, position = decode_varint(data, position)
+                key = data[position:position + length].decode()
+                position += length
+            if data[position] == STR and data[position + 1] < 0x80:
+                # Short strings are the most common values: read them without a call
+                end = position + 2 + data[position + 1]
+                value[key] = data[position + 2:end].decode()
+                position = end
+            else:
+                value[key], position = decode_value(data, position)
+        return value, position
+    if tag == LIST:
+        count, position = decode_varint(data, position)
+        value = []
+        for _ in range(count):
+            item, position = decode_value(data, position)
+            value.append(item)
+        return value, position
+    if tag == NONE:
+        return None, position
+    if tag == TRUE:
+        return True, position
+    if tag == FALSE:
+        return False, position
+    if tag == FLOAT:
+        return DOUBLE.unpack_from(data, position)[0], position + DOUBLE.size
+    if tag == BIG_INT:
+        length, position = decode_varint(data, position)
+        return int.from_bytes(data[position:position + length], "big", signed=True), position + length
+    raise ValueError(f"Unknown value tag {tag}")
+
+
+def decode_message(payload, version=BINARY_FORMAT):
+    """Deserialize the payload of a frame of the given format version."""
+    if version == BINARY_FORMAT:
+        return decode_value(bytes(payload), 0)[0]  # Indexing and slicing bytes is faster than a memoryview
+    if version == JSON_FORMAT:
+        return json.loads(bytes(payload))
+    raise ConnectionError(f"Unsupported frame format {version}")
+
+
+def recv_into_exactly(sock, view):
+    """Fill view from sock. Returns False if the peer closed the connection before the first byte."""
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return False
+            raise ConnectionError("Connection closed in the middle of a frame")
+        received += count
+    return True
+
+
+def check_length(length):
+    """Refuse a frame longer than MAX_FRAME before allocating a buffer for it."""
+    if length > MAX_FRAME:
+        raise ConnectionError(f"Frame of {length} bytes exceeds the limit of {MAX_FRAME}")
+
+
+def recv_message(sock):
+    """Read one framed message from sock. Returns None once the peer has closed the connection."""
+    return MessageReader(sock, 0).read()
+
+
+class MessageReader:
+    def __init__(self, sock, size=65536, on_frame=None):
+        self.sock = sock
+        self.header = bytearray(FRAME_HEADER.size)
+        self.buffer = bytearray(size)  # Reused for every payload read from sock, grown for larger ones
+        self.on_frame = on_frame  # Called with the size in bytes of every frame read, header included
+
+    def read(self):
+        """Read the next framed message. Returns None once the peer has closed the connection."""
+        if not recv_into_exactly(self.sock, memoryview(self.header)):
+            return None
+        version, length = FRAME_HEADER.unpack(self.header)
+        check_length(length)
+        if self.on_frame is not None:
+            self.on_frame(FRAME_HEADER.size + length)
+        if length > len(self.buffer):
+            self.buffer = bytearray(length)
+        payload = memoryview(self.buffer)[:length]
+        if length and not recv_into_exactly(self.sock, payload):
+            raise ConnectionError("Connection closed in the middle of a frame")
+        return decode_message(payload, version)
+
+
+async def read_message(reader, on_frame=None):
+    """Read one framed message from an asyncio stream. Returns None once the peer has closed the connection.
+
+    on_frame is called with the size in bytes of the frame, header included.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        return None
+    version, length = FRAME_HEADER.unpack(header)
+    check_length(length)
+    if on_frame is not None:
+        on_frame(FRAME_HEADER.size + length)
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed in the middle of a frame")
+    return decode_message(payload, version)
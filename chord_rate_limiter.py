@@ -0,0 +1,24 @@
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate  # Units (e.g. bytes) allowed per second; None or 0 means unlimited
+        self.burst = burst if burst is not None else rate  # Units that may be spent at once after an idle period
+        self.tokens = self.burst or 0
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount):
+        """Block until amount units may be spent (token bucket). Amounts above the burst are spent in debt."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+
+class ReplyDispatcher:
+    def __init__(self):
+        self.pending = {}  # request_id -> Future completed by the matching response
+        self.streams = {}  # request_id -> queue receiving every response to a request answered in several parts
+        self.deadlines = []  # Heap of (deadline, request_id) for requests registered with a timeout
+        self.condition = threading.Condition()
+        self.request_ids = itertools.count(1)
+        expiry_thread = threading.Thread(target=self.expire_loop, daemon=True)
+        expiry_thread.start()
+
+    def register(self, timeout=None):
+        """Reserve a request id and return it together with the future its response will complete.
+
+        If timeout is given, the future fails with TimeoutError once that many seconds pass without a response.
+        """
+        request_id = next(self.request_ids)
+        future = Future()
+        with self.condition:
+            self.pending[request_id] = future
+            if timeout is not None:
+                heapq.heappush(self.deadlines, (time.monotonic() + timeout, request_id))
+                self.condition.notify()
+        return request_id, future
+
+    def register_stream(self, sink):
+        """Reserve a request id whose responses are all put on sink (a queue.Queue) until cancel is called.
+
+        The sink should be unbounded: a reply connection carries the responses of many operations and must never wait
+        for room. Streams bound their chunks in flight with the credits of a StreamWindow instead.
+        """
+        request_id = next(self.request_ids)
+        with self.condition:
+            self.streams[request_id] = sink
+        return request_id
+
+    def complete(self, response):
+        """Complete the waiter matching the response's request id. Returns False if nobody is waiting for it."""
+        with self.condition:
+            future = self.pending.pop(response.get("request_id"), None)
+            sink = self.streams.get(response.get("request_id")) if future is None else None
+        if sink is not None:
+            sink.put(response)
+            return True
+        if future is None:
+            return False
+        if not future.done():
+            future.set_result(response)
+        return True
+
+    def cancel(self, request_id):
+        """Stop waiting for a request. A late response is then dropped."""
+        with self.condition:
+            self.pending.pop(request_id, None)
+            self.streams.pop(request_id, None)
+
+    def expire_loop(self):
+        """Fail the futures of requests whose deadline passed without a response."""
+        while True:
+            with self.condition:
+                while not self.deadlines:
+                    self.condition.wait()
+                deadline, request_id = self.deadlines[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.deadlines)
+                future = self.pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_exception(TimeoutError(f"No response to request {request_id} before its deadline"))
+
+
+class StreamWindow:
+    def __init__(self, granted):
+        self.granted = granted  # Chunks of the stream the receiver has room for, counted from its first one
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def grant(self, granted):
+        """Raise the number of chunks the receiver has room for. A negative number cancels the stream."""
+        with self.condition:
+            if granted < 0:
+                self.cancelled = True
+            else:
+                self.granted = max(self.granted, granted)
+            self.condition.notify_all()
+
+    def wait(self, sequence, timeout=None):
+        """Wait until the chunk numbered sequence may be sent. Returns False if the stream was cancelled or timed out."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.cancelled or sequence < self.granted, timeout)
+            return not self.cancelled and sequence < self.granted
@@ -0,0 +1,88 @@
+import bisect
+import hashlib
+
+try:
+    import numpy
+except ImportError:  # Optional: without it every batch is routed with bisect
+    numpy = None
+
+
+def hash_key(key):
+    """Hash a key using SHA-1 and return a 160-bit integer, its position on the ring."""
+    return int(hashlib.sha1(key.encode()).hexdigest(), 16) % (2**160)
+
+
+def in_range(key_hash, lo, hi):
+    """Check whether key_hash lies in the clockwise range [lo, hi). lo == hi is the whole ring."""
+    if lo < hi:
+        return lo <= key_hash < hi
+    if lo > hi:
+        return key_hash >= lo or key_hash < hi
+    return True
+
+
+class RingIndex:
+    def __init__(self, nodes, vectorize_from=256):
+        self.nodes = sorted(nodes, key=lambda node: node["node_id"])  # Ring order; node i owns [id_i, id_i+1)
+        self.ids = [node["node_id"] for node in self.nodes]
+        self.vectorize_from = vectorize_from  # Batches at least this large use numpy.searchsorted when it is installed
+        # High 64 bits of every id as a fixed-width column; ids sharing them are told apart with bisect
+        self.high_words = high_words(self.ids) if numpy is not None else None
+        self.chains = {}  # length -> chain of ring positions starting at every position
+
+    def owner_positions(self, key_hashes):
+        """Return the ring position of the owner of every key hash: the last node whose id does not exceed it."""
+        count = len(self.ids)
+        if not count:
+            return []
+        if self.high_words is None or len(key_hashes) < self.vectorize_from:
+            # Index -1 wraps around to the last node
+            return [(bisect.bisect_right(self.ids, key_hash) - 1) % count for key_hash in key_hashes]
+        keys = high_words(key_hashes)
+        after = numpy.searchsorted(self.high_words, keys, side="right")
+        positions = ((after - 1) % count).tolist()
+        ties = numpy.nonzero(numpy.searchsorted(self.high_words, keys, side="left") != after)[0]
+        for i in ties.tolist():
+            positions[i] = (bisect.bisect_right(self.ids, key_hashes[i]) - 1) % count
+        return positions
+
+    def owners(self, key_hashes):
+        """Return the node owning every key hash."""
+        return [self.nodes[position] for position in self.owner_positions(key_hashes)]
+
+    def chain_positions(self, key_hashes, length):
+        """Return, for every key hash, the ring positions of its owner followed by the replicas along the chain.
+
+        Virtual nodes share their server's storage, so the chain skips the nodes of servers already in it; with fewer
+        servers than length, it holds one node of each.
+        """
+        chains = self.chains.get(length)
+        if chains is None:
+            chains = self.chains[length] = [self.chain_from(position, length) for position in range(len(self.ids))]
+        return [chains[position] for position in self.owner_positions(key_hashes)]
+
+    def chain_from(self, start, length):
+        """Return the ring positions of the first length nodes of distinct servers from position start on."""
+        chain = []
+        servers = set()
+        for i in range(len(self.ids)):
+            position = (start + i) % len(self.ids)
+            server = (self.nodes[position]["ip"], self.nodes[position]["port"])
+            if server not in servers:
+                servers.add(server)
+                chain.append(position)
+                if len(chain) == length:
+                    break
+        return chain
+
+    def group(self, key_hashes):
+        """Group the indices of key_hashes by owner. Returns (node, indices) pairs in ring order."""
+        groups = {}
+        for i, position in enumerate(self.owner_positions(key_hashes)):
+            groups.setdefault(position, []).append(i)
+        return [(self.nodes[position], groups[position]) for position in sorted(groups)]
+
+
+def high_words(ids):
+    """Return the high 64 bits of 160-bit ids as a numpy uint64 array."""
+    return numpy.fromiter((node_id >> 96 for node_id in ids), dtype=numpy.uint64, count=len(ids))
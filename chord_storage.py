@@ -0,0 +1,381 @@
+import bisect
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from chord_ring_index import in_range
+
+
+# Documents are dicts {"key", "key_hash", "value", "version"[, "deleted"]} with key_hash stored as a string,
+# as they have always been in MongoDB. Engines take key hashes as integers.
+class StorageEngine(ABC):
+    @abstractmethod
+    def get(self, key_hash):
+        """Return the document for key_hash, tombstones included, or None."""
+
+    @abstractmethod
+    def get_many(self, key_hashes):
+        """Return the documents for several keys as a dict keyed by the key_hash string."""
+
+    @abstractmethod
+    def put(self, document):
+        """Store a document, replacing any previous document for its key."""
+
+    @abstractmethod
+    def put_many(self, documents):
+        """Store several documents in order."""
+
+    @abstractmethod
+    def scan(self, lo=None, hi=None, include_deleted=False):
+        """Return the documents whose key_hash lies in the clockwise range [lo, hi), or every document without a range."""
+
+    @abstractmethod
+    def scan_batches(self, lo=None, hi=None, include_deleted=False, batch_size=500):
+        """Yield the documents of scan in lists of at most batch_size, without loading them all at once."""
+
+    @abstractmethod
+    def purge(self, tombstones):
+        """Remove the tombstones given as [key_hash, version] that are still stored with that version.
+
+        Returns the key hashes of the removed tombstones.
+        """
+
+    @abstractmethod
+    def count(self):
+        """Return the number of stored documents, tombstones included."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every document."""
+
+    def close(self):
+        """Release the resources of the engine."""
+        pass
+
+    def in_range(self, key_hash, lo, hi):
+        """Check whether key_hash lies in the clockwise range [lo, hi). lo == hi, or a missing bound, is the whole ring."""
+        return lo is None or hi is None or in_range(key_hash, lo, hi)
+
+
+class MongoStorageEngine(StorageEngine):
+    def __init__(self, collection_name, uri="mongodb://localhost:27017/", database="database"):
+        from pymongo import MongoClient  # Only needed by nodes that store in MongoDB
+        self.client = MongoClient(uri)
+        self.collection = self.client[database][collection_name]
+        self.collection.create_index("key_hash", unique=True)
+
+    def get(self, key_hash):
+        return self.collection.find_one({"key_hash": f"{key_hash}"}, {"_id": 0})
+
+    def get_many(self, key_hashes):
+        query = self.collection.find({"key_hash": {"$in": [f"{key_hash}" for key_hash in key_hashes]}}, {"_id": 0})
+        return {document["key_hash"]: document for document in query}
+
+    def put(self, document):
+        self.collection.replace_one({"key_hash": document["key_hash"]}, document, upsert=True)
+
+    def put_many(self, documents):
+        from pymongo import ReplaceOne
+        if documents:
+            self.collection.bulk_write([ReplaceOne({"key_hash": document["key_hash"]}, document, upsert=True) for document in documents], ordered=True)
+
+    def scan(self, lo=None, hi=None, include_deleted=False):
+        # key_hash is a decimal string, so the range cannot be pushed to the index and is filtered here
+        query = self.collection.find({} if include_deleted else {"deleted": {"$ne": True}}, {"_id": 0})
+        return [document for document in query if self.in_range(int(document["key_hash"]), lo, hi)]
+
+    def scan_batches(self, lo=None, hi=None, include_deleted=False, batch_size=500):
+        cursor = self.collection.find({} if include_deleted else {"deleted": {"$ne": True}}, {"_id": 0}).batch_size(batch_size)
+        batch = []
+        for document in cursor:
+            if self.in_range(int(document["key_hash"]), lo, hi):
+                batch.append(document)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def purge(self, tombstones):
+        # One conditional delete per key, so that a tombstone overwritten in the meantime is kept
+        return [
+            int(key_hash) for key_hash, version in tombstones
+            if self.collection.delete_one({"key_hash": f"{key_hash}", "deleted": True, "version": list(version)}).deleted_count
+        ]
+
+    def count(self):
+        return self.collection.count_documents({})
+
+    def clear(self):
+        self.collection.delete_many({})
+
+    def close(self):
+        self.client.close()
+
+
+class MemoryStorageEngine(StorageEngine):
+    def __init__(self, aof_path=None, fsync=False):
+        self.documents = {}  # key_hash -> document
+        self.positions = []  # Sorted key hashes, i.e. the documents in ring order
+        self.lock = threading.Lock()
+        self.aof_path = aof_path  # Append-only file every put and purge is logged to, replayed on start
+        self.fsync = fsync
+        self.aof = None
+        if aof_path is not None:
+            self.replay()
+            self.aof = open(aof_path, "a")
+
+    def replay(self):
+        """Load the documents logged in the append-only file, then rewrite it with one line per key."""
+        if not os.path.exists(self.aof_path):
+            return
+        with open(self.aof_path) as f:
+            for line in f:
+                if line.strip():
+                    document = json.loads(line)
+                    if document.get("purged"):
+                        self.discard(int(document["key_hash"]))
+                    else:
+                        self.store(document)
+        self.rewrite()
+
+    def rewrite(self):
+        """Replace the append-only file with the current documents."""
+        temporary = f"{self.aof_path}.tmp"
+        with open(temporary, "w") as f:
+            for key_hash in self.positions:
+                f.write(json.dumps(self.documents[key_hash]) + "\n")
+        os.replace(temporary, self.aof_path)
+
+    def store(self, document):
+        """Store a document without logging it. Callers hold the lock."""
+        key_hash = int(document["key_hash"])
+        if key_hash not in self.documents:
+            bisect.insort(self.positions, key_hash)
+        self.documents[key_hash] = document
+
+    def discard(self, key_hash):
+        """Remove a document without logging it. Callers hold the lock."""
+        if self.documents.pop(key_hash, None) is not None:
+            del self.positions[bisect.bisect_left(self.positions, key_hash)]
+
+    def log(self, documents):
+        """Append documents to the append-only file. Callers hold the lock."""
+        if self.aof is None:
+            return
+        self.aof.write("".join(json.dumps(document) + "\n" for document in documents))
+        self.aof.flush()
+        if self.fsync:
+            os.fsync(self.aof.fileno())
+
+    def get(self, key_hash):
+        with self.lock:
+            document = self.documents.get(int(key_hash))
+            return dict(document) if document is not None else None
+
+    def get_many(self, key_hashes):
+        with self.lock:
+            return {
+                f"{key_hash}": dict(self.documents[int(key_hash)])
+                for key_hash in key_hashes if int(key_hash) in self.documents
+            }
+
+    def put(self, document):
+        self.put_many([document])
+
+    def put_many(self, documents):
+        documents = [dict(document) for document in documents]
+        with self.lock:
+            for document in documents:
+                self.store(document)
+            self.log(documents)
+
+    def scan(self, lo=None, hi=None, include_deleted=False):
+        with self.lock:
+            if lo is None or hi is None or lo == hi:
+                key_hashes = self.positions
+            elif lo < hi:
+                key_hashes = self.positions[bisect.bisect_left(self.positions, lo):bisect.bisect_left(self.positions, hi)]
+            else:
+                key_hashes = self.positions[bisect.bisect_left(self.positions, lo):] + self.positions[:bisect.bisect_left(self.positions, hi)]
+            return [
+                dict(self.documents[key_hash]) for key_hash in key_hashes
+                if include_deleted or not self.documents[key_hash].get("deleted")
+            ]
+
+    def scan_batches(self, lo=None, hi=None, include_deleted=False, batch_size=500):
+        if lo is None or hi is None or lo == hi:
+            intervals = [(0, None)]
+        elif lo < hi:
+            intervals = [(lo, hi)]
+        else:
+            intervals = [(lo, None), (0, hi)]
+        for start, end in intervals:
+            position = start
+            while True:
+                # Each batch resumes after the last key of the previous one, so writes in between are tolerated
+                with self.lock:
+                    first = bisect.bisect_left(self.positions, position)
+                    last = first + batch_size if end is None else min(first + batch_size, bisect.bisect_left(self.positions, end))
+                    key_hashes = self.positions[first:last]
+                    batch = [
+                        dict(self.documents[key_hash]) for key_hash in key_hashes
+                        if include_deleted or not self.documents[key_hash].get("deleted")
+                    ]
+                if batch:
+                    yield batch
+                if len(key_hashes) < batch_size:
+                    break
+                position = key_hashes[-1] + 1
+
+    def purge(self, tombstones):
+        with self.lock:
+            purged = []
+            for key_hash, version in tombstones:
+                document = self.documents.get(int(key_hash))
+                if document is not None and document.get("deleted") and list(document["version"]) == list(version):
+                    self.discard(int(key_hash))
+                    purged.append(int(key_hash))
+            if purged:
+                self.log([{"key_hash": f"{key_hash}", "purged": True} for key_hash in purged])
+            return purged
+
+    def count(self):
+        with self.lock:
+            return len(self.documents)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.positions.clear()
+            if self.aof is not None:
+                self.aof.truncate(0)
+
+    def close(self):
+        with self.lock:
+            if self.aof is not None:
+                self.aof.close()
+                self.aof = None
+
+
+class WriteBehindStorageEngine(StorageEngine):
+    def __init__(self, engine, flush_interval=0.05, max_pending=1000):
+        self.engine = engine  # Engine the buffered writes are flushed to
+        self.flush_interval = flush_interval  # Longest time in seconds a write stays only in memory
+        self.max_pending = max_pending  # Buffered keys that trigger a flush before the interval ends
+        self.pending = {}  # key_hash string -> latest document not yet handed to the engine
+        self.flushing = {}  # Documents of the flush in progress, still visible to reads
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.running = True
+        self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def get(self, key_hash):
+        with self.condition:
+            document = self.pending.get(f"{key_hash}") or self.flushing.get(f"{key_hash}")
+            if document is not None:
+                return dict(document)
+        return self.engine.get(key_hash)
+
+    def get_many(self, key_hashes):
+        buffered = {}
+        missing = []
+        with self.condition:
+            for key_hash in key_hashes:
+                document = self.pending.get(f"{key_hash}") or self.flushing.get(f"{key_hash}")
+                if document is not None:
+                    buffered[f"{key_hash}"] = dict(document)
+                else:
+                    missing.append(key_hash)
+        documents = self.engine.get_many(missing) if missing else {}
+        documents.update(buffered)
+        return documents
+
+    def put(self, document):
+        self.put_many([document])
+
+    def put_many(self, documents):
+        with self.condition:
+            for document in documents:
+                self.pending[document["key_hash"]] = dict(document)  # Coalesces repeated writes to a key
+            if len(self.pending) >= self.max_pending:
+                self.condition.notify()
+
+    def scan(self, lo=None, hi=None, include_deleted=False):
+        self.flush()
+        return self.engine.scan(lo, hi, include_deleted)
+
+    def scan_batches(self, lo=None, hi=None, include_deleted=False, batch_size=500):
+        self.flush()
+        return self.engine.scan_batches(lo, hi, include_deleted, batch_size)
+
+    def purge(self, tombstones):
+        # Writes buffered after the flush are newer than the tombstones and are flushed over them later
+        self.flush()
+        return self.engine.purge(tombstones)
+
+    def count(self):
+        self.flush()
+        return self.engine.count()
+
+    def clear(self):
+        with self.flush_lock:
+            with self.condition:
+                self.pending.clear()
+            self.engine.clear()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.flush_thread.join()
+        self.flush()
+        self.engine.close()
+
+    def flush_loop(self):
+        """Flush the buffer every flush_interval, or as soon as it holds max_pending keys."""
+        while True:
+            with self.condition:
+                if self.running and len(self.pending) < self.max_pending:
+                    self.condition.wait(self.flush_interval)
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Error flushing buffered writes: {e}")
+
+    def flush(self):
+        """Write every buffered document to the engine as one batch."""
+        with self.flush_lock:
+            with self.condition:
+                if not self.pending:
+                    return
+                self.flushing, self.pending = self.pending, {}
+            try:
+                self.engine.put_many(list(self.flushing.values()))
+            except Exception:
+                with self.condition:
+                    # Keep the failed batch buffered, behind any newer writes to the same keys
+                    self.pending = {**self.flushing, **self.pending}
+                raise
+            finally:
+                with self.condition:
+                    self.flushing = {}
+
+
+def open_storage_engine(name, collection_name, aof_path=None, write_behind=None):
+    """Create the storage engine selected by name ("mongodb" or "memory").
+
+    With write_behind (seconds), writes are buffered and flushed in batches at least that often.
+    """
+    if name == "memory":
+        engine = MemoryStorageEngine(aof_path)
+    elif name == "mongodb":
+        engine = MongoStorageEngine(collection_name)
+    else:
+        raise ValueError(f"Unknown storage engine: {name}")
+    if write_behind is not None:
+        engine = WriteBehindStorageEngine(engine, flush_interval=write_behind)
+    return engine
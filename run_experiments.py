@@ -5,62 +5,123 @@ import sys
 import argparse
 import socket
 import os
+import json
 from pathlib import Path
+from chord_metrics import to_prometheus
 from chord_node import ChordNode
+from chord_pipeline import RequestPipeline
 
-def run_inserts(file_path, node, output_file):
-    """Run insert operations from the specified file and write results to output_file."""
+def timed(latencies, operation, *args):
+    """Run a blocking operation, recording its latency in seconds if it got a response."""
+    start_time = time.perf_counter()
+    if operation(*args) is not None:
+        latencies.append(time.perf_counter() - start_time)
+
+def track(latencies, operation, *args):
+    """Submit a pipelined operation, recording its latency from submission to response once it succeeds."""
+    start_time = time.perf_counter()  # Before submitting, which may wait for a free slot in the pipeline
+    future = operation(*args)
+
+    def done(future):
+        if future.exception() is None:
+            latencies.append(time.perf_counter() - start_time)
+
+    future.add_done_callback(done)
+
+def phase_results(operations, duration, latencies):
+    """Summarize an experiment phase for the JSON results, keeping the raw latencies so runs can be pooled."""
+    return {"operations": operations, "completed": len(latencies), "seconds": duration,
+            "throughput": operations / duration if duration > 0 else 0, "latencies": latencies}
+
+def run_inserts(file_path, node, output_file, bulk=False, pipeline=None):
+    """Run insert operations from the specified file and write results to output_file.
+
+    With a RequestPipeline, operations are issued through it and the run waits for all of them at the end.
+    Returns the phase results; bulk loads have no per-operation latencies.
+    """
     with open(file_path, "r") as f:
         lines = [line.strip() for line in f if line.strip()]
     start_time = time.time()
+    items = []
+    latencies = []
     for line in lines:
         parts = [p.strip() for p in line.split(',')]
         if parts[0].lower() == "insert":
             key = parts[1]
             value = parts[2] if len(parts) > 2 else None
-            node.insert(key, value)
+            if bulk:
+                items.append((key, value))
+            elif pipeline:
+                track(latencies, pipeline.insert, key, value)
+            else:
+                timed(latencies, node.insert, key, value)
+    if bulk:
+        node.insert_many(items)
+    if pipeline:
+        pipeline.drain()
     end_time = time.time()
     duration = end_time - start_time
     throughput = len(lines) / duration if duration > 0 else 0
     with open(output_file, "a") as f:
-        f.write(f"[Insert Experiment] Completed {len(lines)} inserts in {duration:.2f} seconds, throughput: {throughput:.2f} ops/sec\n")
+        f.write(f"[{'Bulk ' if bulk else ''}Insert Experiment] Completed {len(lines)} inserts in {duration:.2f} seconds, throughput: {throughput:.2f} ops/sec\n")
+    return phase_results(len(lines), duration, latencies)
 
-def run_queries(file_path, node, output_file):
-    """Run query operations from the specified file and write results to output_file."""
+def run_queries(file_path, node, output_file, pipeline=None):
+    """Run query operations from the specified file and write results to output_file. Returns the phase results."""
     with open(file_path, "r") as f:
         lines = [line.strip() for line in f if line.strip()]
     start_time = time.time()
+    latencies = []
     for line in lines:
         parts = [p.strip() for p in line.split(',')]
         if parts[0].lower() == "query":
             key = parts[1]
-            node.query(key)
+            if pipeline:
+                track(latencies, pipeline.query, key)
+            else:
+                timed(latencies, node.query, key)
+    if pipeline:
+        pipeline.drain()
     end_time = time.time()
     duration = end_time - start_time
     throughput = len(lines) / duration if duration > 0 else 0
     with open(output_file, "a") as f:
         f.write(f"[Query Experiment] Completed {len(lines)} queries in {duration:.2f} seconds, throughput: {throughput:.2f} ops/sec\n")
+    return phase_results(len(lines), duration, latencies)
+
+def run_requests(file_path, node, output_file, pipeline=None):
+    """Run mixed request operations from the specified file and write completion to output_file.
 
-def run_requests(file_path, node, output_file):
-    """Run mixed request operations from the specified file and write completion to output_file."""
+    A RequestPipeline keeps the file order between operations on the same key. Returns the phase results.
+    """
     with open(file_path, "r") as f:
         lines = [line.strip() for line in f if line.strip()]
-        start_time = time.time()
+    start_time = time.time()
+    latencies = []
     for line in lines:
         parts = [p.strip() for p in line.split(',')]
         op = parts[0].lower()
         if op == "insert":
             key = parts[1]
             value = parts[2] if len(parts) > 2 else None
-            node.insert(key, value)
+            if pipeline:
+                track(latencies, pipeline.insert, key, value)
+            else:
+                timed(latencies, node.insert, key, value)
         elif op == "query":
             key = parts[1]
-            node.query(key)
-        end_time = time.time()
-        duration = end_time - start_time
-        throughput = len(lines) / duration if duration > 0 else 0
+            if pipeline:
+                track(latencies, pipeline.query, key)
+            else:
+                timed(latencies, node.query, key)
+    if pipeline:
+        pipeline.drain()
+    end_time = time.time()
+    duration = end_time - start_time
+    throughput = len(lines) / duration if duration > 0 else 0
     with open(output_file, "a") as f:
         f.write(f"[Requests Experiment] {len(lines)} requests in {duration:.2f} seconds, throughput: {throughput:.2f} ops/sec\n")
+    return phase_results(len(lines), duration, latencies)
 
 def wait_for_signal(listening_socket, node):
     """Wait for a 'go' signal from an external coordinator with a timeout."""
@@ -83,11 +144,25 @@ def main():
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description="Unified Experiment Runner for Chord Node")
     parser.add_argument("--node_number", type=int, required=True, help="Node number (e.g., 0, 1, 2, ...)")
-    parser.add_argument("--consistency", choices=["linearizability", "eventual"], default="linearizability", help="Consistency model")
+    parser.add_argument("--consistency", choices=["linearizability", "eventual", "craq"], default="linearizability", help="Consistency model")
     parser.add_argument("--replication", type=int, default=1, help="Replication factor (k)")
     parser.add_argument("--bootstrap_ip", help="Bootstrap node IP (required if node_number != 0)")
-    parser.add_argument("--bootstrap_port", type=int, default=5000, help="Bootstrap node port (default: 5000)")
+    parser.add_argument("--bootstrap_port", type=int, default=5000, help="Bootstrap node port, the one node 0 listens on (default: 5000)")
+    parser.add_argument("--ip", help="IP address the node listens on and advertises (default: the address of the hostname)")
     parser.add_argument("--signal_port", type=int, required=True, help="Port to listen for signals")
+    parser.add_argument("--bulk", action="store_true", help="Load the insert file with batched insert_many calls")
+    parser.add_argument("--concurrency", type=int, default=1, help="Operations kept in flight at once (default: 1, closed loop)")
+    parser.add_argument("--deadline", type=float, default=10, help="Seconds each pipelined operation may take (default: 10)")
+    parser.add_argument("--read_repair_chance", type=float, default=0.1, help="Share of eventual reads compared with a second replica after answering (default: 0.1)")
+    parser.add_argument("--server", choices=["threaded", "asyncio"], default="threaded", help="Node server mode (default: threaded)")
+    parser.add_argument("--storage", choices=["mongodb", "memory"], default="mongodb", help="Node storage engine (default: mongodb)")
+    parser.add_argument("--write_behind", type=float, help="Buffer writes and flush them in batches at least every this many seconds")
+    parser.add_argument("--cache_size", type=int, default=1024, help="Keys kept in each node's read cache, 0 to disable it (default: 1024)")
+    parser.add_argument("--virtual_nodes", type=int, default=1, help="Ring positions each node takes (default: 1)")
+    parser.add_argument("--hot_replicas", type=int, default=2, help="Extra nodes given read-only copies of hot keys in eventual mode, 0 to disable (default: 2)")
+    parser.add_argument("--wire", choices=["binary", "json"], default="binary", help="Message encoding on the wire (default: binary)")
+    parser.add_argument("--trace_sample", type=float, default=0.0, help="Share of operations traced hop by hop, for trace_report.py (default: 0)")
+    parser.add_argument("--migration_rate", type=float, default=5_000_000, help="Bytes per second sent when migrating keys to a joining node, 0 for unlimited (default: 5000000)")
     args = parser.parse_args()
 
     # Validate arguments
@@ -120,6 +195,7 @@ def main():
 
     # Set up socket for listening to signals
     listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Runs may follow each other on the same ports
     try:
         listening_socket.bind(("0.0.0.0", args.signal_port))
         listening_socket.listen(1)
@@ -128,26 +204,47 @@ def main():
         sys.exit(1)
 
     # Initialize and configure the Chord node
-    node = ChordNode(bootstrap_node=bootstrap_node, replication_factor=args.replication, consistency_type=args.consistency)
+    node = ChordNode(port=args.bootstrap_port, bootstrap_node=bootstrap_node, replication_factor=args.replication, consistency_type=args.consistency, server_mode=args.server,
+                     read_repair_chance=args.read_repair_chance, storage_engine=args.storage,
+                     write_behind=args.write_behind, cache_size=args.cache_size,
+                     migration_rate=args.migration_rate, virtual_nodes=args.virtual_nodes,
+                     hot_replicas=args.hot_replicas, wire_format=args.wire,
+                     trace_sample=args.trace_sample, ip=args.ip)
 
     # Start the node's server in a background thread
     server_thread = threading.Thread(target=node.start_server, daemon=True)
     server_thread.start()
     time.sleep(0.5)  # Allow the server time to initialize
 
+    pipeline = RequestPipeline(node, window=args.concurrency, deadline=args.deadline) if args.concurrency > 1 else None
+
     # Clear or create the output file at the start
     with open(output_file, "w") as f:
         f.write("Experiment Results\n\n")
 
     # Run the experiments in sequence, waiting for signals
+    results = {"node_number": node_number, "consistency": args.consistency, "replication": args.replication}
     wait_for_signal(listening_socket, node)
-    run_inserts(insert_file, node, output_file)
+    results["insert"] = run_inserts(insert_file, node, output_file, args.bulk, pipeline)
+    if args.node_number == 0:
+        with open(output_file, "a") as f:
+            for entry in node.load_report():
+                f.write(f"[Load] {entry['ip']}:{entry['port']} owns {entry['owned']} keys, stores {entry['keys']}, "
+                        f"{entry['ring_share']:.1%} of the ring over {entry['virtual_nodes']} virtual nodes\n")
 
     wait_for_signal(listening_socket, node)
-    run_queries(query_file, node, output_file)
+    results["query"] = run_queries(query_file, node, output_file, pipeline)
 
     wait_for_signal(listening_socket, node)
-    run_requests(requests_file, node, output_file)
+    results["requests"] = run_requests(requests_file, node, output_file, pipeline)
+    with open(output_file, "a") as f:
+        stats = node.cache.stats()
+        f.write(f"[Cache] {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, hit ratio: {stats['hit_ratio']:.2%}\n")
+    # Latencies of every phase for benchmark_local.py, and everything the node measured, next to its results
+    Path(output_file).with_suffix(".json").write_text(json.dumps(results))
+    Path(output_file).with_suffix(".prom").write_text(to_prometheus(node.stats()))
+    if args.trace_sample:
+        Path(output_file).with_suffix(".traces.jsonl").write_text("".join(json.dumps(trace) + "\n" for trace in node.traces))
 
 
     # Clean up
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import socket
+import threading
+import pytest
+from benchmark_protocol import realistic_messages
+from chord_protocol import (BINARY_FORMAT, FIELDS, FRAME_HEADER, JSON_FORMAT, MAX_FRAME, RECORD, RECORDS,
+                            MessageReader, decode_message, encode_message, read_message, recv_message)
+
+
+def round_trip(message, wire_format):
+    """Encode a message into a frame and decode its payload again."""
+    frame = encode_message(message, wire_format)
+    version, length = FRAME_HEADER.unpack_from(frame)
+    assert length == len(frame) - FRAME_HEADER.size
+    return decode_message(memoryview(frame)[FRAME_HEADER.size:], version)
+
+
+@pytest.mark.parametrize("wire_format", ["json", "binary"])
+@pytest.mark.parametrize("name", ["query", "insertion", "query_response", "bulk_insertion", "query_all_chunk"])
+def test_realistic_messages_round_trip(name, wire_format):
+    message = realistic_messages(50)[name]
+    assert round_trip(message, wire_format) == message
+
+
+@pytest.mark.parametrize("value", [
+    0, 1, 63, 64, 127, 128, 300, -1, -64, -65, 2**63 - 1, -2**63,  # Small ints and the zigzag varints
+    2**63, 2**64, 2**160 - 1,  # Node ids and key hashes
+    2**160, -2**63 - 1, -2**200,  # Anything larger or more negative
+    0.0, -1.5, 1e300, "", "a", "x" * 127, "x" * 128, "x" * 70000, "héllo ☃", None, True, False,
+    [], {}, [1, [2, [3, None]]], {"nested": {"deeper": [{"key": "value"}]}},
+])
+def test_values_round_trip(value):
+    message = {"type": "test", "value": value}
+    assert round_trip(message, "binary") == message
+
+
+def test_every_field_and_unknown_keys_round_trip():
+    message = {field: index for index, field in enumerate(FIELDS)}
+    message.update({"not_a_field": "kept", "": "empty", "ünïcode": [1, 2]})
+    assert round_trip(message, "binary") == message
+
+
+def test_binary_matches_json():
+    # Tuples become lists and dict keys strings in both formats
+    message = {"type": "test", "version": (3, "node"), "counts": {1: "one", 2: "two"}}
+    assert round_trip(message, "binary") == round_trip(message, "json") == json.loads(json.dumps(message))
+
+
+def test_binary_is_smaller():
+    message = realistic_messages(50)["bulk_insertion"]
+    assert len(encode_message(message, "binary")) < len(encode_message(message, "json"))
+
+
+def test_frame_header_names_the_format():
+    assert FRAME_HEADER.unpack_from(encode_message({"type": "test"}))[0] == BINARY_FORMAT
+    assert FRAME_HEADER.unpack_from(encode_message({"type": "test"}, "json"))[0] == JSON_FORMAT
+
+
+@pytest.mark.parametrize("count", [1, 15, 16, 200])
+def test_records_round_trip(count):
+    # Short lists are packed record by record, long ones column by column
+    items = [{"key": f"sóng {i}", "key_hash": 2**160 - 1 - i, "value": ""} for i in range(count)]
+    members = [{"ip": "10.0.0.1", "port": 5000 + i, "node_id": i, "version": i, "alive": i % 2 == 0} for i in range(count)]
+    documents = [{"key": f"k{i}", "key_hash": str(i), "value": "v", "version": [i, "42"]} for i in range(count)]
+    message = {"type": "bulk_insertion", "key_hash": 7, "times_copied": 0, "sender_ip": "10.0.0.2", "sender_port": 1,
+               "sender_id": 2, "sender_temp_port": 3, "request_id": 4, "items": items, "gossip": members,
+               "documents": documents, "target_id": None}
+    payload = encode_message(message)[FRAME_HEADER.size:]
+    assert payload[0] == RECORD and payload.count(RECORDS) >= 3
+    assert round_trip(message, "binary") == message
+
+
+@pytest.mark.parametrize("items", [
+    [{"key": "k", "key_hash": 1, "value": None}],  # A tombstone has no string value
+    [{"key": "k", "key_hash": 1, "value": "v"}, {"key": "k", "key_hash": 1, "value": "v", "deleted": True}],
+    [{"key": "k", "key_hash": 1, "value": "v"}, {"key": "k", "key_hash": 1, "other": "v"}],
+    [{"key": "a\0b", "key_hash": 1, "value": "v"}] * 20,  # The separator of string columns
+    [{"key": "k", "key_hash": -1, "value": "v"}, {"key": "k", "key_hash": 2**160, "value": "v"}],
+    [{"ip": "h", "port": True, "node_id": 1}, {"ip": "h", "port": 1.5, "node_id": 1}],
+    [{"key": "k", "key_hash": 1, "value": "v"}, 3],
+])
+def test_dicts_that_do_not_fit_a_layout_round_trip(items):
+    message = {"type": "query", "key": 5, "key_hash": None, "items": items}
+    assert round_trip(message, "binary") == message
+
+
+def test_unsupported_values_and_formats_are_rejected():
+    with pytest.raises(TypeError):
+        encode_message({"type": "test", "value": {1, 2}}, "binary")
+    with pytest.raises(ConnectionError):
+        decode_message(b"{}", 99)
+
+
+def test_message_reader_reads_mixed_formats_and_split_frames():
+    messages = [{"type": "query", "key": "k", "key_hash": 2**159 + 7}, {"type": "big", "value": "v" * 100000},
+                {"type": "empty"}]
+    data = b"".join(encode_message(message, wire_format) for message, wire_format in zip(messages, ["binary", "json", "binary"]))
+    sender, receiver = socket.socketpair()
+    try:
+        sizes = []
+        reader = MessageReader(receiver, size=16, on_frame=sizes.append)
+
+        def send():
+            for start in range(0, len(data), 1000):  # Frames arrive cut at arbitrary points
+                sender.sendall(data[start:start + 1000])
+
+        writer = threading.Thread(target=send)
+        writer.start()
+        assert [reader.read() for _ in messages] == messages
+        writer.join()
+        assert sum(sizes) == len(data)
+        sender.close()
+        assert reader.read() is None
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_frames_longer_than_the_limit_are_refused():
+    sender, receiver = socket.socketpair()
+    try:
+        sender.sendall(FRAME_HEADER.pack(BINARY_FORMAT, MAX_FRAME + 1))
+        with pytest.raises(ConnectionError):
+            MessageReader(receiver).read()
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_recv_message_fails_on_a_truncated_frame():
+    sender, receiver = socket.socketpair()
+    try:
+        sender.sendall(encode_message({"type": "query", "key": "k"}, "binary")[:-2])
+        sender.close()
+        with pytest.raises(ConnectionError):
+            recv_message(receiver)
+    finally:
+        receiver.close()
+
+
+def test_read_message_from_an_asyncio_stream():
+    async def read_all(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return [await read_message(reader) for _ in range(3)]
+
+    messages = [{"type": "stats", "stats": {"counters": {}}}, {"type": "query", "key_hash": 2**160 - 1}]
+    data = encode_message(messages[0], "json") + encode_message(messages[1], "binary")
+    assert asyncio.run(read_all(data)) == messages + [None]
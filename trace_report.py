@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import argparse
+import json
+
+# Roles a node can play for a traced request, in the order of the report
+ROLES = ("route", "owner", "replica", "hot_copy")
+STAGES = ("network",) + ROLES + ("storage",)
+
+
+def load_traces(paths):
+    """Read the traces written by run_experiments.py or the traces command, one JSON object per line."""
+    traces = []
+    for path in paths:
+        with open(path) as f:
+            traces.extend(json.loads(line) for line in f if line.strip())
+    return traces
+
+
+def stages(trace):
+    """Split the end-to-end latency of a trace into the seconds spent in every stage.
+
+    network is the time between a node sending the request and the next one starting to handle it, queueing included,
+    from the client to the first node and from the last one back. Each role gets the handling time of its hops minus
+    their storage calls. Timestamps come from the clocks of different nodes, so skew between them moves time between
+    network and the roles, but the stages always add up to the end-to-end latency.
+    """
+    spent = dict.fromkeys(STAGES, 0.0)
+    previous = trace["started"]
+    for hop in trace["hops"]:
+        departed = hop.get("departed", hop["arrived"])
+        spent["network"] += hop["arrived"] - previous
+        spent[hop["role"]] = spent.get(hop["role"], 0.0) + departed - hop["arrived"] - hop["storage"]
+        spent["storage"] += hop["storage"]
+        previous = departed
+    spent["network"] += trace["finished"] - previous
+    return spent
+
+
+def percentile(samples, q):
+    """Return the q-quantile of sorted samples (nearest rank)."""
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0
+
+
+def breakdown(traces):
+    """Aggregate traces by operation type into per-stage and end-to-end latencies, in seconds.
+
+    Returns {type: {"count", "hops", "total": {"mean", "p50", "p99"}, "stages": {stage: {"mean", "p50", "p99", "share"}}}}.
+    """
+    by_type = {}
+    for trace in traces:
+        by_type.setdefault(trace["type"], []).append(trace)
+    report = {}
+    for request_type, group in sorted(by_type.items()):
+        totals = sorted(trace["finished"] - trace["started"] for trace in group)
+        per_stage = [stages(trace) for trace in group]
+        total_mean = sum(totals) / len(totals)
+        report[request_type] = {
+            "count": len(group),
+            "hops": sum(len(trace["hops"]) for trace in group) / len(group),
+            "total": {"mean": total_mean, "p50": percentile(totals, 0.5), "p99": percentile(totals, 0.99)},
+            "stages": {}
+        }
+        roles = {stage for spent in per_stage for stage in spent} - set(STAGES)  # Roles of newer nodes, if any
+        for stage in STAGES + tuple(sorted(roles)):
+            samples = sorted(spent.get(stage, 0.0) for spent in per_stage)
+            if not any(samples):
+                continue
+            mean = sum(samples) / len(samples)
+            report[request_type]["stages"][stage] = {"mean": mean, "p50": percentile(samples, 0.5),
+                                                     "p99": percentile(samples, 0.99),
+                                                     "share": mean / total_mean if total_mean else 0}
+    return report
+
+
+def slowest(traces, count):
+    """Return the count slowest traces, slowest first."""
+    return sorted(traces, key=lambda trace: trace["finished"] - trace["started"], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break the latency of traced operations down by stage")
+    parser.add_argument("files", nargs="+", help="Trace files, e.g. node0*/*.traces.jsonl")
+    parser.add_argument("--slowest", type=int, default=0, help="Also show the hops of this many slowest traces (default: 0)")
+    parser.add_argument("--json", action="store_true", help="Print the breakdown as JSON")
+    args = parser.parse_args()
+
+    traces = load_traces(args.files)
+    if not traces:
+        print("❌ No traces found")
+        return
+    report = breakdown(traces)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for request_type, entry in report.items():
+        total = entry["total"]
+        print(f"\n🧭 {request_type}: {entry['count']} traces, {entry['hops']:.2f} hops on average, "
+              f"mean {total['mean'] * 1000:.2f} ms, p50 {total['p50'] * 1000:.2f} ms, p99 {total['p99'] * 1000:.2f} ms")
+        for stage, spent in entry["stages"].items():
+            print(f"  {stage:<9} mean {spent['mean'] * 1000:8.3f} ms ({spent['share']:6.1%}), "
+                  f"p50 {spent['p50'] * 1000:8.3f} ms, p99 {spent['p99'] * 1000:8.3f} ms")
+    for trace in slowest(traces, args.slowest):
+        print(f"\n🐢 {trace['type']} {trace['trace_id']}: {(trace['finished'] - trace['started']) * 1000:.2f} ms")
+        previous = trace["started"]
+        for hop in trace["hops"]:
+            departed = hop.get("departed", hop["arrived"])
+            print(f"  +{(hop['arrived'] - previous) * 1000:.3f} ms → {hop['role']} {hop['node_id'] // 2**155}: "
+                  f"{(departed - hop['arrived']) * 1000:.3f} ms handling, {hop['storage'] * 1000:.3f} ms storage")
+            previous = departed
+        print(f"  +{(trace['finished'] - previous) * 1000:.3f} ms → response")
+
+
+if __name__ == "__main__":
+    main()